@@ -5,6 +5,7 @@ import sourceProb
 import mags
 import modelRead
 import mapsAtTimeT
+import slotMaps
 
 
 # sims, mjds, distances, models = allMaps.veni(); 
@@ -204,12 +205,12 @@ def vedi2(sims, mjds, distances, do2015=True, doV=False) :
 
         for day in range(0,10) :
             simfile = data_dir+str(sim)+"-"+str(day)+"-map.hp"
-            if not os.path.exists(simfile) : 
+            if day not in slotMaps.madeSlots(data_dir, sim) and not os.path.exists(simfile) : 
                 totalProb = 0.0
             else :
-                ligo = hp.read_map(simfile,verbose=False)
-                simfile = data_dir+str(sim)+"-"+str(day)+"-probMap.hp"
-                decam = hp.read_map(simfile,verbose=False)
+                maps = slotMaps.readSlot(data_dir, sim, day)
+                ligo = maps["map"]
+                decam = maps["probMap"]
                 ligo = ligo/ligo.sum()
                 totalProb = (decam*ligo).sum()
             totalProbs[day].append(totalProb)
@@ -228,19 +229,20 @@ def vedi2(sims, mjds, distances, do2015=True, doV=False) :
 
 
 # Get the saved maps for each day.
+#   prob, sm.prob, is no longer saved and is None
 def readem (simNumber, day) :
-    n=str(simNumber)+"-"+str(day)
+    maps = slotMaps.readSlot("./", simNumber, day)
 
-    ra=hp.read_map(n+"-ra.hp"); 
-    dec=hp.read_map(n+"-dec.hp"); 
-    ha=hp.read_map(n+"-ha.hp"); 
-    map=hp.read_map(n+"-map.hp");
-    maglim=hp.read_map(n+"-maglim.hp");
-    maglimg=hp.read_map(n+"-maglim-global.hp");
-    prob=hp.read_map(n+"-prob.hp");
-    probMap=hp.read_map(n+"-probMap.hp"); 
-    hx=hp.read_map(n+"-hx.hp"); 
-    hy=hp.read_map(n+"-hy.hp");
+    ra=maps["ra"]; 
+    dec=maps["dec"]; 
+    ha=maps["ha"]; 
+    map=maps["map"];
+    maglim=maps["maglim"];
+    maglimg=maps["maglim-global"];
+    prob=None;
+    probMap=maps["probMap"]; 
+    hx=maps["hx"]; 
+    hy=maps["hy"];
     return ra, dec, map, maglim, maglimg, prob, probMap, hx,hy
 
 # Get the saved maps for each day and hour.
@@ -0,0 +1,94 @@
+import numpy as np
+import os
+import hp2np
+
+license="""
+   Copyright (C) 2014 James Annis
+
+   This program is free software; you can redistribute it and/or modify it
+   under the terms of version 3 of the GNU General Public License as
+   published by the Free Software Foundation.
+
+   More to the points- this code is science code: buggy, barely working,
+   with little or no documentation. Science code in the the alpine fast
+   & light style.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program; if not, write to the Free Software
+   Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""
+
+#
+# The auxiliary maps, galactic dust and the probability of recognition
+# (inverse stellar density), are the same for every trigger. Reading the full
+# resolution fits files and ud_grading them is the slow part of making a
+# mags.observed object, so do it once per nside and keep the result in
+# $DESGW_CACHE_DIR as .npy files that are memory mapped on later reads.
+#
+#   nside = 0 is the native resolution of the fits file
+#
+auxMapFiles = {
+    "ebv"    : "plank-ebv-HFI_CompMap_ThermaDustModel.fits",
+    "precog" : "precognize.fits",
+}
+# maps already loaded by this process, keyed by (name, nside)
+auxMapMemo = {}
+
+def auxMapFile (name, nside) :
+    cache_dir = os.getenv("DESGW_CACHE_DIR", "./")
+    if nside == 0 :
+        res = "native"
+    else :
+        res = "{:d}".format(int(nside))
+    return os.path.join(cache_dir, "auxMap-{}-{}.npy".format(name, res))
+
+# return the healpix (ring) map name at nside, read only
+def getAuxMap (name, nside=0, recompute=False, verbose=True) :
+    if name not in auxMapFiles :
+        raise Exception("no such auxiliary map {}".format(name))
+    key = (name, int(nside))
+    if not recompute and key in auxMapMemo :
+        return auxMapMemo[key]
+
+    file = auxMapFile(name, nside)
+    if recompute or not os.path.exists(file) :
+        makeAuxMap(name, nside, verbose=verbose)
+    elif verbose :
+        print "\t reading {} map {}".format(name, file)
+    hp_map = np.load(file, mmap_mode="r")
+    auxMapMemo[key] = hp_map
+    return hp_map
+
+def makeAuxMap (name, nside, verbose=True) :
+    data_dir = os.environ["DESGW_DATA_DIR"]
+    fits_file = data_dir + auxMapFiles[name]
+    if verbose: print "\t building {} map at nside={} from {}".format(name, nside, fits_file)
+    key = (name, 0)
+    if key in auxMapMemo :
+        hp_map = np.asarray(auxMapMemo[key])
+    else :
+        ra,dec,hp_map = hp2np.hp2np(fits_file)
+    if nside != 0 :
+        # averaging, as mags.observed has always done
+        ra,dec,hp_map = hp2np.map2np(hp_map, resolution=int(nside), fluxConservation=False)
+    file = auxMapFile(name, nside)
+    cache_dir = os.path.dirname(file)
+    if cache_dir != "" and not os.path.exists(cache_dir) : os.makedirs(cache_dir)
+    # write then rename, so that a reader never sees a partial file
+    tmp_file = file + ".{}.tmp".format(os.getpid())
+    fd = open(tmp_file, "wb")
+    np.save(fd, hp_map)
+    fd.close()
+    os.rename(tmp_file, file)
+
+# ra, dec in degrees, ra in -180 to 180, and the map, as hp2np.map2np gives
+def auxMap2np (name, nside=0, verbose=True) :
+    hp_map = getAuxMap(name, nside, verbose=verbose)
+    ra,dec,hp_map = hp2np.map2np(hp_map)
+    return ra,dec,hp_map
+
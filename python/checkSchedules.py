@@ -0,0 +1,214 @@
+import sys
+import copy
+import itertools
+import time
+import numpy as np
+import obsSlots
+
+license="""
+   Copyright (C) 2014 James Annis
+
+   This program is free software; you can redistribute it and/or modify it
+   under the terms of version 3 of the GNU General Public License as
+   published by the Free Software Foundation.
+
+   More to the points- this code is science code: buggy, barely working,
+   with little or no documentation. Science code in the the alpine fast
+   & light style.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program; if not, write to the Free Software
+   Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""
+
+#
+# Checks of the schedulers of obsSlots, on made up hexVals:
+#   greedySchedule makes the schedule of greedyRescan, the rescanning 
+#       greedy schedule it replaced
+#   optimalSchedule keeps to the places of each slot, observes each hex at
+#       most once, and has the most summed probability of any schedule
+#       (against every schedule of a small night) and no less than greedySchedule
+# The checks are fixed (seeded) and raise an AssertionError if one fails.
+#
+#   python checkSchedules.py            # the checks
+#   python checkSchedules.py benchmark  # and the time of greedyRescan against greedySchedule
+#
+
+# hexVals for nslots slots, each holding a fraction of nhexes hexes (all sky for
+# decam is 17287), with probabilities rounded so as to have ties
+def madeUpHexData (nhexes, nslots, fraction=0.5, seed=2020) :
+    np.random.seed(seed)
+    hexData = dict()
+    for i in range(0,nslots) :
+        hexIndex, = np.nonzero(np.random.random(nhexes) < fraction)
+        n = hexIndex.size
+        hexVal = np.round(np.random.random(n)*1e-3, 6)
+        hexData[i] = hexIndex*360./nhexes, np.zeros(n), hexIndex.astype(str), hexVal, \
+            np.zeros(n)+58900.+i*0.0223, np.zeros(n)+i, np.zeros(n)+i, hexIndex
+    return hexData
+
+def sameSchedule (a, b, nslots) :
+    for i in range(0,nslots) :
+        for key in ["ra", "dec", "id", "prob", "mjd", "slotNum", "islot"] :
+            if not np.array_equal(a[i,key], b[i,key]) : return False
+    return True
+
+def checkGreedy (nhexes=2000, nslots=8, maxHexesPerSlot=6) :
+    hexData = madeUpHexData(nhexes, nslots)
+    rescan = greedyRescan(copy.deepcopy(hexData), obsSlots.newSlotsObserving(nslots), maxHexesPerSlot)
+    schedule = obsSlots.greedySchedule(hexData, obsSlots.newSlotsObserving(nslots), maxHexesPerSlot)
+    assert sameSchedule(rescan, schedule, nslots), "greedySchedule is not the rescan schedule"
+    print "greedySchedule = greedyRescan: {} slots, {} per slot".format(nslots, maxHexesPerSlot)
+
+# the places of every slot are kept, and no hex is observed twice
+def checkPlaces (schedule, places, nslots) :
+    for i in range(0,nslots) :
+        assert schedule[i] <= obsSlots.slotPlaces(places, i), \
+            "slot {} has {} hexes in {} places".format(i, schedule[i], obsSlots.slotPlaces(places, i))
+    ids = obsSlots.slotsObservingToNpArrays(schedule)[2]
+    assert np.unique(ids).size == ids.size, "a hex is observed twice"
+
+def checkOptimal (nhexes=2000, nslots=8, maxHexesPerSlot=6) :
+    # against greedy, with the same and with per slot places
+    hexData = madeUpHexData(nhexes, nslots)
+    perSlot = dict([(i, i % 4) for i in range(0,nslots)])
+    for places in [maxHexesPerSlot, perSlot] :
+        greedy = obsSlots.greedySchedule(hexData, obsSlots.newSlotsObserving(nslots), places)
+        optimal = obsSlots.optimalSchedule(hexData, obsSlots.newSlotsObserving(nslots), places)
+        checkPlaces(optimal, places, nslots)
+        greedy_prob = obsSlots.slotsObservingToNpArrays(greedy)[3].sum()
+        optimal_prob = obsSlots.slotsObservingToNpArrays(optimal)[3].sum()
+        assert optimal_prob >= greedy_prob - 1e-12, "optimalSchedule is below greedySchedule"
+
+    # against every schedule of a small night: each hex in a slot, or not observed
+    nhexes, nslots = 7, 3
+    hexData = madeUpHexData(nhexes, nslots, fraction=0.7, seed=22)
+    places = {0:2, 1:1, 2:3}
+    optimal = obsSlots.optimalSchedule(hexData, obsSlots.newSlotsObserving(nslots), places)
+    checkPlaces(optimal, places, nslots)
+    value = np.zeros((nhexes, nslots)) - np.inf
+    for i in range(0,nslots) :
+        value[hexData[i][7], i] = hexData[i][3]
+    best = 0.
+    for where in itertools.product(range(-1,nslots), repeat=nhexes) :
+        where = np.array(where)
+        if np.any([np.sum(where == i) > places[i] for i in range(0,nslots)]) : continue
+        observed, = np.nonzero(where > -1)
+        best = max(best, value[observed, where[observed]].sum())
+    optimal_prob = obsSlots.slotsObservingToNpArrays(optimal)[3].sum()
+    assert abs(optimal_prob - best) < 1e-12, \
+        "optimalSchedule {} is not the best schedule {}".format(optimal_prob, best)
+    print "optimalSchedule keeps the places, and is the best schedule"
+
+# ==== time greedyRescan against greedySchedule
+def benchmarkSchedule (nhexes=17287, nslots=20, maxHexesPerSlot=6, fraction=0.5, seed=2020) :
+    hexData = madeUpHexData(nhexes, nslots, fraction, seed)
+    t0 = time.time()
+    rescan = greedyRescan(copy.deepcopy(hexData), obsSlots.newSlotsObserving(nslots), maxHexesPerSlot)
+    t_rescan = time.time() - t0
+    t0 = time.time()
+    schedule = obsSlots.greedySchedule(hexData, obsSlots.newSlotsObserving(nslots), maxHexesPerSlot)
+    t_schedule = time.time() - t0
+    same = sameSchedule(rescan, schedule, nslots)
+    ncandidates = np.sum([hexData[i][3].size for i in hexData.keys()])
+    print "{} slots, {} candidates, {} per slot:".format(nslots, ncandidates, maxHexesPerSlot),
+    print "rescan {:.3f} s, schedule {:.3f} s, x{:.1f}, same schedule: {}".format(
+        t_rescan, t_schedule, t_rescan/t_schedule, same)
+    return t_rescan, t_schedule, same
+
+#
+# The greedy schedule by rescanning, as obsSlots.observing once made it,
+# to check and time greedySchedule against. It deletes from hexData as it goes.
+#
+def greedyRescan (hexData, slotsObserving, maxHexesPerSlot, verbose=0) :
+    nslots     = slotsObserving["nslots"]
+    mapZero    = slotsObserving["mapZero"]
+    do_nslots  = slotsObserving["do_nslots"]
+    start_slot = slotsObserving["start_slot"]
+    observingSlots = np.arange(0,nslots)
+
+    # start the search for all max probabilities
+    # we'll assume the list is less than 40,000 long, the n-sq-degrees/sky
+    for n in range(0,40000) :
+        # search for a single max probabilities
+        maxRa, maxDec, maxId, maxProb, maxMjd, maxSlotNum, maxIslot, maxIndex  = \
+            obsSlots.findMaxProbOfAllHexes(hexData, slotsObserving, observingSlots, n, verbose) 
+        maxData = maxRa,maxDec,maxId, maxProb,maxMjd,maxSlotNum, maxIslot
+
+        # we've found the maximum probability on the lists, 
+        # so add it to the obs lists # unless not possible. 
+        # If the latter, delete it from that slot
+        slot = maxIslot
+        # if slot is -1, then no max prob found
+        if slot > -1 :  
+            if slotsObserving[slot] < maxHexesPerSlot : 
+                # it is possible to make the observation, 
+                # put it onto the observing lists
+                slotsObserving = obsSlots.addObsToSlot (slotsObserving, maxData, slot)
+                if verbose >= 1: print n, "slot of max:",slot
+            else :
+                # but if this slot of observing is full, it is not possible 
+                # to make the observation,
+                # so move on AFTER deleting it from the list
+                hexData = obsSlots.deleteHexFromSlot (hexData, slot, maxProb) 
+        #if verbose >= 2: 
+        #   if n > 7: raise Exception("jack")
+    
+        # perform the necessary bookkeeping, 
+        # eliminating this hex from future observing
+        hexData = obsSlots.deleteHexFromAllSlots (
+            hexData, slotsObserving, observingSlots, maxIndex, verbose, n) 
+
+        # do some summary statistics
+        sumHexes = 0
+        sumObs = 0
+        for i in range(0,nslots) :
+# JTA 6
+            if start_slot > -1 and do_nslots > -1 :
+                if i+mapZero < start_slot or i+mapZero >= start_slot+do_nslots : continue
+            sumHexes += hexData[i][0].size
+            sumObs += slotsObserving[i]
+
+        if verbose >= 2: 
+            print "sumHexes =", sumHexes, 
+            print "   slots left=", len(observingSlots),
+            print "   slots=",observingSlots,
+            print "   n_obs=",
+            for i in observingSlots:
+                print slotsObserving[i],
+            print "   sum prob= ",
+            for i in observingSlots:
+                print " {:8.6f}".format( slotsObserving[i,"prob"].sum()) ,
+            print ""
+
+        # eliminate full observing slots
+        observingSlots = obsSlots.eliminateFullObservingSlots(\
+            hexData, slotsObserving, observingSlots, maxHexesPerSlot, verbose) 
+
+        # check and see if we are done
+        # two conditions: observing is full, or candidates empty
+        if (len(observingSlots)==0) | (sumHexes == 0) :
+            print "\t======================================== "
+            if verbose >= 1: 
+                print "n slots =", len(observingSlots)," == 0?"
+                print "sumHexes = ", sumHexes, "==? 0"
+            print "\tnumber of hexes possible to observe = ", sumObs
+            print "\t======================================== "
+            return slotsObserving 
+
+        # otherwise, go back and do it again
+    
+    # we've done everything on the lists, we can observe it all,
+    # return this great success that will never be reached.
+    return slotsObserving
+
+if __name__ == "__main__" :
+    checkGreedy()
+    checkOptimal()
+    if "benchmark" in sys.argv[1:] :
+        benchmarkSchedule()
@@ -25,19 +25,29 @@ def probability_covered(ra,dec,vals, area, nside, max_area) :
 
 def contour_sum(ra, dec, vals, threshold) :
     ix = np.argsort(vals)[::-1] ;# descending order
-    ra_sort = ra[ix]
-    dec_sort = dec[ix]
     vals_sort = vals[ix]
 
-    cumulative = 0
-    i = 0
-    while cumulative < threshold and i < ra.size :
-        cumulative +=  vals_sort[i]
-        i += 1
-    if i == ra.size :
-        i -= 1
+    # the number of pixels summed before the cumulative reaches threshold
+    cumulative_sum = np.cumsum(vals_sort)
+    i = np.searchsorted(cumulative_sum, threshold, side="left") + 1
+    if threshold <= 0 :
+        i, cumulative = 0, 0
+    elif i >= ra.size :
+        i = ra.size - 1
+        cumulative = cumulative_sum[-1]
         print "\t contour_sim: ",
         print " npix set to max as sum < threshold, ",
         print "{:.2f}<{:.2f} ".format(vals.sum(),threshold)
-    npixels =ra_sort[:i].size 
+    else :
+        cumulative = cumulative_sum[i-1]
+    npixels = i
     return npixels,cumulative
+
+# the pixels of the credible region holding a fraction level of the probability,
+# in increasing pixel order
+def credibleRegion(vals, level) :
+    ix = np.argsort(vals)[::-1] ;# descending order
+    cumulative_sum = np.cumsum(vals[ix])
+    npix = np.searchsorted(cumulative_sum, level*cumulative_sum[-1], side="left") + 1
+    npix = min(npix, vals.size)
+    return np.sort(ix[:npix])
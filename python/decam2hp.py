@@ -1,6 +1,8 @@
 import numpy as np
+import os
 import matplotlib.path
 import scipy.spatial
+import scipy.sparse
 
 # the intent is that these two main routines,
 #   hexesOnMap & hexalateMap
@@ -23,7 +25,8 @@ def countData (ligo_map_name) :
     tree = treedata[2]
     return ra,dec,vals,tree
 def countLigoProb (hexRa, hexDec, ra,dec,vals,tree, giveProbs=False) :
-    probs = hexalateMapWithoutOverlap(ra,dec,vals,tree, hexRa, hexDec, "decam")
+    matrix = hexMembership(ra, dec, tree, hexRa, hexDec, "decam")
+    probs = hexalateFirstOwner(matrix, vals)
     print probs
     if giveProbs:
         return probs
@@ -74,26 +77,255 @@ def hexalateMap(ra, dec, vals, tree, raHexen, decHexen,  camera, verbose=1) :
             hexVal[i] = 0
     return hexVal
 
+#
+# The hexalation as a sparse matrix.
+#   hexMembership returns a (n hexes x n pixels) csr matrix which
+#   is 1 where a pixel is inside the camera outline of a hex.
+#   Then hexalating a map is a single mat-vec:
+#       hexVals = matrix.dot(vals)
+#   which gives the same answer as hexalateMap.
+#
+def hexMembership(ra, dec, tree, raHexen, decHexen, camera, verbose=0) :
+    if verbose : print "\t hexMembership \t nhex = {},".format(raHexen.size),
+    if verbose: print " npix = {}".format(ra.size)
+    rows = []
+    cols = []
+    for i in range(0,raHexen.size) :
+        ix = radecInHex( raHexen[i], decHexen[i], ra, dec, tree, camera)
+        if not ix.size: continue
+        rows.append(np.zeros(ix.size, dtype=np.int64) + i)
+        cols.append(ix.astype(np.int64))
+    if len(rows) > 0 :
+        rows = np.concatenate(rows)
+        cols = np.concatenate(cols)
+    else :
+        rows = np.zeros(0, dtype=np.int64)
+        cols = np.zeros(0, dtype=np.int64)
+    matrix = scipy.sparse.csr_matrix((np.ones(rows.size), (rows, cols)), 
+        shape=(raHexen.size, ra.size))
+    matrix.sort_indices()
+    return matrix
+
+# the same, using the exact spherical footprints of radecInHexSpherical.
+#   If fractional, the matrix entries are the fraction of each pixel inside 
+#   the camera outline rather than 1.
+def hexMembershipSpherical(nside, raHexen, decHexen, camera, fractional=False, verbose=0) :
+    import healpy as hp
+    if verbose : print "\t hexMembershipSpherical \t nhex = {},".format(raHexen.size),
+    if verbose: print " nside = {}".format(nside)
+    rows = []
+    cols = []
+    weights = []
+    for i in range(0,raHexen.size) :
+        ix, w = radecInHexSpherical( raHexen[i], decHexen[i], nside, camera, fractional=fractional)
+        if not ix.size: continue
+        rows.append(np.zeros(ix.size, dtype=np.int64) + i)
+        cols.append(ix.astype(np.int64))
+        weights.append(w)
+    if len(rows) > 0 :
+        rows = np.concatenate(rows)
+        cols = np.concatenate(cols)
+        weights = np.concatenate(weights)
+    else :
+        rows = np.zeros(0, dtype=np.int64)
+        cols = np.zeros(0, dtype=np.int64)
+        weights = np.zeros(0)
+    matrix = scipy.sparse.csr_matrix((weights, (rows, cols)), 
+        shape=(raHexen.size, hp.nside2npix(nside)))
+    matrix.sort_indices()
+    return matrix
+
+# the all sky hex to pixel matrix depends only on the hex file (i.e., camera) and nside,
+# so build it once and keep it on disk. 
+#   rows are in the order of the hexes in hexFile, as read by hexalate.getHexCenters
+#   columns are healpix pixels in ring order
+#   footprint = "flat"  is the Sanson-Flamsteed outline of radecInHex
+#   footprint = "spherical" is the exact outline of radecInHexSpherical
+#   footprint = "fractional" is the same, weighted by the pixel fraction inside the outline
+def hexPixelMatrix(camera, nside, hexFile="", footprint="flat", recompute=False, verbose=True) :
+    import healpy as hp
+    import hexalate
+    if hexFile == "" :
+        hexFile = os.environ["DESGW_DATA_DIR"] + "all-sky-hexCenters-"+camera+".txt"
+    cache_dir = os.getenv("DESGW_CACHE_DIR", "./")
+    stem = os.path.splitext(os.path.basename(hexFile))[0]
+    if footprint == "flat" :
+        file = "hexPixelMatrix-{}-{}-{}.npz".format(stem, camera, int(nside))
+    elif footprint == "spherical" or footprint == "fractional" :
+        file = "hexPixelMatrix-{}-{}-{}-{}.npz".format(stem, camera, int(nside), footprint)
+    else :
+        raise Exception("no such footprint {}".format(footprint))
+    file = os.path.join(cache_dir, file)
+    if not recompute and os.path.exists(file) :
+        if verbose: print "\t reading hex-pixel matrix {}".format(file)
+        return scipy.sparse.load_npz(file)
+
+    if verbose: print "\t building {} hex-pixel matrix for {} at nside={}".format(
+        footprint, camera, nside)
+    raHexen, decHexen, idHexen = hexalate.getHexCenters(hexFile)
+    matrix = hexMembershipAtNside(int(nside), raHexen, decHexen, camera, footprint)
+    if not os.path.exists(cache_dir) : os.makedirs(cache_dir)
+    scipy.sparse.save_npz(file, matrix)
+    return matrix
+
+# the hex-pixel matrix of the given hexes at nside, for any footprint
+def hexMembershipAtNside(nside, raHexen, decHexen, camera, footprint="flat") :
+    import healpy as hp
+    if footprint == "flat" :
+        theta,phi = hp.pix2ang(int(nside), np.arange(hp.nside2npix(int(nside))))
+        ra = phi*360./2./np.pi
+        dec = 90-theta*360./2./np.pi
+        treedata = buildtree(ra, dec, nsides=int(nside), recompute=True)
+        ra, dec, tree = treedata[0], treedata[1], treedata[2]
+        matrix = hexMembership(ra, dec, tree, raHexen, decHexen, camera)
+    else :
+        matrix = hexMembershipSpherical(int(nside), raHexen, decHexen, camera, 
+            fractional=(footprint == "fractional"))
+    return matrix
+
+#
+# The working set of a map: the pixels of the credible region holding
+# a fraction level of the probability in ligo (see cumul.credibleRegion),
+# the candidate hexes (the hexes of the hex file whose camera outline can reach
+# the credible region), and all the pixels of the candidate hexes.
+#   returns pixels, the candidate rows of the hex file, 
+#   and the candidate hex-pixel matrix with columns restricted to pixels
+def credibleWorkingSet(ligo, level, camera, hexFile="", footprint="flat", verbose=True) :
+    import healpy as hp
+    import cumul
+    import hexCatalog
+    nside = hp.npix2nside(ligo.size)
+    catalog = hexCatalog.getHexCatalog(camera, hexFile)
+    region = cumul.credibleRegion(ligo, level)
+
+    # hex centers within a camera radius plus a pixel of a credible pixel
+    radius = cameraOutlineRadius(camera) + hp.nside2resol(nside, arcmin=True)/60.
+    chord = 2*np.sin(radius*np.pi/180./2.)
+    regionTree = scipy.spatial.cKDTree(np.array(hp.pix2vec(nside, region)).T)
+    distance, ix = regionTree.query(catalog.xyz, distance_upper_bound=chord)
+    candidates, = np.nonzero(np.isfinite(distance))
+
+    matrix = hexMembershipAtNside(nside, catalog.ra[candidates], catalog.dec[candidates],
+        camera, footprint)
+    pixels = np.union1d(region, np.unique(matrix.indices))
+    matrix = matrix[:,pixels].tocsr()
+    matrix.sort_indices()
+    if verbose :
+        print "\t working set: {:.4f} credible region of {} pixels, {} with margin, {} hexes".format(
+            level, region.size, pixels.size, candidates.size)
+    return pixels, candidates, matrix
+
+#
+# Coarse to fine hexalation for high resolution maps.
+#
+# At high nside the all sky hex-pixel matrix is expensive to build, while
+# most hexes have no probability. So hexalate the night's probCube
+# (n slots x n pixels, ring) at coarse_nside with the (cached) coarse matrix,
+# keep the hexes whose value in any slot is >= fraction * the max hex value,
+# along with their neighbors within a coarse pixel, and build the fine
+# matrix rows only for those. The dropped hexes get empty rows, hence zero value.
+#   rows selects the hexes of the hex file to use, as in mapsAtTimeT
+# The error bound is the coarse hexalated probability of the dropped hexes;
+# if validate, the full resolution matrix is built and compared as well.
+def multiresHexPixelMatrix(camera, nside, probCube, hexFile="", footprint="flat",
+        coarse_nside=32, fraction=1e-4, rows=None, validate=False, verbose=True) :
+    import healpy as hp
+    import hexCatalog
+    catalog = hexCatalog.getHexCatalog(camera, hexFile)
+    if rows is None : rows = catalog.index
+    probCube = np.atleast_2d(probCube)
+
+    coarse = hexPixelMatrix(camera, coarse_nside, catalog.hexFile, 
+        footprint=footprint, verbose=verbose)[rows]
+    # summing the probability into the coarse pixels
+    coarseCube = np.array([hp.ud_grade(p, coarse_nside, power=-2) for p in probCube])
+    coarseVals = coarse.dot(coarseCube.T)
+    hexMax = coarseVals.max(axis=1)
+    keep = hexMax >= fraction*hexMax.max()
+    if hexMax.max() <= 0 : keep[:] = False
+    # the coarse pixels smear the probability by about a pixel
+    near = catalog.neighbors(rows[keep], hp.nside2resol(coarse_nside, arcmin=True)/60.)
+    keep = keep | np.in1d(rows, near)
+    kept, = np.nonzero(keep)
+
+    fine = hexMembershipAtNside(int(nside), catalog.ra[rows[kept]], catalog.dec[rows[kept]],
+        camera, footprint)
+    # put the fine rows back in place among all the rows
+    place = scipy.sparse.csr_matrix((np.ones(kept.size), (kept, np.arange(kept.size))),
+        shape=(rows.size, kept.size))
+    matrix = place.dot(fine).tocsr()
+    matrix.sort_indices()
+
+    report = dict()
+    report["n_kept"] = kept.size
+    report["n_hexes"] = rows.size
+    report["dropped_sum"] = coarseVals[~keep].sum(axis=0)
+    report["dropped_max"] = 0.
+    if kept.size < rows.size : report["dropped_max"] = hexMax[~keep].max()
+    if verbose :
+        print "\t multires hexalation: kept {} of {} hexes at nside {} from nside {}".format(
+            kept.size, rows.size, nside, coarse_nside)
+        print "\t\t dropped hexes: max coarse hex prob {:.3e}, max summed over a slot {:.3e}".format(
+            report["dropped_max"], report["dropped_sum"].max())
+    if validate :
+        full = hexPixelMatrix(camera, nside, catalog.hexFile, footprint=footprint,
+            verbose=verbose)[rows]
+        fullVals = full.dot(probCube.T)
+        diff = fullVals - matrix.dot(probCube.T)
+        report["validate_max"] = np.abs(diff).max()
+        report["validate_sum"] = diff.sum(axis=0)
+        if verbose :
+            print "\t\t validation against full nside {}: max hex error {:.3e}, ".format(
+                nside, report["validate_max"]),
+            print "max slot error {:.3e}".format(np.abs(report["validate_sum"]).max())
+    return matrix, report
+
 def hexalateMapWithoutOverlap(ra, dec, vals, tree, raHexen, decHexen,  camera, verbose=1) :
     #the order of the raHexen,decHexen will determine which hex has priority on the sky.
     #the first hex grabs all the ixs, then next one doesnt get those sky pixels inside the first hex
     if verbose : print "\t hexalateMap \t nhex = {},".format(raHexen.size),
     if verbose: print " npix = {}".format(ra.size)
-    hexVal = np.zeros(raHexen.size)
-    counter = 0
-    ixs = []
-    pixelsused = np.array(np.zeros(ra.size),dtype='bool')
-    for i in range(0,raHexen.size) :
-        ix = radecInHex( raHexen[i], decHexen[i], ra, dec, tree, camera)
-        #print('Inside hexalateMap, checking ixs',ix)
-        if not ix.size: continue
-        try  :
-            slicePixelsUsed = np.invert(pixelsused)[ix]
-            hexVal[i] = vals[ix][slicePixelsUsed].sum()
-            pixelsused[ix] = True
-        except Exception:
-            print "why are there exceptions in hexalateMap?"
-            hexVal[i] = 0
+    matrix = hexMembership(ra, dec, tree, raHexen, decHexen, camera)
+    hexVal = hexalateFirstOwner(matrix, vals)
+    return hexVal
+
+#
+# The without overlap hexalation, done on arrays.
+#   The order of the rows of the hex-pixel matrix is the priority order
+#   of the hexes: each pixel belongs to the first (lowest row) hex that covers it,
+#   and a hex's value is the sum over the pixels it owns.
+#
+# firstOwner returns the row of the owning hex for every pixel, -1 if no hex covers it
+def firstOwner(matrix, giveWeights=False) :
+    coo = matrix.tocoo()
+    # a stable sort on pixel number keeps the rows of each pixel in increasing order
+    order = np.argsort(coo.col, kind="mergesort")
+    rows = coo.row[order]
+    cols = coo.col[order]
+    first = np.ones(cols.size, dtype=bool)
+    first[1:] = cols[1:] != cols[:-1]
+    owner = np.zeros(matrix.shape[1], dtype=np.int64) - 1
+    owner[cols[first]] = rows[first]
+    if giveWeights :
+        # the matrix entry of the owner: 1, or the pixel fraction for fractional footprints
+        weight = np.zeros(matrix.shape[1])
+        weight[cols[first]] = coo.data[order][first]
+        return owner, weight
+    return owner
+
+# the same as a sparse matrix, one entry per owned pixel, so that
+# many maps can be done at once: ownerMatrix(matrix).dot(maps)
+def ownerMatrix(matrix) :
+    owner, weight = firstOwner(matrix, giveWeights=True)
+    ix, = np.nonzero(owner > -1)
+    owners = scipy.sparse.csr_matrix((weight[ix], (owner[ix], ix)), 
+        shape=matrix.shape)
+    return owners
+
+def hexalateFirstOwner(matrix, vals) :
+    owner, weight = firstOwner(matrix, giveWeights=True)
+    ix = owner > -1
+    hexVal = np.bincount(owner[ix], weights=vals[ix]*weight[ix], minlength=matrix.shape[0])
     return hexVal
 
 '''
@@ -121,14 +353,7 @@ def sumHexalatedMap(ra, dec, vals, tree, raHexen, decHexen,  camera, verbose=1)
 # the camera outline for the hex 
 
 def radecInHex ( raCenter, decCenter, ra,dec,tree, camera,mapCenter= 0.) :
-    if camera == 'decam':
-        camera_radius = 1.1
-    elif camera == 'hsc':
-        camera_radius = 0.75
-    elif camera == 'desi':
-        camera_radius = 1.59
-    else: 
-        raise Exception('No such camera')
+    camera_radius = cameraRadius(camera)
     radius = camera_radius + 0.1
     sf_scale = 2.6 *np.abs(decCenter)/90. ;# the distortion at high dec means we need wider "circle"
     radius += sf_scale
@@ -150,6 +375,83 @@ def radecInHex ( raCenter, decCenter, ra,dec,tree, camera,mapCenter= 0.) :
 
 
 
+#
+# Exact spherical camera footprints on healpix.
+#
+# The camera outlines of cameraOutlineAtZero are focal plane offsets in degrees
+# about ra,dec = 0,0. Rotate the pixels so that the hex center sits at 0,0
+# and use the gnomonic (tangent plane) projection there: the outline edges are great
+# circles, which are straight lines in the gnomonic projection, so the point in polygon
+# test is exact at all decs. The circular cameras are a cut on the angular distance.
+# There is no search radius fudge; the candidates come from healpy.query_disc.
+#
+# returns the ring pixel numbers inside the footprint, and the weight of each:
+#   1, or if fractional the fraction of the pixel inside the outline, found by
+#   testing the centers of the 4**subdivide nested sub-pixels of each pixel
+def radecInHexSpherical (raCenter, decCenter, nside, camera, fractional=False, subdivide=3) :
+    import healpy as hp
+    camera_radius = cameraRadius(camera)
+    max_radius = cameraOutlineRadius(camera)*2*np.pi/360.
+
+    center = hp.ang2vec(raCenter, decCenter, lonlat=True)
+    pixels = hp.query_disc(nside, center, max_radius, inclusive=fractional)
+    if not pixels.size: return pixels, np.zeros(0)
+
+    if not fractional :
+        x,y,z = hp.pix2vec(nside, pixels)
+        inside = insideSphericalOutline(raCenter, decCenter, x,y,z, camera, camera_radius)
+        pixels = pixels[inside]
+        return pixels, np.ones(pixels.size)
+
+    nsub = 4**subdivide
+    nest = hp.ring2nest(nside, pixels)
+    subpixels = (nest[:,np.newaxis]*nsub + np.arange(nsub)).flatten()
+    x,y,z = hp.pix2vec(nside*2**subdivide, subpixels, nest=True)
+    inside = insideSphericalOutline(raCenter, decCenter, x,y,z, camera, camera_radius)
+    fraction = inside.reshape(pixels.size, nsub).mean(axis=1)
+    ix = fraction > 0
+    return pixels[ix], fraction[ix]
+
+# the radius in degrees of the camera: the circle of the circular cameras,
+# and about that of the decam hex
+def cameraRadius (camera) :
+    if camera == 'decam':
+        camera_radius = 1.1
+    elif camera == 'hsc':
+        camera_radius = 0.75
+    elif camera == 'desi':
+        camera_radius = 1.59
+    else: 
+        raise Exception('No such camera')
+    return camera_radius
+
+# the radius in degrees of the smallest circle about the hex center holding the camera outline
+def cameraOutlineRadius (camera) :
+    outline_ra, outline_dec = cameraOutlineAtZero(camera)
+    return np.sqrt(outline_ra**2 + outline_dec**2).max()*1.0001
+
+# are the unit vectors x,y,z inside the camera outline centered at raCenter, decCenter?
+def insideSphericalOutline (raCenter, decCenter, x, y, z, camera, camera_radius) :
+    degToRad = 2*np.pi/360.
+    a = raCenter*degToRad
+    d = decCenter*degToRad
+    # rotate about z by -ra, then about y by dec: the hex center goes to x=1
+    xp = x*np.cos(a) + y*np.sin(a)
+    yp = -x*np.sin(a) + y*np.cos(a)
+    xpp = xp*np.cos(d) + z*np.sin(d)
+    zpp = -xp*np.sin(d) + z*np.cos(d)
+    if camera == 'decam' :
+        front = xpp > 0
+        gx = np.zeros(x.size); gy = np.zeros(x.size)
+        gx[front] = yp[front]/xpp[front]
+        gy[front] = zpp[front]/xpp[front]
+        outline_ra, outline_dec = cameraOutlineAtZero(camera)
+        path = matplotlib.path.Path(zip(outline_ra*degToRad, outline_dec*degToRad))
+        inside = np.array(path.contains_points(zip(gx, gy))) & front
+    else :
+        inside = xpp >= np.cos(camera_radius*degToRad)
+    return inside
+
 #
 # Use a circle of area pi sq-degrees as a reasonable
 # approximation to the camera outline.
@@ -21,9 +21,12 @@ license="""
    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 """
 
-def dustTransmission(filter, ebv) :
+# relative to the least ebv, that of the map's pixels unless ebv_min is given
+# (the full sky's, for a map restricted to a working set)
+def dustTransmission(filter, ebv, ebv_min=None) :
     A = dustA(filter)
-    dustTransmission = 10**(-0.4*A*(ebv - ebv.min()))
+    if ebv_min is None : ebv_min = ebv.min()
+    dustTransmission = 10**(-0.4*A*(ebv - ebv_min))
     return dustTransmission
 
 def dustA(filter) :
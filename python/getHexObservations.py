@@ -60,7 +60,10 @@ import warnings
 #
 #   exposure_length is only used in the computation of the limiting mag map
 #
-def make_maps(gw_map_trigger, gw_map_strategy, gw_map_control, gw_map_results) :
+#   obs, the mags.observed of an earlier make_maps of the same skymap (it is
+#   returned), is moved to this night rather than read and made again
+#
+def make_maps(gw_map_trigger, gw_map_strategy, gw_map_control, gw_map_results, obs=None) :
     import mapsAtTimeT
     import mags
     import modelRead
@@ -106,6 +109,11 @@ def make_maps(gw_map_trigger, gw_map_strategy, gw_map_control, gw_map_results) :
     print ", calculation starting at  sunset --- with an additional {:.1f} days added\n".format(
          days_since_burst)
     start_mjd = start_mjd + days_since_burst
+    # the night the slots are in, for the sunset and sunrise (mags.darkInterval
+    # takes the night of int(mjd)); a campaign night starts a few minutes 
+    # before 0h of its own date, a whole number of sidereal days after the first
+    night_mjd = getattr(gw_map_trigger, "night_mjd", None)
+    if night_mjd is None : night_mjd = start_mjd
 
     if snarf_mi_maps:
         if mi_map_dir == "/data/des41.a/data/desgw/O3FULL/Main-Injector/OUTPUT/O3REAL/":
@@ -113,6 +121,8 @@ def make_maps(gw_map_trigger, gw_map_strategy, gw_map_control, gw_map_results) :
         # get everything we need from a different directory
         print "copying from {}/ to {}/".format(mi_map_dir, data_dir)
         os.system("cp {}/*hp {}/".format(mi_map_dir, data_dir))
+        os.system("cp -r {}/*-slotMaps {}/".format(mi_map_dir, data_dir))
+        os.system("cp -r {}/*-hexValStore {}/".format(mi_map_dir, data_dir))
         os.system("cp {}/*probabilityTimeCache*txt {}/".format(mi_map_dir, data_dir))
         os.system("cp {}/*-hexVals.txt {}/".format(mi_map_dir, data_dir))
         os.system("cp {}/*-hexVals-cutOverlappingProb.txt {}/".format(mi_map_dir, data_dir))
@@ -129,6 +139,8 @@ def make_maps(gw_map_trigger, gw_map_strategy, gw_map_control, gw_map_results) :
     for f in files: os.remove(f)
     files = glob.glob(data_dir+"/*hp"); 
     for f in files: os.remove(f)
+    files = glob.glob(data_dir+"/*-slotMaps"); 
+    for f in files: shutil.rmtree(f)
     files = glob.glob(data_dir+"/*txt"); 
     for f in files: os.remove(f)
     files = glob.glob(data_dir+"/*pickle"); 
@@ -137,8 +149,9 @@ def make_maps(gw_map_trigger, gw_map_strategy, gw_map_control, gw_map_results) :
 
 # we need to understand the night, how long it is, etc
     print "\t obs slots starting"
-    answers = obsSlots.slotCalculations( start_mjd, exposure_list, tiling_list, 
-        overhead, hexesPerSlot=maxHexesPerSlot, camera=camera) 
+    answers = obsSlots.slotCalculations( night_mjd, exposure_list, tiling_list, 
+        overhead, hexesPerSlot=maxHexesPerSlot, camera=camera,
+        slew=gw_map_control.slew_order) 
     hoursPerNight = answers["hoursPerNight"] ;# in minutes
     slotDuration = answers["slotDuration"] ;# in minutes
     deltaTime = slotDuration/(60.*24.) ;# in days
@@ -148,15 +161,17 @@ def make_maps(gw_map_trigger, gw_map_strategy, gw_map_control, gw_map_results) :
 
     #  ==== run Rob's evaluate the kasen sim universe code
     print "\t examining Kasen universe KN models for coverage"
-    night_dur,sunset,sunrise = mags.findNightDuration(start_mjd, camera)
+    night_dur,sunset,sunrise = mags.findNightDuration(night_mjd, camera)
     midnight_since_burst = 24*(sunset+night_dur/2. - burst_mjd) 
+    # the kn plots are made in the background while the maps are set up
+    kn_plotters = []
     try: ## ag  test to see if we can get past this spot. sept 6 2022
         apparent_mag = kasen_modelspace.run_ap_mag_for_kasen_models (
             working_filter,
             distance, dist_err, 
             midnight_since_burst,
             kasen_fraction, data_dir,
-            fast = False)
+            fast = False, plotters=kn_plotters)
         print "\t\t at a time halfway through night, {:.2f} days after merger:".format(midnight_since_burst/24.)
         print "\t\t {}% requires observations at {} <= {:5.2f}\n".format(kasen_fraction, filter_list[0], apparent_mag)
     except:
@@ -166,26 +181,15 @@ def make_maps(gw_map_trigger, gw_map_strategy, gw_map_control, gw_map_results) :
     # ==== get the neutron star explosion models
     #models = modelRead.getModels()
 
-    # === prep the maps
-    print("map inputs:skymap, res",skymap, resolution)
-    ra,dec,ligo=hp2np.hp2np(skymap, degrade=resolution, field=0)
-    ligo_dist, ligo_dist_sig, ligo_dist_norm  = \
-        distance*np.ones(ra.size), np.zeros(ra.size), np.zeros(ra.size)
-    warnings.filterwarnings("error")
-    try :
-        junk,junk,ligo_dist =hp2np.hp2np(skymap, degrade=resolution, field=1)
-        junk,junk,ligo_dist_sig =hp2np.hp2np(skymap, degrade=resolution, field=2)
-        junk,junk,ligo_dist_norm =hp2np.hp2np(skymap, degrade=resolution, field=3)
-    except RuntimeWarning:
-        pass
-    except:
-        print "\t !!!!!!!! ------- no distance information in skymap ------ !!!!!!!!"
-
-    # details of the observations
-    print("obs input:ra,dec,start_mjd,camera ", ra,dec, start_mjd, camera)
-    obs = mags.observed(ra,dec,ligo, start_mjd, camera=camera, verbose=False)
+    if obs is None :
+        obs = make_observed(gw_map_trigger, gw_map_strategy, gw_map_control, start_mjd)
+    else :
+        print "\t reusing the maps, moving to ", start_mjd
+        obs.resetNight(start_mjd)
     obs.limitMag(working_filter,exposure=summed_exposure_time)
     print "finished setting up exposure calculation"
+    # the kn plots are written before the pool of the night forks
+    for plotter in kn_plotters : plotter.join()
 
     # ==== calculate maps during a full night of observing
     # essentially, give me the total prob, source + ligo for a 1 filter pass
@@ -213,7 +217,105 @@ def make_maps(gw_map_trigger, gw_map_strategy, gw_map_control, gw_map_results) :
     pickle.dump(made_maps_list, open("made_maps.pickle","wb"))
     pickle.dump(gw_map_results, open("gw_map_results.pickle","wb"))
 
-    return 
+    return obs
+
+# the mags.observed of the skymap at start_mjd, on the working set if there is one
+def make_observed(gw_map_trigger, gw_map_strategy, gw_map_control, start_mjd) :
+    import mags
+    skymap               = gw_map_trigger.skymap
+    distance             = gw_map_trigger.distance
+    camera               = gw_map_strategy.camera
+    resolution           = gw_map_control.resolution
+
+    # === prep the maps
+    print("map inputs:skymap, res",skymap, resolution)
+    # a multi-order skymap is read and rasterized once, all its columns at once
+    isMOC = hp2np.isMOC(skymap)
+    if isMOC :
+        ra,dec,moc_maps = hp2np.readMOC(skymap, nside=resolution)
+        ligo = moc_maps[0]
+    else :
+        ra,dec,ligo=hp2np.hp2np(skymap, degrade=resolution, field=0)
+    ligo_dist, ligo_dist_sig, ligo_dist_norm  = \
+        distance*np.ones(ra.size), np.zeros(ra.size), np.zeros(ra.size)
+    warnings.filterwarnings("error")
+    try :
+        if isMOC :
+            ligo_dist, ligo_dist_sig, ligo_dist_norm = moc_maps[1:4]
+        else :
+            junk,junk,ligo_dist =hp2np.hp2np(skymap, degrade=resolution, field=1)
+            junk,junk,ligo_dist_sig =hp2np.hp2np(skymap, degrade=resolution, field=2)
+            junk,junk,ligo_dist_norm =hp2np.hp2np(skymap, degrade=resolution, field=3)
+    except RuntimeWarning:
+        pass
+    except:
+        print "\t !!!!!!!! ------- no distance information in skymap ------ !!!!!!!!"
+
+    # details of the observations
+    print("obs input:ra,dec,start_mjd,camera ", ra,dec, start_mjd, camera)
+    working_pixels = None
+    if gw_map_control.credible_level < 1.0 :
+        hexFile = os.environ["DESGW_DATA_DIR"] + "all-sky-hexCenters-"+camera+".txt"
+        gw_map_control.working_set = decam2hp.credibleWorkingSet(ligo, 
+            gw_map_control.credible_level, camera, hexFile, footprint=gw_map_control.footprint)
+        working_pixels = gw_map_control.working_set[0]
+    obs = mags.observed(ra,dec,ligo, start_mjd, camera=camera, verbose=False,
+        pixels=working_pixels)
+    return obs
+
+# ==== plan the nights of a campaign in one run
+#
+#   epochs are the nights to observe, in whole days since the day of the
+#   burst (the epochN_NS, epochN_BH of recycler.yaml). Night k starts 
+#   round(epochs[k]) sidereal days after start_mjd+days_since_burst, so that
+#   its slots have the local sidereal times of the first night's slots; its
+#   sunset and sunrise are those of the night round(epochs[k]) days after 
+#   the first (trigger.night_mjd).
+#   The skymap, its observed object, the hex-pixel matrix and the kasen
+#   tables are made once; the first night's ha, zd, airmass and telescope 
+#   limits are reused for the others (control.night_geometry). Each night's 
+#   sun, moon, sky, limiting magnitudes, kn magnitudes, probabilities and
+#   hexes are its own, in data_dir/epoch<k>/.
+#
+#   returns a list of (trigger, control, results), one per night, for make_jsons
+#
+def make_campaign(gw_map_trigger, gw_map_strategy, gw_map_control, epochs) :
+    import copy
+    import mags
+    import mapsAtTimeT
+
+    first_mjd = gw_map_trigger.start_mjd + gw_map_trigger.days_since_burst
+    obs = None
+    geometry = None
+    # the credible region working set of the first night's make_observed,
+    # which obs is restricted to for every night
+    working_set = gw_map_control.working_set
+    nights = []
+    for k in range(0, len(epochs)) :
+        print "=================================================="
+        print "                 campaign night {}, epoch {}".format(k+1, epochs[k])
+        print "=================================================="
+        trigger = copy.copy(gw_map_trigger)
+        trigger.days_since_burst = 0
+        trigger.start_mjd = first_mjd + int(round(epochs[k]))*mags.siderealDay
+        trigger.night_mjd = int(first_mjd) + int(round(epochs[k]))
+        control = copy.copy(gw_map_control)
+        control.datadir = os.path.join(gw_map_control.datadir, "epoch{}".format(k+1)) + "/"
+        control.night_geometry = geometry
+        control.working_set = working_set
+        if not os.path.exists(control.datadir) : os.makedirs(control.datadir)
+        results = gw_map_configure.results()
+
+        obs = make_maps(trigger, gw_map_strategy, control, results, obs=obs)
+        working_set = control.working_set
+        make_hexes(trigger, gw_map_strategy, control, results)
+        if geometry is None :
+            # the night's conditions, as mapsAtTimeT got them
+            geometry = mags.getNightConditions(obs, trigger.start_mjd+np.asarray(results.time_of_slot),
+                gw_map_strategy.working_filter, exposure=gw_map_strategy.summed_exposure_time,
+                cache=control.conditions_cache)
+        nights.append((trigger, control, results))
+    return nights
 
 # ==== figure out what to observe
 #
@@ -279,14 +381,30 @@ def make_hexes( gw_map_trigger, gw_map_strategy, gw_map_control, gw_map_results,
     #print "do_nslots =", do_nslots, "start_slot=",start_slot
     #print ")"
     #raise Exception("here")
-    hoursObserving=obsSlots.observing(
-        trigger_id,n_slots, data_dir, mapZero=mapZero,
-        maxHexesPerSlot = maxHexesPerSlot, do_nslots = do_nslots, start_slot=start_slot)
+    if gw_map_control.visits :
+        # each (hex, tiling, filter) visit scheduled on its own, from the hexVals store
+        if start_slot != -1 or do_nslots != -1 :
+            raise Exception("visits plan the whole night; use replan_hexes to start later")
+        hoursObserving = obsSlots.replan(
+            trigger_id, data_dir, [], None, maxHexesPerSlot, slotDuration,
+            mapZero=mapZero, nslots=n_slots, camera = gw_map_strategy.camera,
+            scheduler = gw_map_control.scheduler, **visitArgs(gw_map_strategy, gw_map_control))
+    else :
+        capacity = None
+        if gw_map_control.slew_order and gw_map_strategy.camera == "decam" :
+            # the places of each slot from the time its hexes take, slew ordered
+            capacity = lambda schedule : slewCapacity(schedule, gw_map_strategy, slotDuration)
+        hoursObserving=obsSlots.observing(
+            trigger_id,n_slots, data_dir, mapZero=mapZero,
+            maxHexesPerSlot = maxHexesPerSlot, do_nslots = do_nslots, start_slot=start_slot,
+            camera = gw_map_strategy.camera, scheduler = gw_map_control.scheduler,
+            slotDuration = slotDuration, capacity = capacity)
 
     # print stats to screen
     print "\n=============>>>>  observingStats from *ra-dec-id-* file"
     # save results to the record -- here is made the ra-dec-id- file
-    writeObservingRecord(hoursObserving,   data_dir, gw_map_trigger, gw_map_control, gw_map_strategy)
+    writeObservingRecord(hoursObserving,   data_dir, gw_map_trigger, gw_map_control, gw_map_strategy,
+        slotDuration=slotDuration)
     #ra,dec,id,prob,mjd,slotNumbers,islots = obsSlots.observingStats(hoursObserving, mapZero, do_nslots, start_slot)
     ra,dec,id,prob,mjd,slotNumbers,islots = obsSlots.observingStatsFromRaDecFile( trigger_id, data_dir, 
         hoursObserving, mapZero, do_nslots, start_slot)
@@ -322,14 +440,52 @@ def make_hexes( gw_map_trigger, gw_map_strategy, gw_map_control, gw_map_results,
 
     return 
 
-# Make the json files
-# you will have to add a
-# import gw_helper to your code and use the function
-# gw_helper.setup_tilings()
+#
+# A fresh plan for the rest of the night, in well under a second, from the
+# hexVals store that make_maps leaves (obsSlots.replan):
+#   observed = the ids of the hexes already done, mjd = now
+# The slots are those make_hexes chose. The ra-dec-id file is written again,
+# for make_jsons; rather than the start_slot, do_nslots of make_hexes.
+#
+def replan_hexes( gw_map_trigger, gw_map_strategy, gw_map_control, gw_map_results,
+        observed, mjd) :
+    trigger_id = gw_map_trigger.trigger_id
+    maxHexesPerSlot  = gw_map_strategy.maxHexesPerSlot
+    data_dir = gw_map_control.datadir
+    if (gw_map_results.hoursPerNight == False)  :
+        gw_map_results = reuse_results(gw_map_trigger, gw_map_strategy, gw_map_control, gw_map_results) 
+    slotDuration = gw_map_results.slotDuration   
+    mapZero, n_slots = 0, -1
+    if gw_map_results.n_slots is not False :
+        mapZero, n_slots = gw_map_results.first_slot, gw_map_results.n_slots
+
+    args = dict()
+    if gw_map_control.visits : args = visitArgs(gw_map_strategy, gw_map_control)
+    hoursObserving = obsSlots.replan(
+        trigger_id, data_dir, observed, mjd, maxHexesPerSlot, slotDuration,
+        mapZero=mapZero, nslots=n_slots, camera = gw_map_strategy.camera,
+        scheduler = gw_map_control.scheduler, **args)
+    ra,dec,id,prob,mjds,slotNum,islot = obsSlots.slotsObservingToNpArrays(hoursObserving)
+    print "\t replanned at mjd {:.4f}: {} hexes in {} slots, sum prob= {:7.4f} %".format(
+        mjd, ra.size, np.unique(slotNum).size, 100*prob.sum())
+    if ra.size > 0 :
+        writeObservingRecord(hoursObserving, data_dir, gw_map_trigger, gw_map_control,
+            gw_map_strategy, slotDuration=slotDuration)
+    return hoursObserving
+
+# the visit units of the strategy and how to schedule them, for obsSlots.replan
+def visitArgs (gw_map_strategy, gw_map_control) :
+    units = obsSlots.visitUnits(gw_map_strategy.exposure_list, gw_map_strategy.filter_list,
+        gw_map_strategy.tiling_list, gw_map_strategy.overhead)
+    return dict(units=units, working_filter=gw_map_strategy.working_filter,
+        min_revisit=gw_map_control.min_revisit)
+
+# Make the json files, one per slot, with every tiling of the strategy:
+# the hexes' visits if the record is of visits, else passes over the
+# slot's hexes, one per tiling
 
 def make_jsons(gw_map_trigger, gw_map_strategy, gw_map_control, gw_map_results) :
     import shutil
-    from gw_helper import gw_helper
     print "=================================================="
     print "                 make_jsons "
     print "=================================================="
@@ -362,33 +518,17 @@ def make_jsons(gw_map_trigger, gw_map_strategy, gw_map_control, gw_map_results)
         return 
 
     ra,dec,id,prob,mjd,slotNum,dist = obsSlots.readObservingRecord(trigger_id,data_dir)
+    tilings, filters = obsSlots.readObservingVisits(trigger_id,data_dir)
 
+    # in the order of the record if it is slew ordered, else by setting time
+    slew_order = gw_map_control.slew_order and gw_map_strategy.camera == "decam"
     list_of_jsons = turnObservingRecordIntoJSONs(
         ra,dec,id,prob,mjd,slotNum, trigger_id,
-        exposure_list, filter_list, tiling_list, trigger_type, skymap, data_dir, propid) 
-    print("tiling list", tiling_list) #ag check 8.11.20
-    print("list of jsons", list_of_jsons)
-    for tiling in tiling_list[1:] :
-        if tiling == 0: ra_shift, dec_shift =  0.00, 0.00
-        if tiling == 1: ra_shift, dec_shift =  0.02, 0.00
-        if tiling == 2: ra_shift, dec_shift =  0.00, 0.02
-        if tiling == 3: ra_shift, dec_shift = -0.02, 0.00
-        if tiling == 4: ra_shift, dec_shift =  0.00,-0.02
-        print("\t tiling {} ra,dec shift by {},{}".format(tiling, ra_shift, dec_shift))
-        print("list of jsons, rashift, decshift, tiling", list_of_jsons, ra_shift, dec_shift, tiling)
-        gw_helper.setup_tilings(
-            list_of_jsons,
-            ra_shift = [ra_shift], dec_shift = [dec_shift],
-            tilings = tiling,
-            prefix='tiling_{}'.format(tiling),
-            overwrite=False,
-        )
+        exposure_list, filter_list, tiling_list, trigger_type, skymap, data_dir, propid,
+        sort = not slew_order, tilings=tilings, filters=filters) 
+    print "\t tiling list", tiling_list
     for file in list_of_jsons:
-        dir = os.path.dirname(file)
-        file = os.path.basename(file)
-        print("basename file", file)
-        print("basename dir", dir)
-        shutil.copyfile(dir+"/"+file, dir+"/json/tiling_{}_".format(tiling_list[0]) + file)
+        shutil.copyfile(file, os.path.join(data_dir, "json", os.path.basename(file)))
 
 #
 # ====== there are possibilities. Show them.
@@ -490,9 +630,11 @@ def how_well_did_we_do(gw_map_trigger, gw_map_strategy, gw_map_control) :
     raH, decH = np.genfromtxt(name, unpack=True, usecols=(0,1))
     treedata = decam2hp.buildtree(ra, dec, resolution, recompute=True) 
     tree = treedata[2] 
-    sum = decam2hp.hexalateMapWithoutOverlap(ra,dec,ligo,tree, raH,decH,camera, verbose=False) 
+    # the hexes are in the order of the -ra-dec-id file, which sets who owns shared pixels
+    matrix = decam2hp.hexMembership(ra, dec, tree, raH, decH, camera)
+    sum = decam2hp.hexalateFirstOwner(matrix, ligo)
     print "\nTotal Ligo probability covered by hexes observed: {:.3f}%".format(sum.sum()*100.)
-    print "   (from decam2hp.sumHexalatedMap of -ra-dec-id file)\n"
+    print "   (from decam2hp.hexalateFirstOwner of -ra-dec-id file)\n"
     return sum.sum()
 
 
@@ -634,23 +776,22 @@ def economics (simNumber, best_slot, mapDirectory,
 #   raMap, decMap, ligoMap, maglimMap, probMap, haMap, xMap,yMap, hxMap,hyMap = readMaps(
 #   ra, dec, ligo, maglim, prob, ha, x,y, hx,hy = readMaps(
 def readMaps(mapDir, simNumber, slot) :
-    import healpy as hp
+    import slotMaps
     # get the maps for a reasonable slot
-    name = os.path.join(mapDir, str(simNumber) + "-"+str(slot))
-    #print "\t reading ",name+"-ra.hp  & etc"
-    raMap     =hp.read_map(name+"-ra.hp", verbose=False);
-    decMap    =hp.read_map(name+"-dec.hp", verbose=False);
-    haMap     =hp.read_map(name+"-ha.hp", verbose=False);
-    xMap      =hp.read_map(name+"-x.hp", verbose=False);
-    yMap      =hp.read_map(name+"-y.hp", verbose=False);
-    hxMap     =hp.read_map(name+"-hx.hp", verbose=False);
-    hyMap     =hp.read_map(name+"-hy.hp", verbose=False);
-    ligoMap   =hp.read_map(name+"-map.hp", verbose=False);
-    maglimMap =hp.read_map(name+"-maglim.hp", verbose=False);
-    probMap   =hp.read_map(name+"-probMap.hp", verbose=False);
-    haMap=haMap/(2*np.pi/360.)
-    raMap=raMap/(2*np.pi/360.)
-    decMap=decMap/(2*np.pi/360.)
+    maps = slotMaps.readSlot(mapDir, simNumber, slot)
+    raMap     = maps["ra"]
+    decMap    = maps["dec"]
+    haMap     = maps["ha"]
+    xMap      = maps["x"]
+    yMap      = maps["y"]
+    hxMap     = maps["hx"]
+    hyMap     = maps["hy"]
+    ligoMap   = maps["map"]
+    maglimMap = maps["maglim"]
+    probMap   = maps["probMap"]
+    haMap=haMap.astype(np.float64)/(2*np.pi/360.)
+    raMap=raMap.astype(np.float64)/(2*np.pi/360.)
+    decMap=decMap.astype(np.float64)/(2*np.pi/360.)
     return raMap, decMap, ligoMap, maglimMap, probMap, \
         haMap, xMap, yMap, hxMap, hyMap
 
@@ -685,7 +826,8 @@ def hoursPerNight (mjd, camera="decam") :
     
 def turnObservingRecordIntoJSONs(
         ra,dec,id,prob,mjd,slotNumbers, trigger_id,
-        exposure_list, filter_list, tiling_list, trigger_type, skymap, mapDirectory, propid) :
+        exposure_list, filter_list, tiling_list, trigger_type, skymap, mapDirectory, propid,
+        sort=True, tilings=None, filters=None) :
     seqtot =  ra.size
     seqzero,seqnum = 0,0
 
@@ -697,11 +839,15 @@ def turnObservingRecordIntoJSONs(
         tmpname, name = jsonUTCName(slot, slotMJD, trigger_id, mapDirectory)
         tmpname = mapDirectory + tmpname
         name = mapDirectory + name
-        jsonMaker.writeJson(ra[ix],dec[ix],id[ix],
+        visits = dict()
+        if tilings is not None :
+            visits = dict(tilings=tilings[ix], filters=filters[ix])
+        passes = jsonMaker.writeJson(ra[ix],dec[ix],id[ix],
             seqzero, seqnum, seqtot, exposureList= exposure_list, 
             filterList= filter_list, tilingList = tiling_list, trigger_id = trigger_id, 
-            trigger_type=trigger_type, propid=propid, skymap=skymap, jsonFilename=tmpname)
-        desJson(tmpname, name, mapDirectory, slotMJD) 
+            trigger_type=trigger_type, propid=propid, skymap=skymap, jsonFilename=tmpname,
+            **visits)
+        desJson(tmpname, name, mapDirectory, slotMJD, sort=sort, passes=passes) 
         seqzero += ra[ix].size
 #        list_of_jsons.append(mapDirectory+name) #ag commented out 8.10.20
         list_of_jsons.append(name)
@@ -709,7 +855,9 @@ def turnObservingRecordIntoJSONs(
     return list_of_jsons
         
 # verbose can be 0, 1=info, 2=debug
-def desJson(tmpname, name, data_dir, start_time, verbose = 1) :
+# sort puts the queue in order of setting time, else it is left in the file's order;
+#   with passes, the tiling pass of each exposure, in order of setting time within each pass
+def desJson(tmpname, name, data_dir, start_time, verbose = 1, sort=True, passes=None) :
     import os
     import json
     import gwwide
@@ -719,7 +867,12 @@ def desJson(tmpname, name, data_dir, start_time, verbose = 1) :
     gw_queue = json.load(fd); fd.close()
     # seconds to leave before hitting the Blanco limits
     time_buffer= 300.
-    fixed_queue = gwwide.gwwide([],gw_queue, start_time, time_buffer, sort=True)
+    fixed_queue = gwwide.gwwide([],gw_queue, start_time, time_buffer, 
+        sort=sort and passes is None)
+    if sort and passes is not None :
+        order = sorted(range(len(fixed_queue)), 
+            key = lambda k: (passes[k], fixed_queue[k]['lateTime']))
+        fixed_queue = [fixed_queue[k] for k in order]
     fd = open(name,"w")
     print "make ericJson {}".format(name)
     json.dump(fixed_queue, fd, indent=4); fd.close()
@@ -1029,24 +1182,37 @@ def observingPlot(figure, simNumber, slot, data_dir, nslots, n_hexes, camera,
         moonRa=moonRa, moonDec=moonDec, moonIllumination=moonIllumination)
     return d
 
-def writeObservingRecord(slotsObserving, data_dir, gw_map_trigger, gw_map_control, gw_map_strategy) :
+def writeObservingRecord(slotsObserving, data_dir, gw_map_trigger, gw_map_control, gw_map_strategy,
+        slotDuration=None) :
     trigger_id = gw_map_trigger.trigger_id
     just_sort_by_ra = gw_map_control.just_sort_by_ra
     max_number_of_hexes_to_do = gw_map_strategy.max_number_of_hexes_to_do
+    slew_order = gw_map_control.slew_order and gw_map_strategy.camera == "decam"
 
     name = os.path.join(data_dir, str(trigger_id) + "-ra-dec-id-prob-mjd-slot-dist.txt")
     ra,dec,id,prob,mjd,slotNum,islot = obsSlots.slotsObservingToNpArrays(slotsObserving)
+    # the tiling and filter of each, if the hexes are visits (obsSlots.visitSchedule)
+    tiling, filter = obsSlots.visitsToNpArrays(slotsObserving)
+    visits = tiling is not None
 
     # let's optionally limit the number of hexes going into the file:
     #    of course, this assumes they are sorted by prob
     if max_number_of_hexes_to_do < 10000 :
-        ra = ra[0:max_number_of_hexes_to_do]
-        dec = dec[0:max_number_of_hexes_to_do]
-        id = id[0:max_number_of_hexes_to_do]
-        prob = prob[0:max_number_of_hexes_to_do]
-        mjd = mjd[0:max_number_of_hexes_to_do]
-        slotNum = slotNum[0:max_number_of_hexes_to_do]
-        islot = islot[0:max_number_of_hexes_to_do]
+        keep = slice(0, max_number_of_hexes_to_do)
+        if visits :
+            # the visits of the first hexes, all of their visits
+            first = np.unique(id, return_index=True)[1]
+            keep = np.in1d(id, id[np.sort(first)[0:max_number_of_hexes_to_do]])
+        ra = ra[keep]
+        dec = dec[keep]
+        id = id[keep]
+        prob = prob[keep]
+        mjd = mjd[keep]
+        slotNum = slotNum[keep]
+        islot = islot[keep]
+        if visits :
+            tiling = tiling[keep]
+            filter = filter[keep]
         print "\t ========================================"
         print "\t number of hexes kept for jsons = {}".format( max_number_of_hexes_to_do)
         print "\t ========================================"
@@ -1056,6 +1222,7 @@ def writeObservingRecord(slotsObserving, data_dir, gw_map_trigger, gw_map_contro
         ix = np.argsort(ra)
         ra,dec,id,prob,islot = \
             ra[ix],dec[ix],id[ix],prob[ix],islot [ix]
+        if visits : tiling, filter = tiling[ix], filter[ix]
 
     map_distance = gw_map_trigger.ligo_dist
     nside = hp.npix2nside(map_distance.size)
@@ -1065,8 +1232,15 @@ def writeObservingRecord(slotsObserving, data_dir, gw_map_trigger, gw_map_contro
     #fixing the distance
     #dist = 60.
     fd = open(name,'w')
-    fd.write("# ra, dec, id, prob, mjd, slotNum, dist\n")
+    if visits :
+        fd.write("# ra, dec, id, prob, mjd, slotNum, dist, tiling, filter\n")
+        # the pass of each visit, and the order of its filter in the strategy
+        tilingPass = np.array([list(gw_map_strategy.tiling_list).index(t) for t in tiling])
+        filterOrder = np.array([list(gw_map_strategy.filter_list).index(f) for f in filter])
+    else :
+        fd.write("# ra, dec, id, prob, mjd, slotNum, dist\n")
     unique_slots = np.unique(slotNum)
+    last = None
     for slot in unique_slots:
         ix = slot==slotNum
         iy = np.argsort(ra[ix])
@@ -1078,6 +1252,23 @@ def writeObservingRecord(slotsObserving, data_dir, gw_map_trigger, gw_map_contro
             iy = np.argsort(dummy_ra)
         else :
             iy = np.argsort(ra[ix])
+        if slew_order :
+            # or the order that slews least, from the last hex of the slot before
+            iy = slewOrderSlot(ra[ix], dec[ix], mjd[ix][0], iy, last, slot,
+                gw_map_strategy, (None if visits else slotDuration))
+            last = ra[ix][iy][-1], dec[ix][iy][-1]
+        if visits :
+            # visits pass by pass, the hexes in the order above, 
+            # the filters of a hex in the order of the strategy
+            first, where = np.unique(id[ix][iy], return_index=True, return_inverse=True)[1:]
+            iy = iy[np.lexsort((filterOrder[ix][iy], first[where], tilingPass[ix][iy]))]
+            for r,d,i,p,m,s,di,t,f in zip(
+                    ra[ix][iy], dec[ix][iy], id[ix][iy],
+                    prob[ix][iy], mjd[ix][iy], slotNum[ix][iy], dist[ix][iy],
+                    tiling[ix][iy], filter[ix][iy]):
+                fd.write("{:.6f} {:.5f} {:s} {:.7f} {:.4f} {:.1f} {:.2f} {:d} {:s}\n".format(
+                    r,d,i,p,m,s,di,int(t),f))
+            continue
         for r,d,i,p,m,s,di in zip(
                 ra[ix][iy], dec[ix][iy], id[ix][iy],
                 prob[ix][iy], mjd[ix][iy], slotNum[ix][iy], dist[ix][iy]):
@@ -1087,3 +1278,59 @@ def writeObservingRecord(slotsObserving, data_dir, gw_map_trigger, gw_map_contro
     fd.close()
     return ra,dec,id,prob,mjd,slotNum,dist
 
+#
+# the order of a slot's hexes that slews least (telescope.slewTour), from
+# last, the ra,dec of the last hex of the slot before, if there is one.
+# Prints the slewing against that of ra_order, and the time the slot's
+# visits take against its slotDuration (minutes), if given.
+#
+def slewOrderSlot(ra, dec, mjd, ra_order, last, slot, gw_map_strategy, slotDuration=None) :
+    import telescope
+    ha = telescope.hourAngle(ra, mjd)
+    start = None
+    if last is not None :
+        start = telescope.hourAngle(last[0], mjd), last[1]
+    order = telescope.slewTour(ha, dec, start)
+    ra_slews = telescope.pathSlewTime(ha[ra_order], dec[ra_order], start)
+    slews = telescope.pathSlewTime(ha[order], dec[order], start)
+    print "\t slot {:.0f}: {} hexes, slewing {:.0f} s, {:.0f} s in ra order".format(
+        slot, ra.size, slews, ra_slews),
+    if slotDuration is not None :
+        used = telescope.decamVisitsTime(ra.size, gw_map_strategy.exposure_list,
+            np.size(gw_map_strategy.tiling_list), slews)/60.
+        print ", {:.1f} of {:.1f} minutes".format(used, slotDuration),
+    print ""
+    return order
+
+#
+# the places of each slot of a schedule, from the time its hexes take in the
+# order that slews least, from the last hex of the slot before (as 
+# writeObservingRecord orders them): the slotDuration (minutes) left over holds 
+# more hexes, at a neighbour's slew each, and a slot over its duration holds 
+# fewer. A slot with no hexes keeps maxHexesPerSlot. For obsSlots.observing.
+#
+def slewCapacity(slotsObserving, gw_map_strategy, slotDuration) :
+    import telescope
+    exposure_list = gw_map_strategy.exposure_list
+    ntilings = np.size(gw_map_strategy.tiling_list)
+    # the seconds of one hex more
+    more = telescope.decamVisitsTime(1, exposure_list, ntilings,
+        telescope.blancoSlewTime(0., 0., 0., telescope.decamHexSpacing))
+    places = dict()
+    last = None
+    for i in range(0, slotsObserving["nslots"]) :
+        ra, dec, mjd = slotsObserving[i,"ra"], slotsObserving[i,"dec"], slotsObserving[i,"mjd"]
+        if ra.size == 0 :
+            places[i] = gw_map_strategy.maxHexesPerSlot
+            continue
+        ha = telescope.hourAngle(ra, mjd[0])
+        start = None
+        if last is not None :
+            start = telescope.hourAngle(last[0], mjd[0]), last[1]
+        order = telescope.slewTour(ha, dec, start)
+        slews = telescope.pathSlewTime(ha[order], dec[order], start)
+        left = slotDuration*60. - telescope.decamVisitsTime(ra.size, exposure_list, ntilings, slews)
+        places[i] = max(ra.size + int(np.floor(left/more)), 0)
+        last = ra[order][-1], dec[order][-1]
+    return places
+
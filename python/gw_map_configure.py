@@ -34,6 +34,8 @@ class trigger(object):
         # ok, I'm going to declare that we want this routine to start at noon UT on JD of burst
         # As there is automatic sunrise, sunset calculations given MJD, we will pick midnight
         self.start_mjd = np.round(burst_mjd)
+        # the night of start_mjd+days_since_burst if None; set by make_campaign
+        self.night_mjd = None
 
         if trigger_type == "bright" :
             named_trigger = "has remnant"
@@ -52,22 +54,34 @@ class trigger(object):
             self.distance = 100.
             self.diststd = 30.
 
-        ra,dec,ligo=hp2np.hp2np(skymap, degrade=resolution, field=0)
-        ligo_dist, ligo_dist_sig, ligo_dist_norm  = \
-            distance*np.ones(ra.size), np.zeros(ra.size), np.zeros(ra.size)
-        try :
-            ligo_dist      = hp.read_map(skymap, field=1, verbose=False)
-            ligo_dist_sig  = hp.read_map(skymap, field=2, verbose=False)
-            ligo_dist_norm = hp.read_map(skymap, field=3, verbose=False)
-            # there are infinite distance pixels in the map. deal with these
-            ligo_dist[np.isinf(ligo_dist)] = 10000.
-
-            # change resolution
-            ligo_dist      = hp.ud_grade(ligo_dist, resolution)
-            ligo_dist_sig  = hp.ud_grade(ligo_dist, resolution)
-            ligo_dist_norm = hp.ud_grade(ligo_dist, resolution)
-        except:
-            print "\n\t !!!!!!!! ------- no distance information in skymap ------ !!!!!!!!\n"
+        if "ORDERING" in hdr and str(hdr["ORDERING"]).strip() == "NUNIQ" :
+            # multi-order skymap, rasterized straight to resolution
+            ra,dec,maps = hp2np.readMOC(skymap, nside=resolution)
+            ligo = maps[0]
+            ligo_dist, ligo_dist_sig, ligo_dist_norm  = \
+                distance*np.ones(ra.size), np.zeros(ra.size), np.zeros(ra.size)
+            if len(maps) == 4 :
+                ligo_dist, ligo_dist_sig, ligo_dist_norm = maps[1], maps[2], maps[3]
+                ligo_dist[np.isinf(ligo_dist)] = 10000.
+            else :
+                print "\n\t !!!!!!!! ------- no distance information in skymap ------ !!!!!!!!\n"
+        else :
+            ra,dec,ligo=hp2np.hp2np(skymap, degrade=resolution, field=0)
+            ligo_dist, ligo_dist_sig, ligo_dist_norm  = \
+                distance*np.ones(ra.size), np.zeros(ra.size), np.zeros(ra.size)
+            try :
+                ligo_dist      = hp.read_map(skymap, field=1, verbose=False)
+                ligo_dist_sig  = hp.read_map(skymap, field=2, verbose=False)
+                ligo_dist_norm = hp.read_map(skymap, field=3, verbose=False)
+                # there are infinite distance pixels in the map. deal with these
+                ligo_dist[np.isinf(ligo_dist)] = 10000.
+
+                # change resolution
+                ligo_dist      = hp.ud_grade(ligo_dist, resolution)
+                ligo_dist_sig  = hp.ud_grade(ligo_dist, resolution)
+                ligo_dist_norm = hp.ud_grade(ligo_dist, resolution)
+            except:
+                print "\n\t !!!!!!!! ------- no distance information in skymap ------ !!!!!!!!\n"
     
         self.ligo_ra = ra
         self.ligo_dec = dec
@@ -141,6 +155,43 @@ class control(object):
         self.do_nslots = -1
         self.just_sort_by_ra = False # if true, take the calculated hexes and just sort
                                     # the time to be observed as increasing ra
+        # camera footprint on the healpix map used for hexalation:
+        #   "flat" (the historical radecInHex), "spherical", or "fractional"
+        self.footprint = "flat"
+        # coarse to fine hexalation (decam2hp.multiresHexPixelMatrix): hexalate
+        # at multires_nside, refine only the hexes above multires_fraction of the max,
+        # and if multires_validate compare against the full resolution hexalation
+        self.multires = False
+        self.multires_nside = 32
+        self.multires_fraction = 1e-4
+        self.multires_validate = False
+        # restrict the map work to the pixels of the credible_level credible region
+        # of the skymap, plus the hexes that reach it (decam2hp.credibleWorkingSet).
+        # 1.0 means the whole sky
+        self.credible_level = 1.0
+        # (pixels, candidate hexes, candidate hex-pixel matrix), made in make_maps
+        self.working_set = None
+        # number of processes evaluating the slots of mapsAtTimeT in parallel; 1 is sequential
+        self.n_workers = 1
+        # keep the slot results of mapsAtTimeT on disk in datadir/slot-cache rather than in memory
+        self.slot_cache_spill = False
+        # keep the night's observing conditions (mags.nightConditions), which do not
+        # depend on the skymap, in $DESGW_CACHE_DIR for later skymaps of the event
+        self.conditions_cache = False
+        # a mags.nightConditions of another night, whose ha, zd, airmass and limits
+        # are reused at the same local sidereal times (set by make_campaign)
+        self.night_geometry = None
+        # how obsSlots.observing places the hexes in the slots: "greedy", highest
+        # probability first, or "optimal", the most summed probability
+        self.scheduler = "greedy"
+        # put the hexes of each slot in the order that slews least, with the
+        # Blanco slew model of telescope, which also sets the slot duration and,
+        # from the time that order takes, the hexes each slot holds (decam)
+        self.slew_order = False
+        # schedule each (hex, tiling, filter) visit on its own (obsSlots.visitSchedule),
+        # the tilings of a hex at least min_revisit minutes apart
+        self.visits = False
+        self.min_revisit = 0.
         # should i bypass the mapmaking by copying over from the MI directories?
         self.snarf_mi_maps = snarf_mi_maps
         # what directory to holds the existing maps? Copy over to output_dir
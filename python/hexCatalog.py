@@ -0,0 +1,109 @@
+import numpy as np
+import os
+import scipy.spatial
+
+license="""
+   Copyright (C) 2015 James Annis
+
+   This program is free software; you can redistribute it and/or modify it
+   under the terms of version 3 of the GNU General Public License as
+   published by the Free Software Foundation.
+
+   More to the points- this code is science code: buggy, barely working,
+   with little or no documentation. Science code in the the alpine fast
+   & light style.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program; if not, write to the Free Software
+   Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""
+
+#
+# The all sky hex centers of a camera, read once.
+#
+# A hex is known by its integer index, the row in the hex file (and so
+# the row in the decam2hp.hexPixelMatrix). The string ids of hexalate.getHexId
+# are not unique for every camera (hsc has a few repeats), so matching on
+# the sky is done with a kd-tree on unit vectors.
+#
+#   catalog = hexCatalog.getHexCatalog("decam")
+#   index = catalog.indexOfRaDec(ra, dec)   # -1 if no hex center within 36"
+#   keep = catalog.selectIds(this_tiling, reject_hexes)
+#
+class HexCatalog(object):
+    def __init__(self, hexFile) :
+        import hexalate
+        ra,dec = np.genfromtxt(hexFile, unpack=True, usecols=(0,1),comments="#")
+        self.hexFile = hexFile
+        self.ra = ra
+        self.dec = dec
+        self.id = hexalate.getHexId(ra,dec)
+        self.index = np.arange(ra.size)
+        self.size = ra.size
+        self.xyz = radecToUnitVector(ra, dec)
+        self.tree = scipy.spatial.cKDTree(self.xyz)
+        # id to the indicies of the hexes with that id
+        self.idIndex = dict()
+        for i in range(0,self.size) :
+            self.idIndex.setdefault(self.id[i], []).append(i)
+
+    # the index of the hex centered at ra,dec (degrees), -1 if none within tolerance
+    #   tolerance is in degrees, 36" by default as in getHexObservations.make_hexes
+    def indexOfRaDec (self, ra, dec, tolerance=36./3600.) :
+        scalar = np.isscalar(ra)
+        xyz = radecToUnitVector(np.atleast_1d(ra), np.atleast_1d(dec))
+        chord = 2*np.sin(tolerance*np.pi/180./2.)
+        distance, index = self.tree.query(xyz, distance_upper_bound=chord)
+        index = np.where(np.isfinite(distance), index, -1)
+        if scalar : return index[0]
+        return index
+
+    # all of the hex indicies having any of the ids
+    def indicesOfIds (self, ids) :
+        index = []
+        for id in np.atleast_1d(ids) :
+            index.extend(self.idIndex.get(id, []))
+        return np.array(index, dtype=np.int64)
+
+    # the hexes within radius (degrees) of hex index, or of any of an array of indicies
+    def neighbors (self, index, radius) :
+        chord = 2*np.sin(radius*np.pi/180./2.)
+        index = np.atleast_1d(index)
+        if index.size == 0 : return np.zeros(0, dtype=np.int64)
+        near = self.tree.query_ball_point(self.xyz[index], chord)
+        near = np.unique(np.concatenate([np.array(n, dtype=np.int64) for n in near]))
+        return np.setdiff1d(near, index)
+
+    # boolean mask over the catalog:
+    #   if onlyIds is non-empty, only those hexes are kept,
+    #   then the hexes of rejectIds are dropped
+    def selectIds (self, onlyIds=[], rejectIds=[]) :
+        keep = np.ones(self.size, dtype=bool)
+        if len(onlyIds) > 0 :
+            keep[:] = False
+            keep[self.indicesOfIds(onlyIds)] = True
+        if len(rejectIds) > 0 :
+            keep[self.indicesOfIds(rejectIds)] = False
+        return keep
+
+def radecToUnitVector (ra, dec) :
+    ra = ra*np.pi/180.
+    dec = dec*np.pi/180.
+    xyz = np.array([np.cos(dec)*np.cos(ra), np.cos(dec)*np.sin(ra), np.sin(dec)]).T
+    return xyz
+
+# catalogs already read by this process, keyed by hex file
+hexCatalogMemo = {}
+
+def getHexCatalog (camera="decam", hexFile="") :
+    if hexFile == "" :
+        hexFile = os.environ["DESGW_DATA_DIR"] + "all-sky-hexCenters-"+camera+".txt"
+    if hexFile not in hexCatalogMemo :
+        hexCatalogMemo[hexFile] = HexCatalog(hexFile)
+    return hexCatalogMemo[hexFile]
+
@@ -21,6 +21,7 @@ license="""
 """
 
 import numpy as np
+import os
 import decam2hp
 
 #
@@ -63,7 +64,12 @@ def cutAndHexalate (obs, sm, camera, hexFile) :
     return raHexen, decHexen, idHexen, hexVals, rank
 
 
-def cutAndHexalateOnRaDec (obs, sm, raHexen, decHexen, idHexen, tree, camera, cutProbs=False) :
+# if a hex-pixel matrix (decam2hp.hexMembership, decam2hp.hexPixelMatrix) 
+# with rows matching raHexen,decHexen is given, the hexalation is done
+# on the matrix (a sparse mat-vec, or decam2hp.hexalateFirstOwner for cutProbs)
+# and the tree is not needed
+def cutAndHexalateOnRaDec (obs, sm, raHexen, decHexen, idHexen, tree, camera, cutProbs=False,
+        matrix=None) :
     #cutProbs calls without Overlap
     verbose = False
     obsHourAngle = obs.ha*360./(2*np.pi)
@@ -78,9 +84,13 @@ def cutAndHexalateOnRaDec (obs, sm, raHexen, decHexen, idHexen, tree, camera, cu
         print "\t cutAndHexalate probabilities sum",probabilities.sum()
 
     hexVals = np.zeros(raHexen.size)
-    if not cutProbs:
+    if not cutProbs and matrix is not None :
+        hexVals[ix2] = matrix.dot(probabilities)[ix2]
+    elif not cutProbs:
         hexVals[ix2] = decam2hp.hexalateMap(obsRa,obsDec, probabilities, tree,
                                             raHexen[ix2], decHexen[ix2], camera, verbose=False)
+    elif matrix is not None :
+        hexVals[ix2] = decam2hp.hexalateFirstOwner(matrix[ix2], probabilities)
     else:
         hexVals[ix2] = decam2hp.hexalateMapWithoutOverlap(obsRa,obsDec, probabilities, tree,
                                             raHexen[ix2], decHexen[ix2], camera, verbose=False)
@@ -91,26 +101,116 @@ def cutAndHexalateOnRaDec (obs, sm, raHexen, decHexen, idHexen, tree, camera, cu
  
     return raHexen, decHexen, idHexen, hexVals, rank
 
+#
+# Hexalate a whole night at once.
+#   probCube is the (n slots x n pixels) stack of obs.map*sm.probMap,
+#   matrix is the hex-pixel matrix with rows matching raHexen,decHexen.
+# Returns the (n slots x n hexes) array of hex values, with the
+# same cuts as cutAndHexalateOnRaDec. If nameStems (and the slot mjds)
+# are given, the per slot -hexVals.txt files are written, or 
+# the -hexVals-cutOverlappingProb.txt files if cutProbs
+def hexalateNight (probCube, raHexen, decHexen, idHexen, matrix, cutProbs=False,
+        nameStems=[], mjds=[]) :
+    probCube = np.atleast_2d(probCube)
+    ix2 = decHexen < 43.
+
+    hexVals = np.zeros((probCube.shape[0], raHexen.size))
+    if not cutProbs :
+        hexVals[:,ix2] = matrix[ix2].dot(probCube.T).T
+    else :
+        owners = decam2hp.ownerMatrix(matrix[ix2])
+        hexVals[:,ix2] = owners.dot(probCube.T).T
+
+    suffix = "-hexVals.txt"
+    if cutProbs : suffix = "-hexVals-cutOverlappingProb.txt"
+    for i in range(0,len(nameStems)) :
+        writeHexVals(nameStems[i]+suffix, raHexen, decHexen, idHexen, hexVals[i], mjds[i])
+    return hexVals
+
+# the -hexVals.txt format read by obsSlots.loadHexalatedProbabilities
+def writeHexVals (name, raHexen, decHexen, idHexen, hexVals, mjd) :
+    rank=np.argsort(hexVals);
+    rank = rank[::-1];# sort from large to small by flipping natural argsort order
+    if os.path.exists(name): os.remove(name)
+    f = open(name,'w')
+    for j in range(0,raHexen.size) :
+        f.write("{:.6f}, {:.5f}, {:s}, {:.4e}, {:d}, {:.4f}\n".format(
+            raHexen[j],decHexen[j],idHexen[j],hexVals[j],rank[j], mjd))
+    f.close()
 
+
+# the hex centers are read once per hex file, see hexCatalog
 def getHexCenters (hexFile) :
     #allskyDesHexes="../data/all-sky-hexCenters-"+camera+".txt"
-    ra,dec = np.genfromtxt(hexFile, unpack=True, \
-        usecols=(0,1),comments="#")
-    hex_id = getHexId(ra,dec)
-    return ra,dec,hex_id
+    import hexCatalog
+    catalog = hexCatalog.getHexCatalog(hexFile=hexFile)
+    return catalog.ra.copy(), catalog.dec.copy(), catalog.id.copy()
 
 #
 # a modified DES convention: just rounded ra,dec with + or - sign
 # of type "24-31", "179+10"
 def getHexId(ra, dec) :
-    intra = np.round(ra)
-    intdec = np.abs(np.round(dec));
+    ra = np.atleast_1d(ra)
+    dec = np.atleast_1d(dec)
+    intra = np.round(ra).astype(int).astype(str)
+    intdec = np.abs(np.round(dec)).astype(int).astype(str)
     sign=np.full(ra.size, "+",dtype="str");
     ix = dec < 0; sign[ix]="-";
-    id = np.array([],dtype="str")
-    for i in range(0,ra.size) :
-        name = str(np.int(intra[i])) + sign[i] + str(np.int(intdec[i]))
-        id = np.append(id, name)
+    id = np.char.add(np.char.add(intra, sign), intdec)
+    # as narrow a string type as the ids need
+    id = np.array(id.tolist(), dtype="str")
     return id
 
 
+#
+# The hexVals store: the night's (slots x hexes) hex values in one place,
+# so that obsSlots.replan need not read the -hexVals.txt files.
+# data_dir/<trigger_id>-hexValStore/ holds .npy files:
+#   vals       (slots x hexes), as the -hexVals.txt files have them (%.4e)
+#   hexIndex   the hexCatalog index of each hex
+#   slot       the slot (map counter) of each row
+#   mjd        the mjd of each row
+#   sky-<f>    (slots x hexes) the sky less the fiducial sky in filter f at
+#              the hex centers (mags.skyAtSlots), for obsSlots.visitSchedule
+# vals is memory mapped on read, and a store read is kept by the process
+# until the store is written again.
+#
+hexValStoreMemo = {}
+
+def hexValStoreDir (data_dir, trigger_id) :
+    return os.path.join(data_dir, str(trigger_id) + "-hexValStore")
+
+def writeHexValStore (data_dir, trigger_id, hexVals, hexIndex, slots, mjds, sky=dict()) :
+    import shutil
+    store = hexValStoreDir(data_dir, trigger_id)
+    if os.path.exists(store) : shutil.rmtree(store)
+    os.makedirs(store)
+    hexVals = np.atleast_2d(hexVals)
+    vals = np.char.mod("%.4e", hexVals.ravel()).astype(np.float64).reshape(hexVals.shape)
+    np.save(os.path.join(store, "vals.npy"), vals)
+    np.save(os.path.join(store, "hexIndex.npy"), np.asarray(hexIndex, dtype=np.int64))
+    np.save(os.path.join(store, "slot.npy"), np.asarray(slots, dtype=np.int64))
+    np.save(os.path.join(store, "mjd.npy"), np.asarray(mjds, dtype=np.float64))
+    for filter in sky.keys() :
+        np.save(os.path.join(store, "sky-{}.npy".format(filter)), sky[filter])
+    hexValStoreMemo.pop(store, None)
+    return store
+
+# the store as a dict of its arrays (sky a dict by filter), None if there is none
+def readHexValStore (data_dir, trigger_id) :
+    import glob
+    store = hexValStoreDir(data_dir, trigger_id)
+    file = os.path.join(store, "vals.npy")
+    if not os.path.exists(file) : return None
+    stamp = os.path.getmtime(file)
+    if store in hexValStoreMemo and hexValStoreMemo[store][0] == stamp :
+        return hexValStoreMemo[store][1]
+    values = dict(vals = np.load(file, mmap_mode="r"))
+    for name in ["hexIndex", "slot", "mjd"] :
+        values[name] = np.load(os.path.join(store, name + ".npy"))
+    values["sky"] = dict()
+    for file in glob.glob(os.path.join(store, "sky-*.npy")) :
+        filter = os.path.basename(file)[len("sky-"):-len(".npy")]
+        values["sky"][filter] = np.load(file, mmap_mode="r")
+    hexValStoreMemo[store] = (stamp, values)
+    return values
@@ -28,11 +28,115 @@ license="""
 #   fluxConservation = False => averaging maps when changing resolution
 #   fluxConservation = True => sums maps when changing resolution
 #
+#   multi-order (ORDERING = NUNIQ) skymaps are rasterized directly to degrade
+#   by readMOC, where the probability is always summed
 def hp2np (hp_map_file, nan=True, degrade=False, fluxConservation=True, field=0, verbose=False) :
+    if isMOC(hp_map_file) :
+        ra,dec,maps = readMOC(hp_map_file, nside=degrade, verbose=verbose)
+        return ra,dec,maps[field]
     hm = hp.read_map(hp_map_file, field=field, verbose=verbose)
     ra,dec,vals = map2np(hm, resolution=degrade, fluxConservation=fluxConservation, verbose=verbose)
     return ra,dec,vals
 
+#
+# Multi-order skymaps.
+#
+# The LIGO/Virgo/KAGRA multi-order skymaps are a table of tiles, each a
+# nested healpix pixel at its own order, named by UNIQ = 4*4**order + ipix,
+# with PROBDENSITY (per steradian) and DISTMU, DISTSIGMA, DISTNORM.
+# Rasterize the tiles straight to the working nside:
+#   tiles coarser than nside are spread over their nside pixels,
+#   tiles finer than nside are summed into their nside parent, with the
+#       distance columns the probability weighted mean of the tiles
+# never making the full resolution flat map.
+#
+def isMOC (hp_map_file) :
+    import fitsio
+    try :
+        hdr = fitsio.read_header(hp_map_file, 1)
+    except :
+        return False
+    return "ORDERING" in hdr and str(hdr["ORDERING"]).strip() == "NUNIQ"
+
+# returns ra, dec, [prob, distmu, distsigma, distnorm] at nside, in ring order
+#   nside = False means the finest order in the skymap
+def readMOC (hp_map_file, nside=False, verbose=False) :
+    import fitsio
+    data = fitsio.read(hp_map_file, ext=1)
+    columns = data.dtype.names
+    uniq = data["UNIQ"]
+    probdensity = data["PROBDENSITY"]
+    distance = []
+    for name in ["DISTMU", "DISTSIGMA", "DISTNORM"] :
+        if name in columns : distance.append(data[name])
+    if verbose: print "\t readMOC: {} tiles, columns {}".format(uniq.size, columns)
+    if not nside :
+        order, ipix = uniq2nest(uniq)
+        nside = 2**order.max()
+    maps = moc2np(uniq, probdensity, distance, nside)
+    ra,dec,junk = map2np(maps[0])
+    return ra,dec,maps
+
+def uniq2nest (uniq) :
+    uniq = np.asarray(uniq).astype(np.int64)
+    order = (np.floor(np.log2(uniq/4.)/2.)).astype(np.int64)
+    # guard the floating point log against the exact powers of 4
+    order = np.where(4*4**(order+1) <= uniq, order+1, order)
+    order = np.where(4*4**order > uniq, order-1, order)
+    ipix = uniq - 4*4**order
+    return order, ipix
+
+# the rasterization of the tiles to nside; see readMOC
+def moc2np (uniq, probdensity, distance, nside) :
+    nside = int(nside)
+    target_order = int(np.round(np.log2(nside)))
+    if 2**target_order != nside : raise Exception("nside {} is not a power of 2".format(nside))
+    npix = hp.nside2npix(nside)
+    order, ipix = uniq2nest(uniq)
+    # the probability in each tile
+    prob = probdensity*4*np.pi/(12*4.**order)
+
+    target = []
+    weight = []
+    tiles = []
+    for o in np.unique(order) :
+        ix, = np.nonzero(order == o)
+        if o <= target_order :
+            # spread over the children at nside, in equal parts
+            n = 4**(target_order - o)
+            target.append((ipix[ix][:,np.newaxis]*n + np.arange(n)).flatten())
+            weight.append(np.repeat(prob[ix]/n, n))
+            tiles.append(np.repeat(ix, n))
+        else :
+            target.append(ipix[ix] >> 2*(o - target_order))
+            weight.append(prob[ix])
+            tiles.append(ix)
+    target = np.concatenate(target)
+    weight = np.concatenate(weight)
+    tiles = np.concatenate(tiles)
+
+    prob_map = np.bincount(target, weights=weight, minlength=npix)
+    maps = [prob_map,]
+    for dist in distance :
+        dist = dist[tiles]
+        good = np.isfinite(dist)
+        wsum = np.bincount(target[good], weights=weight[good], minlength=npix)
+        mean = np.bincount(target[good], weights=(weight*dist)[good], minlength=npix)
+        flat = np.bincount(target[good], weights=dist[good], minlength=npix)
+        nflat = np.bincount(target[good], minlength=npix)
+        dist_map = np.zeros(npix) + np.inf
+        ix = wsum > 0
+        dist_map[ix] = mean[ix]/wsum[ix]
+        # where there is no probability, the plain mean of the tiles
+        ix = (wsum <= 0) & (nflat > 0)
+        dist_map[ix] = flat[ix]/nflat[ix]
+        maps.append(dist_map)
+
+    # nest to ring
+    nest = hp.ring2nest(nside, np.arange(npix))
+    maps = [m[nest] for m in maps]
+    return maps
+
 #
 # healpix maps have implicit ra,dec-
 # one is supposed to know from position along
@@ -25,75 +25,85 @@ import numpy as np
 # This code wants a list ra,decs and will write a JSON file
 # to cause the Blanco to observe them.
 #
+# Every tiling of tilingList is written, each a pass over the ra,decs at
+# the tiling's offset (tileOffsets), in the order of tilingList.
+# With tilings and filters, one each per ra,dec, each ra,dec is a visit
+# (obsSlots.visitUnits): the exposures of exposureList in that filter, 
+# at that tiling; the visits are written in their tiling's pass.
+# Returns the pass (index in tilingList) of each exposure written, for desJson.
+#
 def writeJson(ra,dec,id, seqid="none", seqnum=0, seqtot=0,
         exposureList = [90,90,90], 
         filterList = ["i","z","z"],
         tilingList = [1, 5],
         trigger_id = "LIGO/Virgo", trigger_type = "bright", propid='propid',
-        skymap="bayestar.fits", jsonFilename="des-gw.json") :
+        skymap="bayestar.fits", jsonFilename="des-gw.json", tilings=None, filters=None) :
     offsets = tileOffsets()
     fd = open(jsonFilename,"w")
     fd.write("[\n")
 
-# we're going to implement tiling by running Francisco's code
-# git clone git@github.com:paztronomer/gw_helper.git
-# which duplicates json files with changes-
-# here we underfill the slot with just 1 tiling,
-# then use gw_helper to duplicate the json with a different
-# dither/tile
-    tilingList = [tilingList[0],]
-
     size = ra.size
+    exposureList = np.atleast_1d(exposureList)
+    filterList = np.atleast_1d(filterList)
+    tilingList = list(np.atleast_1d(tilingList))
     nexp = np.size(exposureList)
     ntiles = np.size(tilingList) 
     seqtot= seqtot*nexp
-    for i in range(0,size) :
-        for k in range(0,ntiles) :
+    # (hex, tiling, exposure) of each image, pass by pass
+    images = []
+    for k in range(0,ntiles) :
+        for i in range(0,size) :
+            if tilings is not None and tilings[i] != tilingList[k] : continue
             for j in range(0,nexp) :
-                seqnum +=1
-                tiling = tilingList[k]
-                filter = filterList[j]
-                exp = exposureList[j]
-                offsets[tiling]
-                delRa = offsets[tiling][0]
-                delDec = offsets[tiling][1]
-                tra = ra[i]
-                tdec = dec[i]
-                tdec = tdec+delDec
-                tra = tra + delRa/np.cos(tdec*2*np.pi/360.)
-                if tra < 0 : tra = tra+360.
-                if tra > 360. : tra = tra-360.
-                #comment = "DESGW: LIGO {} event {}: {} of {}, hex {} tiling {}".format(
-                #    trigger_type, seqid, seqnum, seqtot, id[i], 9)
-                comment = "{} strategy {} on {}: image {} of {}, filter {}, tiling {} in {}".format(
-                    trigger_id, trigger_type, skymap, j+1, nexp, filter, tiling, tilingList)
-                object = trigger_id
+                if filters is not None and filterList[j] != filters[i] : continue
+                images.append((i, k, j))
+    passes = []
+    for n, (i, k, j) in enumerate(images) :
+        seqnum +=1
+        tiling = tilingList[k]
+        filter = filterList[j]
+        exp = exposureList[j]
+        passes.append(k)
+        delRa = offsets[tiling][0]
+        delDec = offsets[tiling][1]
+        tra = ra[i]
+        tdec = dec[i]
+        tdec = tdec+delDec
+        tra = tra + delRa/np.cos(tdec*2*np.pi/360.)
+        if tra < 0 : tra = tra+360.
+        if tra > 360. : tra = tra-360.
+        #comment = "DESGW: LIGO {} event {}: {} of {}, hex {} tiling {}".format(
+        #    trigger_type, seqid, seqnum, seqtot, id[i], 9)
+        comment = "{} strategy {} on {}: image {} of {}, filter {}, tiling {} in {}".format(
+            trigger_id, trigger_type, skymap, j+1, nexp, filter, tiling, tilingList)
+        object = trigger_id
     
-                fd.write("{")
-                fd.write(" \"expType\" : \"object\",\n")
-                fd.write("  \"object\" : \"{}\",\n".format(object))
-                #fd.write("  \"seqid\" : \"{}\",\n".format(seqid))
-                #fd.write("  \"seqnum\" : \"{:d}\",\n".format(int(seqnum)))
-                #fd.write("  \"seqtot\" : \"{:d}\",\n".format(int(seqtot)))
-                fd.write("  \"expTime\" : {:d},\n".format(int(exp)))
-                fd.write("  \"wait\" : \"False\",\n")
-                #fd.write("  \"count\" : \"1\",\n")
-                #fd.write("  \"note\" : \"Added to queue from desgw json file, not obstac\",\n")
-                fd.write("  \"filter\" : \"{}\",\n".format(filter))
-                fd.write("  \"program\" : \"des gw\",\n")
-                fd.write("  \"RA\" : {:.6f},\n".format(tra))
-                fd.write("  \"dec\" : {:.5f},\n".format(tdec))
-                fd.write("  \"propid\" : \"{}\",\n".format(propid))
-                fd.write("  \"comment\" : \"{}\"\n".format(comment)) 
-                # note lack of comma for end
-                fd.write("}")
-                if (i == size-1) and ( j == nexp-1) and ( k == ntiles-1) :
-                    pass
-                else :
-                    fd.write(",")
-                fd.write("\n")
+        fd.write("{")
+        fd.write(" \"expType\" : \"object\",\n")
+        fd.write("  \"object\" : \"{}\",\n".format(object))
+        #fd.write("  \"seqid\" : \"{}\",\n".format(seqid))
+        #fd.write("  \"seqnum\" : \"{:d}\",\n".format(int(seqnum)))
+        #fd.write("  \"seqtot\" : \"{:d}\",\n".format(int(seqtot)))
+        fd.write("  \"expTime\" : {:d},\n".format(int(exp)))
+        fd.write("  \"wait\" : \"False\",\n")
+        #fd.write("  \"count\" : \"1\",\n")
+        #fd.write("  \"note\" : \"Added to queue from desgw json file, not obstac\",\n")
+        fd.write("  \"filter\" : \"{}\",\n".format(filter))
+        fd.write("  \"program\" : \"des gw\",\n")
+        fd.write("  \"RA\" : {:.6f},\n".format(tra))
+        fd.write("  \"dec\" : {:.5f},\n".format(tdec))
+        fd.write("  \"propid\" : \"{}\",\n".format(propid))
+        fd.write("  \"comment\" : \"{}\"\n".format(comment)) 
+        # note lack of comma for end
+        fd.write("}")
+        if n == len(images)-1 :
+            pass
+        else :
+            fd.write(",")
+        fd.write("\n")
     fd.write("]\n")
     fd.close()
+    return passes
 
 # production offsets are in DES docdb 7269
 # production offsets are one based, not zero based:
@@ -1,47 +1,144 @@
 import os
+import sys
 import numpy as np
 from knlc import kn_brightness_estimate
 
-def run_ap_mag_for_kasen_models (filter, distance, dist_err, days_since_burst, 
-        kasen_fraction, data_dir="./", fast=False, doPlots=True) :
+#   plotters, if a list, gets the background process making the plots of
+#   the report (fast=False), for the caller to join; else it is joined here
+def run_ap_mag_for_kasen_models (filter, distance, dist_err, days_since_burst,
+        kasen_fraction, data_dir="./", fast=False, doPlots=True, plotters=None) :
     report_file = data_dir + "kn_report"
     if not fast :
-        knlc_dir = os.getenv("DESGW_DIR", "./")+ "knlc/"
-        code = knlc_dir+"kn_brightness_estimate.py"
-        cmd = "python {} --distance {} --distance_err {} --time_delay {} ".format(
-            code, distance, dist_err, days_since_burst)
-        cmd = cmd + "--fraction {} ".format(kasen_fraction)
+        # the kn_brightness_estimate.py report, made in this process;
+        # the plots are finished by a background process
+        files = dict()
         if doPlots :
-            cmd = cmd + "--magplot_file kn_mag_plot.png "
-            cmd = cmd + "--expplot_file kn_exp_plot.png "
-            cmd = cmd + "--report_file {} ".format(report_file)
-        print(cmd) #ag test 8.5.2020
-        os.system(cmd)
-
-        file = report_file + ".txt"
-        fd = open(file,"r")
-        for i in range(0,16): fd.readline()
-        line = fd.readline().split()
-        apparent_mag = dict()
-        apparent_mag["g"] = np.float(line[0])
-        apparent_mag["r"] = np.float(line[3])
-        apparent_mag["i"] = np.float(line[6])
-        apparent_mag["z"] = np.float(line[9])
-        ap_mag = apparent_mag[filter]
+            files = dict(magplot_file=data_dir+"kn_mag_plot.png",
+                expplot_file=data_dir+"kn_exp_plot.png", report_file=report_file)
+        report = kn_brightness_estimate.brightness_report(distance, dist_err, days_since_burst,
+            fraction=kasen_fraction, **files)
+        if report["plotter"] is not None :
+            if plotters is None : report["plotter"].join()
+            else : plotters.append(report["plotter"])
+        # as the report file has it
+        ap_mag = float("%.2f" % report["cutoffs"][filter])
 
     else :
-        kn_calc         = kn_brightness_estimate.KNCalc(distance, dist_err, days_since_burst)
-        percentile_dict = kn_brightness_estimate.calc_mag_fractions(kn_calc.template_df_full)
-        cutoffs         = kn_brightness_estimate.mags_of_percentile(
-            kasen_fraction, percentile_dict)
-        kn_brightness_estimate.make_output_csv(
-            np.linspace(0., 100., 101), 
-            percentile_dict, 
-            write_answer=True, 
-            flt=filter, 
-            fraction=kasen_fraction,
-            datadir=data_dir)
-        file = data_dir+"answer_{}.txt".format(filter)
-        ap_mag = np.genfromtxt(file)
- 
+        # the KNCalc, calc_mag_fractions, make_output_csv answer, from the table
+        ap_mag = knApparentMag(filter, distance, dist_err, days_since_burst, kasen_fraction)
+
     return ap_mag
+
+#
+# The kn apparent magnitude table.
+#
+# A knlc KNCalc weights every template row by its luminosity distance each
+# time it is made, and mapsAtTimeT wants one every slot. Here the answer of
+# calc_mag_fractions (knlc.mag_fractions_at_delta_mjd), the
+# magnitude at each percentile 0..100 in g,r,i,z, is kept for the nodes of a
+# grid in distance and distance error (knNodeStep Mpc apart) and delta_mjd
+# (the 0.1 day steps of KNCalc), in memory and in $DESGW_CACHE_DIR.
+# Between nodes it is interpolated bilinearly in distance and distance error.
+# At a node the answer is that of the fast KNCalc path, rounded to %.2f
+# as the answer_<filter>.txt file has it.
+#
+#   time_delay is passed to KNCalc as it is, the same as the old path did
+#
+knBands = ["g", "r", "i", "z"]
+knNodeStep = 1.0
+# the percentile magnitudes per (distance, distance_err) node: {delta_mjd : (4,101) array}
+knTableMemo = {}
+# the (distance, delta_mjd) already checked against the template redshift range
+knCheckedMemo = set()
+
+def knApparentMag (filter, distance, dist_err, time_delay, kasen_fraction) :
+    if filter not in knBands :
+        raise Exception("no kn models in filter {}".format(filter))
+    delta_mjd = knDeltaMjd(time_delay)
+    knCheckDistance(distance, delta_mjd)
+
+    percentiles = 0.0
+    for d, d_weight in knNodes(distance) :
+        for e, e_weight in knNodes(dist_err) :
+            percentiles = percentiles + d_weight*e_weight*knPercentiles(d, e, delta_mjd)
+
+    # as make_output_csv, the closest percentile to the fraction
+    fraction = kasen_fraction
+    if fraction < 1.0 :
+        fraction *= 100
+    index = np.argmin(np.abs(float(fraction) - np.linspace(0., 100., 101)))
+    ap_mag = percentiles[knBands.index(filter), index]
+    return float("%.2f" % ap_mag)
+
+# as KNCalc
+def knDeltaMjd (time_delay) :
+    if float(time_delay) > 400.8:
+        print("Currently, only time delays less than 400.8 hours (16.7 days) post merger are supported")
+        sys.exit()
+    return round(float(time_delay) / 24.0, 1)
+
+# the grid nodes about x and their weights; x itself if the lower node is not above zero
+def knNodes (x, step=knNodeStep) :
+    low = np.floor(x/step)*step
+    if low <= 0 or low == x :
+        return [(x, 1.0)]
+    t = (x-low)/step
+    return [(low, 1.0-t), (low+step, t)]
+
+# as KNCalc, exit if no template bin holds the distance
+def knCheckDistance (distance, delta_mjd) :
+    if (distance, delta_mjd) in knCheckedMemo : return
+    mean_z = kn_brightness_estimate.redshift_at_distance(float(distance))
+    t = kn_brightness_estimate.template_columns(delta_mjd, ["ZMIN", "ZMAX"])
+    if not np.any((t["ZMIN"] < mean_z) & (t["ZMAX"] > mean_z)) :
+        store, index = kn_brightness_estimate.template_store(
+            kn_brightness_estimate.photometry_file(delta_mjd))
+        if not all(index["zmax"] > mean_z) :
+            print("Object is too far away. mean_z is "+str(mean_z)+". Exiting.")
+            sys.exit()
+        else :
+            print("Something wrong with knlc photometry template library. Exiting")
+            sys.exit()
+    knCheckedMemo.add((distance, delta_mjd))
+
+def knPercentiles (distance, dist_err, delta_mjd) :
+    node = (float(distance), float(dist_err))
+    if node not in knTableMemo :
+        knTableMemo[node] = knReadTable(distance, dist_err)
+    table = knTableMemo[node]
+    if delta_mjd not in table :
+        table[delta_mjd] = knCalcPercentiles(distance, dist_err, delta_mjd)
+        knWriteTable(distance, dist_err, table)
+    return table[delta_mjd]
+
+# calc_mag_fractions on the template_df_full of KNCalc
+def knCalcPercentiles (distance, dist_err, delta_mjd) :
+    percentile_dict = kn_brightness_estimate.mag_fractions_at_delta_mjd(
+        delta_mjd, [distance], [dist_err])
+    return np.array([percentile_dict[band+"_cutoff"][0] for band in knBands])
+
+def knTableFile (distance, dist_err) :
+    cache_dir = os.getenv("DESGW_CACHE_DIR", "./")
+    return os.path.join(cache_dir, "knMagTable-{:.3f}-{:.3f}.npz".format(distance, dist_err))
+
+def knReadTable (distance, dist_err) :
+    table = dict()
+    file = knTableFile(distance, dist_err)
+    if os.path.exists(file) :
+        data = np.load(file)
+        for delta_mjd, percentiles in zip(data["delta_mjd"], data["percentiles"]) :
+            table[float(delta_mjd)] = percentiles
+    return table
+
+def knWriteTable (distance, dist_err, table) :
+    file = knTableFile(distance, dist_err)
+    cache_dir = os.path.dirname(file)
+    if cache_dir != "" and not os.path.exists(cache_dir) : os.makedirs(cache_dir)
+    delta_mjd = sorted(table.keys())
+    percentiles = np.array([table[d] for d in delta_mjd])
+    # write then rename, so that a reader never sees a partial file
+    tmp_file = file + ".{}.tmp".format(os.getpid())
+    fd = open(tmp_file, "wb")
+    np.savez(fd, delta_mjd=np.array(delta_mjd), percentiles=percentiles)
+    fd.close()
+    os.rename(tmp_file, file)
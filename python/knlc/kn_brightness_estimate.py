@@ -12,8 +12,6 @@ import sys
 import os
 
 from astropy.cosmology import WMAP9 as cosmo
-from astropy.cosmology import z_at_value
-import astropy.units as u
 
 # Handle command-line arguments
 class KNCalc():
@@ -28,33 +26,16 @@ class KNCalc():
             sys.exit()
         self.delta_mjd = round(float(time_delay) / 24.0, 1)
         
-        # Set directory for lookup table
-        knlc_dir = os.getenv("DESGW_DIR", "./")
-        if knlc_dir != "./" : knlc_dir = knlc_dir + "/knlc/"
-            
-        # Choose lookup table based on time_delay
-        if self.delta_mjd < 2.3:
-            df = pd.read_csv(knlc_dir+'data/grouped_photometry.csv')
-        elif self.delta_mjd < 4.7:
-            df = pd.read_csv(knlc_dir+'data/grouped_photometry_2.csv')
-        elif self.delta_mjd < 7.1:
-            df = pd.read_csv(knlc_dir+'data/grouped_photometry_3.csv')
-        elif self.delta_mjd < 9.5:
-            df = pd.read_csv(knlc_dir+'data/grouped_photometry_4.csv')
-        elif self.delta_mjd < 11.9:
-            df = pd.read_csv(knlc_dir+'data/grouped_photometry_5.csv')
-        elif self.delta_mjd < 14.3:
-            df = pd.read_csv(knlc_dir+'data/grouped_photometry_6.csv')
-        elif self.delta_mjd < 16.7:
-            df = pd.read_csv(knlc_dir+'data/grouped_photometry_7.csv')
+        # Choose lookup table based on time_delay, and take only the rows at delta_mjd
+        df = template_frame(self.delta_mjd)
         df['ZMEAN'] = np.mean(df[['ZMIN', 'ZMAX']].values, axis=1)
 
         # Mean distance calculation 
-        mean_z = z_at_value(cosmo.luminosity_distance, float(self.distance) * u.Mpc)
-        template_df_mean = df[(df['ZMIN'].values < mean_z) & (df['ZMAX'].values > mean_z) & (df['DELTA_MJD'].values == self.delta_mjd)].copy().reset_index(drop=True)
+        mean_z = redshift_at_distance(float(self.distance))
+        template_df_mean = df[(df['ZMIN'].values < mean_z) & (df['ZMAX'].values > mean_z)].copy().reset_index(drop=True)
         # check that the event is not too far away
         if template_df_mean.empty:
-            checkzmax = df['ZMAX'].values > mean_z
+            checkzmax = template_store(photometry_file(self.delta_mjd))[0]['ZMAX'] > mean_z
             if not all(checkzmax):
                 print("Object is too far away. mean_z is "+str(mean_z)+". Exiting.")
                 sys.exit()
@@ -66,8 +47,8 @@ class KNCalc():
         self.template_df_mean = template_df_mean
 
         # Full distance calculation
-        template_df_full = df[df['DELTA_MJD'].values == self.delta_mjd].copy().reset_index(drop=True)
-        weights = [norm.pdf(x.value, loc=float(self.distance), scale=float(self.distance_err)) for x in cosmo.luminosity_distance(template_df_full['ZMEAN'].values)]
+        template_df_full = df.copy().reset_index(drop=True)
+        weights = norm.pdf(luminosity_distance(template_df_full['ZMEAN'].values), loc=float(self.distance), scale=float(self.distance_err))
         template_df_full['WEIGHT'] = weights / np.sum(weights)
         self.template_df_full = template_df_full
 
@@ -75,6 +56,162 @@ class KNCalc():
 
         
 
+# The lookup table of template photometry for a delta_mjd (days)
+def photometry_file(delta_mjd):
+    # Set directory for lookup table
+    knlc_dir = os.getenv("DESGW_DIR", "./")
+    if knlc_dir != "./" : knlc_dir = knlc_dir + "/knlc/"
+
+    if delta_mjd < 2.3:
+        name = 'grouped_photometry.csv'
+    elif delta_mjd < 4.7:
+        name = 'grouped_photometry_2.csv'
+    elif delta_mjd < 7.1:
+        name = 'grouped_photometry_3.csv'
+    elif delta_mjd < 9.5:
+        name = 'grouped_photometry_4.csv'
+    elif delta_mjd < 11.9:
+        name = 'grouped_photometry_5.csv'
+    elif delta_mjd < 14.3:
+        name = 'grouped_photometry_6.csv'
+    elif delta_mjd < 16.7:
+        name = 'grouped_photometry_7.csv'
+    return knlc_dir + 'data/' + name
+
+# The template library as a columnar binary store, made once from each csv
+# file in $DESGW_CACHE_DIR/knlc-<file>/ and memory mapped when read, so
+# that only the rows of one DELTA_MJD are touched. One .npy per numeric column,
+# with the rows grouped by DELTA_MJD, in csv order within a group, and
+# index.npz:
+#   delta_mjd, start, end   the rows [start:end] of each DELTA_MJD
+#   zmin, zmax              the redshift bins; the ZBIN column indexes them
+template_store_memo = {}
+
+def template_store_dir(file):
+    cache_dir = os.getenv("DESGW_CACHE_DIR", "./")
+    name = os.path.splitext(os.path.basename(file))[0]
+    return os.path.join(cache_dir, "knlc-" + name)
+
+def build_template_store(file):
+    store_dir = template_store_dir(file)
+    print("building knlc template store {} from {}".format(store_dir, file))
+    df = pd.read_csv(file)
+    order = np.argsort(df['DELTA_MJD'].values, kind='mergesort')
+    delta_mjd = df['DELTA_MJD'].values[order]
+    index_delta_mjd, start = np.unique(delta_mjd, return_index=True)
+    end = np.append(start[1:], delta_mjd.size)
+    bins = np.array([df['ZMIN'].values, df['ZMAX'].values]).T[order]
+    bins, zbin = np.unique(bins, axis=0, return_inverse=True)
+
+    # write into a temporary directory, then rename, so a reader never sees part of a store
+    tmp_dir = store_dir + ".{}.tmp".format(os.getpid())
+    if not os.path.exists(tmp_dir): os.makedirs(tmp_dir)
+    for col in df.select_dtypes(include=[np.number]).columns:
+        np.save(os.path.join(tmp_dir, col + '.npy'), df[col].values[order])
+    np.save(os.path.join(tmp_dir, 'ZBIN.npy'), zbin)
+    np.savez(os.path.join(tmp_dir, 'index.npz'), delta_mjd=index_delta_mjd, start=start, end=end,
+        zmin=bins[:, 0], zmax=bins[:, 1])
+    try:
+        os.rename(tmp_dir, store_dir)
+    except OSError:
+        # another process made it first
+        import shutil
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+# the columns (memory mapped) and index of the store of a csv file, built if need be
+def template_store(file):
+    if file not in template_store_memo:
+        store_dir = template_store_dir(file)
+        if not os.path.exists(store_dir):
+            build_template_store(file)
+        index = dict(np.load(os.path.join(store_dir, 'index.npz')))
+        columns = {}
+        for name in sorted(os.listdir(store_dir)):
+            if name.endswith('.npy'):
+                columns[name[:-4]] = np.load(os.path.join(store_dir, name), mmap_mode='r')
+        template_store_memo[file] = (columns, index)
+    return template_store_memo[file]
+
+# the rows at delta_mjd of the library, as {column: array}; no rows if it has none
+def template_columns(delta_mjd, columns=None):
+    store, index = template_store(photometry_file(delta_mjd))
+    ix, = np.where(index['delta_mjd'] == delta_mjd)
+    start, end = 0, 0
+    if ix.size > 0:
+        start, end = index['start'][ix[0]], index['end'][ix[0]]
+    if columns is None:
+        columns = store.keys()
+    return {col: np.array(store[col][start:end]) for col in columns}
+
+def template_frame(delta_mjd):
+    return pd.DataFrame(template_columns(delta_mjd))
+
+# The WMAP9 luminosity distance (Mpc) on a redshift grid, made once and kept
+# in $DESGW_CACHE_DIR; distances and redshifts are interpolated on it.
+dl_grid_z = np.linspace(0.0, 2.0, 20001)
+dl_grid_memo = {}
+
+def luminosity_distance_grid():
+    if 'dl' not in dl_grid_memo:
+        cache_dir = os.getenv("DESGW_CACHE_DIR", "./")
+        file = os.path.join(cache_dir, "knlc-wmap9-luminosity-distance.npy")
+        dl = None
+        if os.path.exists(file):
+            dl = np.load(file)
+        if dl is None or dl.size != dl_grid_z.size:
+            dl = cosmo.luminosity_distance(dl_grid_z).value
+            if cache_dir != "" and not os.path.exists(cache_dir): os.makedirs(cache_dir)
+            tmp_file = file + ".{}.tmp".format(os.getpid())
+            fd = open(tmp_file, "wb")
+            np.save(fd, dl)
+            fd.close()
+            os.rename(tmp_file, file)
+        dl_grid_memo['dl'] = dl
+    return dl_grid_z, dl_grid_memo['dl']
+
+def luminosity_distance(z):
+    z_grid, dl_grid = luminosity_distance_grid()
+    return np.interp(z, z_grid, dl_grid)
+
+# in place of astropy z_at_value
+def redshift_at_distance(distance):
+    z_grid, dl_grid = luminosity_distance_grid()
+    return np.interp(distance, dl_grid, z_grid)
+
+# calc_mag_fractions(KNCalc(distance, distance_err, time_delay).template_df_full)
+# for many (distance, distance_err) pairs at once, for campaign studies:
+#   {'g_cutoff': (pairs x 101) array, ...}
+def batch_mag_fractions(distances, distance_errs, time_delay):
+    if float(time_delay) > 400.8:
+        print("Currently, only time delays less than 400.8 hours (16.7 days) post merger are supported")
+        sys.exit()
+    delta_mjd = round(float(time_delay) / 24.0, 1)
+    return mag_fractions_at_delta_mjd(delta_mjd, distances, distance_errs)
+
+def mag_fractions_at_delta_mjd(delta_mjd, distances, distance_errs):
+    import scipy.sparse
+    bands = ['g', 'r', 'i', 'z']
+    data = template_columns(delta_mjd, ['SIM_TEMPLATE_INDEX', 'ZMIN', 'ZMAX'] + ['MAG_%s' % band for band in bands])
+    zmean = np.mean(np.array([data['ZMIN'], data['ZMAX']]).T, axis=1)
+    distances = np.atleast_1d(np.asarray(distances, dtype=float))[:, np.newaxis]
+    distance_errs = np.atleast_1d(np.asarray(distance_errs, dtype=float))[:, np.newaxis]
+
+    # (pairs x rows) weights, normalized per pair as in KNCalc
+    weights = norm.pdf(luminosity_distance(zmean)[np.newaxis, :], loc=distances, scale=distance_errs)
+    weights = weights / np.sum(weights, axis=1)[:, np.newaxis]
+    # (rows x templates) membership, to sum the rows of each template
+    templates, inverse = np.unique(data['SIM_TEMPLATE_INDEX'], return_inverse=True)
+    member = scipy.sparse.csr_matrix((np.ones(inverse.size), (np.arange(inverse.size), inverse)),
+        shape=(inverse.size, templates.size))
+    weight_sums = member.T.dot(weights.T).T
+
+    percentile_levels = np.linspace(0.0, 100.0, 101)
+    percentile_dict = {}
+    for band in bands:
+        mags = member.T.dot((weights * data['MAG_%s' % band]).T).T / weight_sums
+        percentile_dict['%s_cutoff' % band] = np.nanpercentile(mags, q=percentile_levels, axis=1).T
+    return percentile_dict
+
 ### Functions to calculate metrics of interest
 def weighted_average(quantity, weights):
     return np.dot(quantity, weights) / np.sum(weights)
@@ -294,6 +431,58 @@ def make_exptime_plot(percentile_dict, title='', outfile=None):
 
     return
 
+# The report of the command line, made in the calling process.
+#   Returns a dict: 'percentiles' the calc_mag_fractions percentile_dict,
+#   'cutoffs' the g,r,i,z magnitudes that fraction of the models are brighter than,
+#   and 'blue', 'red' the GW170817 magnitudes.
+#   The report files are written as the command line has always written them.
+#   The plots are made by a forked process, returned as 'plotter' (None if
+#   there are no plots); join it to be sure the plot files are written.
+def brightness_report(distance, distance_err, time_delay, fraction=90, filter=None,
+                      magplot_file=None, expplot_file=None, report_file=None):
+    fraction = float(fraction)
+    kn_calc = KNCalc(float(distance), float(distance_err), float(time_delay))
+
+    blue, red = gw170817(kn_calc.template_df_full)
+    if report_file:
+        # a report of this call only
+        if os.path.exists(report_file + '.txt'):
+            os.remove(report_file + '.txt')
+        print_dict(blue, "GW170817-blue", outfile=report_file)
+        print_dict(red, "GW170817-red", outfile=report_file)
+
+    percentile_dict = calc_mag_fractions(kn_calc.template_df_full)
+    cutoffs = mags_of_percentile(fraction, percentile_dict)
+    cutoff_dict = {'%s_mag' %k : v for k, v in cutoffs.items()}
+    for band in ['g', 'r', 'i', 'z']:
+        cutoff_dict['%s_magerr' %band] = 0.00
+
+    if filter:
+        make_output_csv(np.linspace(0., 100., 101), percentile_dict, outfile=report_file, write_answer=True, flt=filter, fraction=fraction)
+    else:
+        make_output_csv(np.linspace(0., 100., 101), percentile_dict, outfile=report_file)
+
+    if fraction < 1.0:
+        print_dict(cutoff_dict, "%.2f Detection Probability Magnitude Thresholds" %float(fraction * 100), outfile=report_file)
+    else:
+        print_dict(cutoff_dict, "%.2f Detection Probability Magnitude Thresholds" %float(fraction), outfile=report_file)
+
+    plotter = None
+    if magplot_file or expplot_file:
+        import multiprocessing
+        plot_title = "%s +/- %s Mpc  -- %.2f Days After Merger" %(distance, distance_err, float(time_delay) / 24.0)
+        plotter = multiprocessing.Process(target=make_report_plots,
+                                          args=(percentile_dict, blue, red, plot_title, magplot_file, expplot_file, fraction))
+        plotter.start()
+
+    return {'percentiles': percentile_dict, 'cutoffs': cutoffs, 'blue': blue, 'red': red, 'plotter': plotter}
+
+def make_report_plots(percentile_dict, blue, red, title, magplot_file, expplot_file, fraction):
+    if magplot_file:
+        make_plot(percentile_dict, blue, red, title=title, outfile=magplot_file, fraction=fraction)
+    if expplot_file:
+        make_exptime_plot(percentile_dict, title=title, outfile=expplot_file)
+
 if __name__ == '__main__':
     parser = OptionParser(__doc__)
     parser.add_option('--distance', default=None, help="LVC luminosity distance in Mpc")
@@ -328,37 +517,7 @@ if __name__ == '__main__':
             print("ERROR: filter argument must be in ['g', 'r', 'i', 'z']")
             sys.exit()
 
-    kn_calc = KNCalc(float(options.distance), float(options.distance_err), float(options.time_delay))
-
-    if options.report_file:
-        blue, red = gw170817(kn_calc.template_df_full)
-        print_dict(blue, "GW170817-blue", outfile=options.report_file)
-        print_dict(red, "GW170817-red", outfile=options.report_file)
-
-
-    percentile_dict = calc_mag_fractions(kn_calc.template_df_full)
-    cutoffs = mags_of_percentile(float(options.fraction), percentile_dict)
-    cutoff_dict = {'%s_mag' %k : v for k, v in cutoffs.iteritems()}
-    for band in ['g', 'r', 'i', 'z']:
-        cutoff_dict['%s_magerr' %band] = 0.00
-    
-    if options.filter:
-        make_output_csv(np.linspace(0., 100., 101), percentile_dict, outfile=options.report_file, write_answer=True, flt=options.filter, fraction=options.fraction)
-    else:
-        make_output_csv(np.linspace(0., 100., 101), percentile_dict, outfile=options.report_file)
-    
-    if options.fraction < 1.0:
-        print_dict(cutoff_dict, "%.2f Detection Probability Magnitude Thresholds" %float(options.fraction * 100), outfile=options.report_file)
-    else:
-        print_dict(cutoff_dict, "%.2f Detection Probability Magnitude Thresholds" %float(options.fraction), outfile=options.report_file)
-
-    plot_title = "%s +/- %s Mpc  -- %.2f Days After Merger" %(options.distance, options.distance_err, float(options.time_delay) / 24.0)
-    if options.magplot_file:
-        make_plot(percentile_dict, blue, red, title=plot_title, outfile=options.magplot_file, fraction=options.fraction)
-    if options.expplot_file:
-        make_exptime_plot(percentile_dict, title=plot_title, outfile=options.expplot_file)
-
-
-
-
-
+    brightness_report(options.distance, options.distance_err, options.time_delay,
+                      fraction=options.fraction, filter=options.filter,
+                      magplot_file=options.magplot_file, expplot_file=options.expplot_file,
+                      report_file=options.report_file)
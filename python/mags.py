@@ -6,6 +6,7 @@ from pyslalib import slalib
 import atmosphere  
 import telescope
 import dustModel  
+import auxMaps
 import seeingModel
 import skyModel
 from equalArea import mcbryde
@@ -56,31 +57,12 @@ class observed(object):
             degradeRes=True, # change map resolution
             doMaps=True,  # don't think of ra,dec,vals as a healpy map; don't do map work
             camera="decam",
-            verbose=True   # be very loud or no
+            verbose=True,   # be very loud or no
+            pixels=None    # restrict the map to these pixels (a cumul.credibleRegion working set)
         ) :
         self.verbose      = verbose
         data_dir          = os.environ["DESGW_DATA_DIR"]
-        ctio_lat          = -30.16527778
-        ctio_lon          = -70.8125
-        ctio_height       = 2215.
-        kpno_lat          = 31.9600784
-        kpno_lon          = -111.598169
-        kpno_height       =  2067.
-        maunakea_lat      = 19.826667
-        maunakea_lon      = -155.471667
-        maunakea_height   = 4215.
-        if camera == "decam" or camera == "des":
-            obs_lat = ctio_lat
-            obs_lon = ctio_lon
-            obs_height = ctio_height
-        elif camera == "desi" :
-            obs_lat = kpno_lat
-            obs_lon = kpno_lon
-            obs_height = kpno_height
-        elif camera == "hsc" :
-            obs_lat = maunakea_lat
-            obs_lon = maunakea_lon
-            obs_height = maunakea_height
+        obs_lat, obs_lon, obs_height = observatorySite(camera)
         self.observatory = camera
 
         self.date         = slalib.sla_djcl(mjd)
@@ -91,13 +73,18 @@ class observed(object):
         self.height       = obs_height
 
         self.mjd          = mjd
-        self.ra           = ra*self.degToRad
-        self.dec          = dec*self.degToRad
-        self.map          = values
+        # with pixels, ra,dec,values are still the full sky map; keep them for fullSkyMaps
+        self.pixels       = pixels
         if doMaps :
             self.nside        = hp.npix2nside(values.size)
         else :
             self.nside        = 0
+        if pixels is not None :
+            self.fullRa, self.fullDec, self.fullMap = ra, dec, values
+            ra, dec, values = ra[pixels], dec[pixels], values[pixels]
+        self.ra           = ra*self.degToRad
+        self.dec          = dec*self.degToRad
+        self.map          = values
 
         # observational astronomy
         self.lst          = self.mjdToLST(self.mjd, self.lon)
@@ -115,33 +102,42 @@ class observed(object):
         # telescope limits
         self.limits       = 0.0
 
-        # galactic dust
-        dust_dir          = data_dir
-        dust_file         = "plank-ebv-HFI_CompMap_ThermaDustModel.fits"
-        ra,dec,ebv        = dustModel.loadDust(dust_dir, dust_file)
+        # galactic dust, from the per nside cache of auxMaps
         if degradeRes :
-            ra,dec,ebv    = hp2np.map2np (ebv, resolution=self.nside, fluxConservation=False)
+            ra,dec,ebv    = auxMaps.auxMap2np("ebv", self.nside, verbose=verbose)
+        else :
+            ra,dec,ebv    = auxMaps.auxMap2np("ebv", verbose=verbose)
+            # in radians, as dustModel.loadDust
+            ra = ra*2*np.pi/360.
+            dec = dec*2*np.pi/360.
         if not doMaps :
             ra      = self.ra/self.degToRad
             dec     = self.dec/self.degToRad
             ebv = hp.get_interp_val(ebv, ra,dec, lonlat=True)
             ra      = self.ra
             dec     = self.dec
+        # the extinction is relative to the least ebv of the full sky
+        self.ebv_min      = ebv.min()
+        if pixels is not None and doMaps :
+            ra,dec,ebv = ra[pixels], dec[pixels], ebv[pixels]
         self.dust_ra      = ra
         self.dust_dec     = dec
         self.ebv          = ebv
 
         # stellar density in the form of a probability of recognizing object map
         print "\t loading inverse stellar density = probability of recognition map"
-        ra,dec,precog     = hp2np.hp2np(data_dir + "precognize.fits")
         if degradeRes :
-            ra,dec,precog = hp2np.map2np (precog, resolution=self.nside, fluxConservation=False)
+            ra,dec,precog = auxMaps.auxMap2np("precog", self.nside, verbose=verbose)
+        else :
+            ra,dec,precog = auxMaps.auxMap2np("precog", verbose=verbose)
         if not doMaps :
             ra      = self.ra/self.degToRad
             dec     = self.dec/self.degToRad
             precog = hp.get_interp_val(precog, ra,dec, lonlat=True)
             ra      = self.ra
             dec     = self.dec
+        if pixels is not None and doMaps :
+            ra,dec,precog = ra[pixels], dec[pixels], precog[pixels]
         self.pra          = ra
         self.pdec         = dec
         self.precog       = precog
@@ -157,6 +153,46 @@ class observed(object):
         # for the right Mcbryde plot, which projects onto a flat x,y page
         # plt.axes().set_aspect('equal')
 
+    # for a map restricted to a working set of pixels: 
+    #   values on the working set put back onto the full sky, fill elsewhere
+    def fullSky (self, values, fill=0.0) :
+        if self.pixels is None : return values
+        full = np.zeros(self.fullMap.size, dtype=np.asarray(values).dtype) + fill
+        full[self.pixels] = values
+        return full
+
+    #   a full sky map restricted to the working set
+    def restrict (self, values) :
+        if self.pixels is None : return values
+        return values[self.pixels]
+
+    #   the maps of the current time that slotMaps.writeSlot writes, full sky: 
+    #   ha, hx, hy from the full sky ra,dec, and the limiting magnitudes from
+    #   the full sky arrays of conditions, if it is a cached nightConditions
+    #   holding this time, else those of the working set, zero elsewhere.
+    #   No full sky observed (limitMag) is made.
+    def fullSkyMaps (self, conditions=None) :
+        if self.pixels is None :
+            maps = dict(ha=self.ha, hx=self.hx, hy=self.hy, maglim=self.maglim)
+            maps["maglim-global"] = self.maglimall
+            return maps
+        ra, dec = self.fullRa*self.degToRad, self.fullDec*self.degToRad
+        ha = self.lst - ra
+        ix = np.nonzero(ha > 180.*2*np.pi/360.)
+        ha[ix] = ha[ix] - 360*2*np.pi/360.
+        hx,hy = mcbryde.mcbryde(ha/self.degToRad, dec/self.degToRad, alpha=self.mcbryde_alpha)
+        maps = dict(ha=ha, hx=hx, hy=hy)
+        full = fullNightConditions(conditions)
+        islot = -1
+        if full is not None : islot = full.indexOfMjd(self.mjd)
+        if islot > -1 :
+            maps["maglim"] = full.maglim[islot]
+            maps["maglim-global"] = full.maglimall[islot]
+        else :
+            maps["maglim"] = self.fullSky(self.maglim)
+            maps["maglim-global"] = self.fullSky(self.maglimall)
+        return maps
+
     # change to a new time
     def resetTime (self, mjd) :
         self.mjd          = mjd
@@ -171,6 +207,34 @@ class observed(object):
         self.moonRa       = self.moonData[0]
         self.moonDec      = self.moonData[1]
 
+    # move to another night: resetTime, and the moon phase of the new time
+    def resetNight (self, mjd) :
+        self.resetTime(mjd)
+        self.moonPhase    = self.getLunarPhase()
+
+    # change to slot islot of a nightConditions, without recomputing:
+    #   the same as resetTime then limitMag at conditions.mjd[islot]
+    def setConditions (self, conditions, islot) :
+        self.mjd          = conditions.mjd[islot]
+        self.lst          = conditions.lst[islot]
+        self.ha           = conditions.ha[islot]
+        self.zd           = conditions.zd[islot]
+        self.airmass      = conditions.airmass[islot]
+        self.sunData      = conditions.sunData[islot]
+        self.sunZD        = self.sunData[2]
+        self.moonData     = conditions.moonData[islot]
+        self.moonZD       = self.moonData[2]
+        self.moonSep      = conditions.moonSep[islot]
+        self.moonRa       = self.moonData[0]
+        self.moonDec      = self.moonData[1]
+        if not conditions.sunIsUp[islot] :
+            self.limits   = conditions.limits[islot].astype(np.float64)
+        alpha = self.mcbryde_alpha
+        self.x,self.y   = mcbryde.mcbryde(self.ra/self.degToRad, self.dec/self.degToRad, alpha=alpha)
+        self.hx,self.hy = mcbryde.mcbryde(self.ha/self.degToRad, self.dec/self.degToRad, alpha=alpha)
+        self.maglim       = conditions.maglim[islot]
+        self.maglimall    = conditions.maglimall[islot]
+
     def limitMag (self, filter, exposure=30, verbose=True) :
         #print "\t JTA limiting magnitude", self.mjd, self.mjdToLST(self.mjd, self.lon)
         #print self.ha[int(self.ha.size/2.)]
@@ -189,7 +253,7 @@ class observed(object):
             mglobal = np.copy(ebv)*0.1+-10.0
             print "\t ... the sun is up"
         else :
-            dust    = self.dustTransmission(filter, ebv)
+            dust    = self.dustTransmission(filter, ebv, self.ebv_min)
             atmo    = self.atmosphereTransmission(zd, airmass, filter, moon_sep)
             seeing  = self.seeing(airmass, filter, seeingAtZenith=0.9)
             sky     = self.skyBrightness(zd, moon_zd, moon_sep, moon_phase, filter) 
@@ -198,12 +262,7 @@ class observed(object):
             telescope = self.telescopeLimits(self.ha, self.dec)
             self.limits =telescope
 
-            if filter == "g" : m_zp = 23.3
-            elif filter == "r" :m_zp = 23.4
-            elif filter == "i" :m_zp = 22.9
-            elif filter == "z" :m_zp = 22.5
-            elif filter == "y" :m_zp = 20.6
-            else : raise Exception("no such filter")
+            m_zp = zeroPoint(filter)
             
             SN = telescope*dust*atmo*(1./seeing)*np.sqrt(exposure/30.)
             ix = np.nonzero( SN <= 0)
@@ -234,9 +293,9 @@ class observed(object):
         self.maglim = m
         self.maglimall = mglobal
 
-    def dustTransmission(self, filter, ebv) :
+    def dustTransmission(self, filter, ebv, ebv_min=None) :
         if self.verbose: print "\t ... dust"
-        dustTransmission = dustModel.dustTransmission(filter, ebv)
+        dustTransmission = dustModel.dustTransmission(filter, ebv, ebv_min)
         return dustTransmission
 
     def atmosphereTransmission(self, zd, airmass, filter, moon_sep, refAirmass=1.3) :
@@ -251,16 +310,11 @@ class observed(object):
 
     def telescopeLimits (self, ha, dec) :
         if self.verbose: print "\t ... telescope limits"
-        if self.observatory == "decam" or self.observatory == "des" :
-            #limits = telescope.blancoLimits(ha, dec)
-            #print "HACK HACK HACK"
-            limits = np.zeros(ha.size)
-            ix = self.zd*360./2/np.pi <= 67.5
-            limits[ix] = 1.0
-        elif self.observatory == "desi" or self.observatory == "hsc" :
-            limits = np.zeros(ha.size)
-            ix = self.zd*360./2/np.pi <= 80.
-            limits[ix] = 1.0
+        #limits = telescope.blancoLimits(ha, dec)
+        #print "HACK HACK HACK"
+        limits = np.zeros(ha.size)
+        ix = self.zd*360./2/np.pi <= telescopeZDLimit(self.observatory)
+        limits[ix] = 1.0
         return limits 
 
     def seeing(self, airmass, wavelength=775., seeingAtZenith=1.0) :
@@ -399,7 +453,306 @@ class observed(object):
         ahav = 2*np.arcsin(np.sqrt(x))
         return ahav
 
-def findNightDuration(mjd, camera="decam") :
+#
+# The observing conditions for every slot of a night at once.
+#
+# resetTime then limitMag does the whole sky one slot at a time. Here only
+# the per slot quantities (lst, the sun and the moon) are done slot by slot,
+# with slalib; the per pixel quantities are broadcast to (slots x pixels)
+# arrays in float32:
+#   ha, zd, airmass, moonSep, sky, maglim, maglimall, limits
+# with sky brightness and limiting magnitude done only where the sun is down
+# (sky is nan, the maglims are limitMag's sun-is-up values, where it is up).
+# The pixels are those of obs (so a working set if obs has one), or with
+# fullSky the whole sky even if obs has a working set. As in observed, 
+# the moon phase is that of obs, fixed when obs was made.
+# With geometry, a nightConditions of the same pixels on another night, the
+# slots at its local sidereal times take ha, zd, airmass and limits from it
+# (see geometryRows).
+#
+#   conditions = mags.nightConditions(obs, start_mjd+slot_times, "i", exposure=90)
+#   later = mags.nightConditions(obs, start_mjd+2*mags.siderealDay+slot_times, "i",
+#       exposure=90, geometry=conditions)
+#   conditions.indexOfMjd(mjd)              # the slot at mjd, -1 if none
+#   obs.setConditions(conditions, islot)
+#
+class nightConditions(object):
+    """
+    """
+    def __init__(self, obs, mjds, filter, exposure=30, dtype=np.float32, fullSky=False,
+            geometry=None) :
+        """
+        """
+        mjds = np.atleast_1d(np.asarray(mjds, dtype=np.float64))
+        self.mjd = mjds
+        self.filter = filter
+        self.exposure = exposure
+        self.observatory = obs.observatory
+        lat = obs.lat
+        lon = obs.lon
+        obs_ra, obs_dec, obs_ebv = obs.ra, obs.dec, obs.ebv
+        if fullSky and obs.pixels is not None :
+            obs_ra, obs_dec = obs.fullRa*obs.degToRad, obs.fullDec*obs.degToRad
+            obs_ebv = auxMaps.auxMap2np("ebv", obs.nside, verbose=False)[2]
+
+        # per slot
+        lst, sunData, moonData = [], [], []
+        for mjd in mjds :
+            this_lst = slalib.sla_gmst(mjd) + slalib.sla_eqeqx(mjd) + lon
+            lst.append(this_lst)
+            ra, dec, diam = slalib.sla_rdplan(mjd, 0, lon, lat)
+            sunData.append([ra, dec, obs.zenithDistance(this_lst - ra, dec, lat)])
+            ra, dec, diam = slalib.sla_rdplan(mjd, 3, lon, lat)
+            moonData.append([ra, dec, obs.zenithDistance(this_lst - ra, dec, lat)])
+        self.lst = np.array(lst)
+        self.sunData = np.array(sunData)
+        self.moonData = np.array(moonData)
+        self.sunIsUp = np.array([obs.sunBrightnessModel(zd) for zd in self.sunData[:,2]])
+
+        # per slot and pixel
+        ra = obs_ra.astype(dtype)[np.newaxis,:]
+        dec = obs_dec.astype(dtype)[np.newaxis,:]
+        lst = self.lst.astype(dtype)[:,np.newaxis]
+        moon_ra = self.moonData[:,0].astype(dtype)[:,np.newaxis]
+        moon_dec = self.moonData[:,1].astype(dtype)[:,np.newaxis]
+        moon_zd = self.moonData[:,2].astype(dtype)[:,np.newaxis]
+        # the geometry of a slot at the lst of a slot of geometry is taken from it
+        rows = geometryRows(geometry, self.lst, ra.shape[1])
+        have, = np.nonzero(rows >= 0)
+        fresh, = np.nonzero(rows < 0)
+        if fresh.size == mjds.size :
+            self.ha, self.zd, self.airmass, self.limits = slotGeometry(obs, lst, ra, dec, lat, dtype)
+        else :
+            shape = (mjds.size, ra.shape[1])
+            self.ha, self.zd, self.airmass = [np.zeros(shape, dtype=dtype) for i in range(3)]
+            self.limits = np.zeros(shape, dtype=bool)
+            for name in ["ha", "zd", "airmass", "limits"] :
+                getattr(self, name)[have] = getattr(geometry, name)[rows[have]]
+            if fresh.size > 0 :
+                ha, zd, airmass, limits = slotGeometry(obs, lst[fresh], ra, dec, lat, dtype)
+                self.ha[fresh], self.zd[fresh], self.airmass[fresh], self.limits[fresh] = \
+                    ha, zd, airmass, limits
+        zd = self.zd
+        self.moonSep = obs.gc_separation(ra, dec, moon_ra, moon_dec)
+
+        # limiting magnitude, as observed.limitMag, done only for the dark slots
+        ebv = obs_ebv.astype(dtype)
+        self.maglim = np.zeros(zd.shape, dtype=dtype) + (ebv*0.1+-10.0)
+        self.maglimall = np.zeros(zd.shape, dtype=dtype) + (ebv*0.1+-10.0)
+        self.sky = np.zeros(zd.shape, dtype=dtype) + np.nan
+        dark, = np.nonzero(~self.sunIsUp)
+        if dark.size == 0 : return
+        zd, airmass, moon_sep, moon_zd = zd[dark], self.airmass[dark], self.moonSep[dark], moon_zd[dark]
+
+        dust    = dustModel.dustTransmission(filter, ebv, obs.ebv_min)
+        atmo    = atmosphere.transmission(airmass, filter, 1.3)
+        # the 10**-100 of atmosphere.dirtTransmission and lunarDirtTransmission
+        # is zero in float32, so those are carried as log10
+        deg_to_rad = 2*np.pi/360.
+        log_dirt = (-100.*(zd > 90*deg_to_rad) - 100.*(moon_sep < 0.5*deg_to_rad)).astype(dtype)
+        seeing  = seeingModel.seeingWithAirmassAndLambda(airmass, filter, seeingAtZenith=0.9)
+        sky     = skyModel.sky_brightness_at_time(filter, zd, moon_zd, moon_sep, obs.moonPhase)
+        skyFid  = skyModel.skyFiducial(filter)
+        limits  = self.limits[dark]
+        m_zp    = zeroPoint(filter)
+
+        SNglobal = dust*atmo*(1./seeing)*np.sqrt(exposure/30.)
+        SN = limits*SNglobal
+        log_SN = np.where(SN > 0, np.log10(np.where(SN > 0, SN, 1.0)) + log_dirt, -12.)
+        m = m_zp + 2.5*log_SN + 0.5*(sky - skyFid)
+        m[m < 0] = 0
+        m[~limits] = -11.0
+        log_SN = np.where(SNglobal > 0, np.log10(np.where(SNglobal > 0, SNglobal, 1.0)) + log_dirt, -12.)
+        mglobal = m_zp + 2.5*log_SN + 0.5*(sky - skyFid)
+        mglobal[mglobal < 0] = 0
+        self.sky[dark] = sky
+        self.maglim[dark] = m
+        self.maglimall[dark] = mglobal
+
+    # the slot at mjd, -1 if there is none within tolerance (days)
+    def indexOfMjd (self, mjd, tolerance=1e-6) :
+        islot = np.argmin(np.abs(self.mjd - mjd))
+        if np.abs(self.mjd[islot] - mjd) > tolerance : return -1
+        return islot
+
+# ha, zd, airmass and the telescope limits, (slots x pixels), of the slots at lst
+def slotGeometry (obs, lst, ra, dec, lat, dtype=np.float32) :
+    ha = lst - ra
+    zd = obs.zenithDistance(ha, dec, dtype(lat))
+    ix = np.nonzero(ha > 180.*2*np.pi/360.)
+    ha[ix] = ha[ix] - 360*2*np.pi/360.
+    airmass = obs.airmassModel(zd)
+    limits = zd*360./2/np.pi <= telescopeZDLimit(obs.observatory)
+    return ha, zd, airmass, limits
+
+# the sky brightness less the fiducial dark sky of each filter, in mag/arcsec^2
+# as limitMag uses it, at ra,dec (degrees; hex centers, say) in the slots
+# islots of conditions: {filter : (slots x ra.size)}. Half of it is the
+# change of the limiting magnitude in that filter.
+def skyAtSlots (obs, conditions, islots, ra, dec, filters, dtype=np.float32) :
+    degToRad = 2.*np.pi/360.
+    islots = np.atleast_1d(islots)
+    ra = (np.asarray(ra)*degToRad).astype(dtype)[np.newaxis,:]
+    dec = (np.asarray(dec)*degToRad).astype(dtype)[np.newaxis,:]
+    lst = conditions.lst[islots].astype(dtype)[:,np.newaxis]
+    moon_ra = conditions.moonData[islots,0].astype(dtype)[:,np.newaxis]
+    moon_dec = conditions.moonData[islots,1].astype(dtype)[:,np.newaxis]
+    moon_zd = conditions.moonData[islots,2].astype(dtype)[:,np.newaxis]
+    zd = obs.zenithDistance(lst - ra, dec, dtype(obs.lat))
+    moon_sep = obs.gc_separation(ra, dec, moon_ra, moon_dec)
+    sky = dict()
+    for filter in filters :
+        sky[filter] = (skyModel.sky_brightness_at_time(filter, zd, moon_zd, moon_sep, obs.moonPhase)
+            - skyModel.skyFiducial(filter)).astype(dtype)
+    return sky
+
+#
+# A whole number of sidereal days after a slot the sky is where it was:
+# the lst is the same, so are ha, zd, airmass and the telescope limits of
+# every pixel. Only the sun, the moon and what follows from them (moonSep, 
+# sky, maglim) change from night to night.
+# geometryRows gives, for each lst, the slot of geometry (a nightConditions
+# of the same pixels, or None) within tolerance (radians) of that lst, or -1.
+# The default tolerance, 0.4 seconds of time, allows for the drift of the
+# equation of the equinoxes over a few weeks.
+#
+siderealDay = 0.9972695663 ;# days
+
+def geometryRows (geometry, lst, npix, tolerance=1e-4) :
+    rows = np.zeros(lst.size, dtype=int) - 1
+    if geometry is None or geometry.ha.shape[1] != npix : return rows
+    diff = np.abs(lst[:,np.newaxis] - geometry.lst[np.newaxis,:]) % (2*np.pi)
+    diff = np.minimum(diff, 2*np.pi - diff)
+    nearest = np.argmin(diff, axis=1)
+    ok = diff[np.arange(lst.size), nearest] <= tolerance
+    rows[ok] = nearest[ok]
+    return rows
+
+#
+# The night's observing conditions do not depend on the skymap, only on the
+# site, the slot mjds, filter, exposure, nside and the moon phase of obs.
+# So the full sky nightConditions are kept in 
+# $DESGW_CACHE_DIR/nightConditions-<camera>-<night>-<filter>-<exposure>-<nside>-<key>/
+# as .npy files, and a later skymap of the same event (the same slots) reads 
+# them, memory mapped, rather than computing them again. With a working set
+# the working set's pixels are taken from the full sky arrays, so they are 
+# the all sky values (below the horizon the sky uses the largest airmass of
+# the pixels) as in the full sky maps probabilityMapSaver writes. The dust
+# is relative to the least ebv of the full sky (observed.ebv_min) either way.
+#
+#   conditions = mags.getNightConditions(obs, mjds, "i", exposure=90, cache=True)
+#
+# The last answer is also kept in memory, as oneDayOfTotalProbability and
+# probabilityMapSaver both ask for the same night. geometry is passed on to
+# nightConditions when the conditions have to be made.
+#
+conditionSlotArrays  = ["mjd", "lst", "sunData", "moonData", "sunIsUp"]
+conditionPixelArrays = ["ha", "zd", "airmass", "moonSep", "limits", "sky", "maglim", "maglimall"]
+nightConditionsMemo = {}
+
+def getNightConditions (obs, mjds, filter, exposure=30, cache=True, geometry=None) :
+    import hashlib
+    mjds = np.atleast_1d(np.asarray(mjds, dtype=np.float64))
+    pixels = "all"
+    if obs.pixels is not None :
+        pixels = hashlib.md5(np.asarray(obs.pixels).tobytes()).hexdigest()
+    key = (nightConditionsDir(obs, mjds, filter, exposure), pixels, bool(cache))
+    if key not in nightConditionsMemo :
+        nightConditionsMemo.clear()
+        nightConditionsMemo[key] = makeNightConditions(obs, mjds, filter, exposure, cache, geometry)
+    return nightConditionsMemo[key]
+
+def makeNightConditions (obs, mjds, filter, exposure, cache, geometry) :
+    if not cache or obs.nside == 0 :
+        return nightConditions(obs, mjds, filter, exposure=exposure, geometry=geometry)
+    cache_dir = nightConditionsDir(obs, mjds, filter, exposure)
+    if not os.path.exists(cache_dir) :
+        if obs.verbose :
+            print "\t computing the night's observing conditions into {}".format(cache_dir)
+        # the cached conditions are full sky, so is the geometry they are made from
+        if geometry is not None and getattr(geometry, "cache_dir", None) is not None :
+            geometry = loadNightConditions(geometry.cache_dir)
+        conditions = nightConditions(obs, mjds, filter, exposure=exposure, fullSky=True,
+            geometry=geometry)
+        saveNightConditions(conditions, cache_dir)
+    elif obs.verbose :
+        print "\t reading the night's observing conditions from {}".format(cache_dir)
+    return loadNightConditions(cache_dir, obs.pixels)
+
+# the full sky nightConditions of a cached conditions (fullSky or restricted
+# to a working set), memory mapped; None if conditions was not cached
+fullNightConditionsMemo = {}
+
+def fullNightConditions (conditions) :
+    cache_dir = getattr(conditions, "cache_dir", None)
+    if cache_dir is None : return None
+    if cache_dir not in fullNightConditionsMemo :
+        fullNightConditionsMemo.clear()
+        fullNightConditionsMemo[cache_dir] = loadNightConditions(cache_dir)
+    return fullNightConditionsMemo[cache_dir]
+
+def nightConditionsDir (obs, mjds, filter, exposure) :
+    import hashlib
+    cache_dir = os.getenv("DESGW_CACHE_DIR", "./")
+    key = hashlib.md5(mjds.tobytes() + "{:.6f}".format(obs.moonPhase)).hexdigest()[:12]
+    name = "nightConditions-{}-{}-{}-{:g}-{}-{}".format(
+        obs.observatory, int(mjds[0]), filter, float(exposure), obs.nside, key)
+    return os.path.join(cache_dir, name)
+
+def saveNightConditions (conditions, cache_dir) :
+    import shutil
+    # write then rename, so that a reader never sees a partial directory
+    tmp_dir = cache_dir + ".{}.tmp".format(os.getpid())
+    if os.path.exists(tmp_dir) : shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    for name in conditionSlotArrays + conditionPixelArrays :
+        np.save(os.path.join(tmp_dir, name + ".npy"), getattr(conditions, name))
+    np.save(os.path.join(tmp_dir, "setup.npy"), np.array([conditions.filter, conditions.observatory]))
+    np.save(os.path.join(tmp_dir, "exposure.npy"), np.array(conditions.exposure, dtype=np.float64))
+    try :
+        os.rename(tmp_dir, cache_dir)
+    except OSError :
+        # another process got there first
+        shutil.rmtree(tmp_dir)
+
+# a nightConditions read from cache_dir, restricted to pixels if not None
+def loadNightConditions (cache_dir, pixels=None) :
+    conditions = nightConditions.__new__(nightConditions)
+    for name in conditionSlotArrays :
+        setattr(conditions, name, np.load(os.path.join(cache_dir, name + ".npy")))
+    for name in conditionPixelArrays :
+        values = np.load(os.path.join(cache_dir, name + ".npy"), mmap_mode="r")
+        if pixels is not None :
+            values = values[:,pixels]
+        setattr(conditions, name, values)
+    filter, observatory = np.load(os.path.join(cache_dir, "setup.npy"))
+    conditions.filter = str(filter)
+    conditions.observatory = str(observatory)
+    conditions.exposure = float(np.load(os.path.join(cache_dir, "exposure.npy")))
+    conditions.cache_dir = cache_dir
+    return conditions
+
+# the limiting magnitude zero point of a 30 second exposure
+def zeroPoint (filter) :
+    if filter == "g" : m_zp = 23.3
+    elif filter == "r" :m_zp = 23.4
+    elif filter == "i" :m_zp = 22.9
+    elif filter == "z" :m_zp = 22.5
+    elif filter == "y" :m_zp = 20.6
+    else : raise Exception("no such filter")
+    return m_zp
+
+# the largest zenith distance, degrees, the telescope can point to
+def telescopeZDLimit (camera) :
+    if camera == "decam" or camera == "des" :
+        limit = 67.5
+    elif camera == "desi" or camera == "hsc" :
+        limit = 80.
+    else : raise Exception("no such camera {}".format(camera))
+    return limit
+
+# the latitude, east longitude (degrees) and height (m) of the telescope of a camera
+def observatorySite (camera) :
     ctio_lat          = -30.16527778
     ctio_lon          = -70.8125
     ctio_height       = 2215.
@@ -421,41 +774,87 @@ def findNightDuration(mjd, camera="decam") :
         obs_lat = maunakea_lat
         obs_lon = maunakea_lon
         obs_height = maunakea_height
+    else : raise Exception("no such camera {}".format(camera))
+    return obs_lat, obs_lon, obs_height
+
+#
+# The night: sunset is when the sun goes below the twilight of
+# observed.sunBrightnessModel, 100 degrees zenith distance, and sunrise
+# when it comes back above it.
+#
+# The night of mjd is looked for in the day starting 6 hours before 0h UT
+# of mjd, as the minute by minute search this replaces did. The crossings are
+# bracketed on a nightGridStep grid, then found by brentq to nightTolerance, 
+# and each (camera, night) is solved once per process.
+#   if the day has no sunset or no sunrise after it, they are nan
+#
+#   duration, sunset, sunrise = mags.findNightDuration(mjd, camera)
+#   intervals = mags.darkIntervals(mjds, camera)   # (n,2) sunset, sunrise
+#
+nightGridStep  = 20./(24.*60)     ;# days
+nightTolerance = 0.1/(24.*3600)   ;# days
+# (sunset, sunrise) keyed by (camera, integer mjd)
+nightMemo = {}
+
+def findNightDuration(mjd, camera="decam") :
+    sunset, sunrise = darkInterval(mjd, camera)
+    duration = sunrise-sunset
+    return duration, sunset, sunrise
 
+def darkInterval (mjd, camera="decam") :
+    key = (camera, int(mjd))
+    if key not in nightMemo :
+        nightMemo[key] = solveNight(int(mjd), camera)
+    return nightMemo[key]
+
+# the sunset and sunrise of the nights of many mjds, as an (n,2) array
+def darkIntervals (mjds, camera="decam") :
+    intervals = [darkInterval(mjd, camera) for mjd in np.atleast_1d(mjds)]
+    return np.array(intervals, dtype=np.float64).reshape(-1,2)
+
+def solveNight (imjd, camera="decam") :
+    from scipy.optimize import brentq
+    obs_lat, obs_lon, obs_height = observatorySite(camera)
     degToRad = 2.*np.pi/360.
     lat          = obs_lat*degToRad
     lon          = obs_lon*degToRad
-    height       = obs_height
+    twilight = 100.*2*np.pi/360. 
+    # positive when it is dark
+    def darkness (mjd) :
+        return sunZenithDistance(mjd, lat, lon) - twilight
 
-    imjd = np.int(mjd)
     start_mjd = imjd - 6./24.  ;# before sunset at CTIO
-
-    sunset = ""
-    sunrise = ""
-    # check every minute
-    for i in np.arange(0, 1., 1./(24.*60) ) :
-        mjd = start_mjd + i
-        gmst        = slalib.sla_gmst(mjd)
-        eqEquinoxes = slalib.sla_eqeqx(mjd)
-        lst         = gmst + eqEquinoxes + lon
-
-        sunra, sundec, diam = slalib.sla_rdplan(mjd, 0, lon, lat)
-        sunha = lst - sunra
-        sinAltRad = np.sin(lat)*np.sin(sundec) + \
-            np.cos(lat)*np.cos(sundec)*np.cos(sunha)
-        altRad = np.arcsin(sinAltRad)
-        zenithDist = 90*degToRad - altRad
-
-        twilight = 100.*2*np.pi/360. 
-        if zenithDist <= twilight :
-            bright = True
-        else :
-            bright = False
-        if sunset == "" and bright == False :
-            sunset = mjd
-        if sunset != "" and sunrise == "" and bright == True :
-            sunrise = mjd
-    duration = sunrise-sunset
-    return duration, sunset, sunrise
+    nsteps = int(np.ceil(1./nightGridStep))
+    grid = start_mjd + np.linspace(0., 1., nsteps+1)
+    dark = np.array([darkness(mjd) for mjd in grid]) > 0
+
+    sunset, sunrise = np.nan, np.nan
+    if dark[0] :
+        sunset = grid[0]
+        after = 0
+    else :
+        ix, = np.nonzero(dark)
+        if ix.size == 0 : return sunset, sunrise
+        after = ix[0]
+        sunset = brentq(darkness, grid[after-1], grid[after], xtol=nightTolerance)
+    ix, = np.nonzero(~dark[after:])
+    if ix.size == 0 : return sunset, sunrise
+    after = after + ix[0]
+    sunrise = brentq(darkness, grid[after-1], grid[after], xtol=nightTolerance)
+    return sunset, sunrise
+
+# the zenith distance of the sun, radians, at lat, lon (radians)
+def sunZenithDistance (mjd, lat, lon) :
+    gmst        = slalib.sla_gmst(mjd)
+    eqEquinoxes = slalib.sla_eqeqx(mjd)
+    lst         = gmst + eqEquinoxes + lon
+
+    sunra, sundec, diam = slalib.sla_rdplan(mjd, 0, lon, lat)
+    sunha = lst - sunra
+    sinAltRad = np.sin(lat)*np.sin(sundec) + \
+        np.cos(lat)*np.cos(sundec)*np.cos(sunha)
+    altRad = np.arcsin(sinAltRad)
+    zenithDist = 90*2.*np.pi/360. - altRad
+    return zenithDist
 
 
@@ -2,8 +2,11 @@ import numpy as np
 import healpy as hp
 import os
 import decam2hp
+import hexCatalog
 import hexalate
 import kasen_modelspace
+import mags
+import slotMaps
 
 import sourceProb
 import modelRead
@@ -71,8 +74,16 @@ def oneDayOfTotalProbability (obs, deltaTime, start_mjd,
     data_dir       = gw_map_control.datadir
     simple_distance = gw_map_trigger.distance
     simple_dist_err = gw_map_trigger.diststd
+    # if obs is restricted to a working set of pixels, so are the maps
+    spatial        = obs.restrict(spatial)
+    distance       = obs.restrict(distance)
+    distance_sig   = obs.restrict(distance_sig)
 
 
+    # the slot results are kept for probabilityMapSaver; start afresh for this trigger
+    slotCacheSpill(gw_map_control)
+    slotCacheClear(gw_map_trigger.trigger_id)
+
     # the work.
     start_of_days=0
     end_of_days=1
@@ -84,7 +95,10 @@ def oneDayOfTotalProbability (obs, deltaTime, start_mjd,
         probTimeFile=probTimeFile, trigger_type=trigger_type, 
         filter=filter, exposure=exposure, 
         kasen_fraction=kasen_fraction, data_dir = data_dir,
-        simple_distance=simple_distance, simple_dist_err=simple_dist_err)
+        simple_distance=simple_distance, simple_dist_err=simple_dist_err,
+        n_workers=gw_map_control.n_workers, trigger_id=gw_map_trigger.trigger_id,
+        conditions_cache=gw_map_control.conditions_cache,
+        geometry=gw_map_control.night_geometry)
 
     return totalProbs,times, isDark
 
@@ -95,23 +109,37 @@ def manyDaysOfTotalProbability (
         filter="i", exposure=90, 
         kasen_fraction=50, data_dir = "./", 
         simple_distance=100, simple_dist_err=30,
-        verbose=True) :
+        verbose=True, n_workers=1, trigger_id=None, conditions_cache=False,
+        geometry=None) :
     times = []
     totalProbs = []
 
+    slot_times = np.arange(startOfDays,endOfDays,deltaTime)
+    # the observing conditions of every slot, at once
+    conditions = mags.getNightConditions(obs, start_mjd+slot_times, filter, exposure=exposure,
+        cache=conditions_cache, geometry=geometry)
+    args = dict(burst_mjd=burst_mjd, start_mjd=start_mjd, 
+        spatial=spatial, distance=distance, distance_sig=distance_sig,
+        filter=filter, exposure=exposure, trigger_type=trigger_type,
+        kasen_fraction=kasen_fraction, data_dir=data_dir,
+        simple_distance=simple_distance, simple_dist_err=simple_dist_err,
+        conditions=conditions, trigger_id=trigger_id)
+    if n_workers > 1 :
+        answers = runSlotPool(slotTotalProbabilityWorker, slot_times, obs, args, n_workers)
+        syncToSlot(obs, start_mjd, slot_times[-1], filter, exposure, conditions)
+
     # in the language of getHexObservations:
     #   each slot is 32 minutes, each slot can hold 4 hexes
     dark = False
     isDark = []
-    for time_since_start in np.arange(startOfDays,endOfDays,deltaTime) :
+    for i in range(0,slot_times.size) :
+        time_since_start = slot_times[i]
         print "================================== ",
         print "hours since Time Zero: {:5.1f}".format(time_since_start*24.),
-        totalProb, sunIsUp = totalProbability(obs, burst_mjd, start_mjd, time_since_start, \
-            spatial, distance, distance_sig, \
-            filter=filter, exposure=exposure, \
-            trigger_type=trigger_type, \
-            kasen_fraction=kasen_fraction, data_dir = data_dir,
-            simple_distance=simple_distance, simple_dist_err=simple_dist_err)
+        if n_workers > 1 :
+            totalProb, sunIsUp = answers[i]
+        else :
+            totalProb, sunIsUp = slotTotalProbability(obs, time_since_start, args)
         if sunIsUp: 
             print "\t ... the sun is up"
         else:
@@ -163,6 +191,18 @@ def manyDaysOfTotalProbability (
     np.savetxt(probTimeFile, data, "%f %f %d")
     return totalProbs,times, isDark
 
+# one slot of manyDaysOfTotalProbability
+def slotTotalProbability(obs, time_since_start, args) :
+    a = args
+    totalProb, sunIsUp = totalProbability(obs, a["burst_mjd"], a["start_mjd"], time_since_start, \
+        a["spatial"], a["distance"], a["distance_sig"], \
+        filter=a["filter"], exposure=a["exposure"], \
+        trigger_type=a["trigger_type"], \
+        kasen_fraction=a["kasen_fraction"], data_dir = a["data_dir"],
+        simple_distance=a["simple_distance"], simple_dist_err=a["simple_dist_err"],
+        conditions=a.get("conditions"), trigger_id=a.get("trigger_id"))
+    return totalProb, sunIsUp
+
 #==============================================================
 #
 # core computation
@@ -171,13 +211,14 @@ def totalProbability(obs, burst_mjd, start_mjd, daysSinceStart, \
         spatial, distance, distance_sig, 
         filter="i", exposure=180, trigger_type="bright", 
         kasen_fraction=50, data_dir="./",
-        simple_distance=100, simple_dist_err=30) :
+        simple_distance=100, simple_dist_err=30, conditions=None, trigger_id=None) :
 
     obs,sm,sunIsUp = probabilityMaps(obs, burst_mjd, start_mjd, daysSinceStart, \
         spatial, distance, distance_sig,
         filter, exposure, trigger_type=trigger_type, 
         kasen_fraction=kasen_fraction, data_dir = data_dir,
-        simple_distance=simple_distance, simple_dist_err=simple_dist_err)
+        simple_distance=simple_distance, simple_dist_err=simple_dist_err,
+        conditions=conditions, trigger_id=trigger_id)
     if sunIsUp:
         totalProb = 0.0
     else :
@@ -185,18 +226,40 @@ def totalProbability(obs, burst_mjd, start_mjd, daysSinceStart, \
     return totalProb, sunIsUp
 
 # drive the probability map calculations. In the end, distance only is used here
+#   if the time is a slot of conditions, a mags.nightConditions, 
+#   obs is set from it rather than recomputed
+#   with a trigger_id, the source probability map is kept in the slot cache,
+#   and taken from it if it is already there
 def probabilityMaps(obs, burst_mjd, start_mjd, daysSinceStart, \
         spatial, distance, distance_sig, 
         filter="i", exposure=180, trigger_type="bright", 
         kasen_fraction=50, data_dir="./", 
-        simple_distance=100, simple_dist_err=30, verbose=True) :
-
-    obs.resetTime(start_mjd+daysSinceStart)
+        simple_distance=100, simple_dist_err=30, verbose=True, conditions=None,
+        trigger_id=None) :
+
+    islot = -1
+    if conditions is not None :
+        islot = conditions.indexOfMjd(start_mjd+daysSinceStart)
+    if islot >= 0 :
+        obs.setConditions(conditions, islot)
+    else :
+        obs.resetTime(start_mjd+daysSinceStart)
 
     sunIsUp = obs.sunBrightnessModel(obs.sunZD)
     if sunIsUp: return obs, "sm", sunIsUp
 
-    obs.limitMag(filter, exposure=exposure)
+    if islot < 0 :
+        obs.limitMag(filter, exposure=exposure)
+
+    key = None
+    if trigger_id is not None :
+        key = slotCacheKey(trigger_id, start_mjd+daysSinceStart, filter, exposure, kasen_fraction)
+        cached = slotCacheGet(key)
+        if cached is not None :
+            sunIsUp, apparent_mag, probMap = cached
+            sm=sourceProb.map(obs, type=trigger_type, apparent_mag_source=apparent_mag)
+            sm.probMap = probMap
+            return obs,sm, sunIsUp
     if trigger_type == "bright" :
         # as of O3, let's not use source probability
         #   # we may need to rescale the light curve in the models
@@ -226,6 +289,8 @@ def probabilityMaps(obs, burst_mjd, start_mjd, daysSinceStart, \
     #print("spatial, distance, distance_sig", spatial, distance, distance_sig)
     if not result:
         sunIsUp = 1
+    if key is not None :
+        slotCachePut(key, sunIsUp, apparent_mag, sm.probMap)
     return obs,sm, sunIsUp
 
 #==============================================================
@@ -255,8 +320,12 @@ def probabilityMapSaver (obs, times, probabilities,
     distance                   = gw_map_trigger.ligo_dist
     distance_sig               = gw_map_trigger.ligo_dist_sig
     debug                      = gw_map_control.debug
+    footprint                  = gw_map_control.footprint
+    multires                   = gw_map_control.multires
+    working_set                = gw_map_control.working_set
     reject_hexes               = gw_map_control.reject_hexes
     data_dir                   = gw_map_control.datadir
+    n_workers                  = gw_map_control.n_workers
     camera                     = gw_map_strategy.camera
     filter                     = gw_map_strategy.working_filter
     exposure                   = gw_map_strategy.summed_exposure_time
@@ -265,6 +334,10 @@ def probabilityMapSaver (obs, times, probabilities,
     simple_dist_err            = gw_map_trigger.diststd
     #onlyHexesAlreadyDone  = gw_map_control.this_tiling
     onlyHexesAlreadyDone  = []
+    # if obs is restricted to a working set of pixels, so are the maps
+    ligo                       = obs.restrict(ligo)
+    distance                   = obs.restrict(distance)
+    distance_sig               = obs.restrict(distance_sig)
 
     # one reads the tiling 9 hex centers as that is our default position
     gw_data_dir          = os.environ["DESGW_DATA_DIR"]
@@ -274,10 +347,41 @@ def probabilityMapSaver (obs, times, probabilities,
     prob_slots = np.percentile(probabilities, 95)
     print("95th percentile of cumulative prob covered {}\n".format(prob_slots))
     ix, = np.where(probabilities > 0)
+    # obs.ra, obs.dec do not change with time, so the hex centers
+    # and the hex-pixel matrix are made once for the night
+    nside = hp.get_nside(obs.fullSky(obs.ra))
+    if keep_flag :
+        # the rows of the hex-pixel matrix are the hexes of the catalog
+        catalog = hexCatalog.getHexCatalog(camera, hexFile)
+        keep = catalog.selectIds(onlyHexesAlreadyDone, reject_hexes)
+        if working_set is not None :
+            # only the candidate hexes of the working set, whose matrix is already made
+            pixels, candidates, candidateMatrix = working_set
+            hexMatrix = candidateMatrix[keep[candidates]]
+            do_these = candidates[keep[candidates]]
+            if multires : 
+                print "\t multires hexalation is not needed on the working set, skipping"
+                multires = False
+        else :
+            do_these, = np.nonzero(keep)
+        raHexen, decHexen, idHexen = \
+            catalog.ra[do_these], catalog.dec[do_these], catalog.id[do_these]
+        # with multires the matrix depends on the night's probabilities, so wait
+        if working_set is None and not multires :
+            hexMatrix = decam2hp.hexPixelMatrix(camera, nside, hexFile, footprint=footprint)
+            if do_these.size < catalog.size :
+                hexMatrix = hexMatrix[do_these]
+    # the slots to hexalate are collected, then hexalated all at once
+    hexalateProbs  = []
+    hexalateStems  = []
+    hexalateMjds   = []
+    hexalateSlots  = []
+
     # since we are now doing every slot in a night, counter 0 is at sunset
     counter = -1
     # let's keep track of when the sun is down
     made_maps_list  = np.array([])
+    slots = []
     for time,prob  in zip(times, probabilities) :
         counter += 1
         performHexalatationCalculation = keep_flag
@@ -288,141 +392,245 @@ def probabilityMapSaver (obs, times, probabilities,
             if prob <= prob_slots : 
                 performHexalatationCalculation = False
 
-        daysSinceStart = time
-        #print "daysSinceStart:", daysSinceStart, time, start_mjd, burst_mjd
-        obs,sm, isDark = \
-            probabilityMaps( obs, burst_mjd, start_mjd, daysSinceStart, 
-            ligo, distance, distance_sig,
-            filter, exposure, trigger_type=trigger_type, 
-            kasen_fraction=kasen_fraction, data_dir = data_dir,
-            simple_distance=simple_distance, simple_dist_err=simple_dist_err)
-        if obs.sunBrightnessModel (obs.sunZD ): 
-            #print "\t\tThe sun is up. Continue", time, prob
-            #print ""
-            continue
-
-        # Legend:
-        # obs.ra, obs.dec, obs.map  = ligo map
-        # obs.hx, obs.hy   = mcbryde projection of houar angle, dec
-        # obs.maglim = limiting mag
-        # sm.prob = limiting mag convolve abmag convolve volume
-        # sm.probMap = total prob map
-        # hexRa,hexDec,hexVals
-        nameStem = os.path.join(data_dir, str(trigger_id) + "-{}".format(str(counter)))
-        print "\t Writing map files as {} for time {:.3f} and prob {:.2e}".format(nameStem,time,prob)
+        slots.append((counter, time, prob, performHexalatationCalculation))
+
+    conditions = mags.getNightConditions(obs, start_mjd+np.asarray(times), filter, exposure=exposure,
+        cache=gw_map_control.conditions_cache, geometry=gw_map_control.night_geometry)
+    args = dict(burst_mjd=burst_mjd, start_mjd=start_mjd, trigger_id=trigger_id,
+        ligo=ligo, distance=distance, distance_sig=distance_sig,
+        filter=filter, exposure=exposure, trigger_type=trigger_type,
+        kasen_fraction=kasen_fraction, data_dir=data_dir,
+        simple_distance=simple_distance, simple_dist_err=simple_dist_err,
+        conditions=conditions)
+    # the maps of every slot go in one store, the slots' rows written in place
+    args["slot_maps"] = slotMaps.createSlotMaps(data_dir, trigger_id, obs, start_mjd+np.asarray(times))
+    slotCacheSpill(gw_map_control)
+    if n_workers > 1 :
+        answers = runSlotPool(slotMapSaverWorker, slots, obs, args, n_workers)
+        syncToSlot(obs, start_mjd, times[-1], filter, exposure, conditions)
+    for i in range(0,len(slots)) :
+        counter, time, prob, performHexalatationCalculation = slots[i]
+        if n_workers > 1 :
+            made, hexalateProb = answers[i]
+        else :
+            made, hexalateProb = slotMapSaver(obs, counter, time, prob,
+                performHexalatationCalculation, args)
+        if not made : continue
         made_maps_list = np.append(made_maps_list, counter)
-
-        name = nameStem + "-ra.hp"
-        if os.path.exists(name): os.remove(name)
-        hp.write_map(name, obs.ra)
-        name = nameStem + "-dec.hp"
-        if os.path.exists(name): os.remove(name)
-        hp.write_map(name, obs.dec)
-        name = nameStem + "-ha.hp"
-        if os.path.exists(name): os.remove(name)
-        hp.write_map(name, obs.ha)
-        name = nameStem + "-hx.hp"
-        if os.path.exists(name): os.remove(name)
-        hp.write_map(name, obs.hx)
-        name = nameStem + "-hy.hp"
-        if os.path.exists(name): os.remove(name)
-        hp.write_map(name, obs.hy)
-        name = nameStem + "-x.hp"
-        if os.path.exists(name): os.remove(name)
-        hp.write_map(name, obs.x)
-        name = nameStem + "-y.hp"
-        if os.path.exists(name): os.remove(name)
-        hp.write_map(name, obs.y)
-        name = nameStem + "-map.hp"
-        if os.path.exists(name): os.remove(name)
-        hp.write_map(name, obs.map)
-        name = nameStem + "-maglim.hp"
-        if os.path.exists(name): os.remove(name)
-        hp.write_map(name, obs.maglim)
-        name = nameStem + "-maglim-global.hp"
-        if os.path.exists(name): os.remove(name)
-        hp.write_map(name, obs.maglimall)
-# do we need this?
-        #name = nameStem + "-prob.hp"
-        #if os.path.exists(name): os.remove(name)
-        #hp.write_map(name, sm.prob)
-        name = nameStem + "-probMap.hp"
-        if os.path.exists(name): os.remove(name)
-        #sm.probMap = sm.probMap*gal
-        try:
-            hp.write_map(name, sm.probMap)
-        except:
-            # there is no prob map in the sm, so prob is zero everywhere
-            hp.write_map(name, obs.map*0.0)
-
-        treedata = decam2hp.buildtree(obs.ra*360./2/np.pi,obs.dec*360./2/np.pi,\
-            nsides=hp.get_nside(obs.ra), recompute=True)
-        tree = treedata[2]
         if performHexalatationCalculation :
-            raHexen, decHexen, idHexen = hexalate.getHexCenters(hexFile)
-            if len(onlyHexesAlreadyDone) > 0 :
-                do_these = np.in1d(idHexen, onlyHexesAlreadyDone)
-                do_these = np.nonzero(do_these)
-                raHexen, decHexen, idHexen = \
-                    raHexen[do_these], decHexen[do_these], idHexen[do_these]
-            if len(reject_hexes) > 0 :
-                dont_do_these = np.in1d(idHexen, reject_hexes)
-                dont_do_these = np.nonzero(np.invert(dont_do_these))
-                raHexen, decHexen, idHexen = \
-                    raHexen[do_these], decHexen[do_these], idHexen[do_these]
-
-        #    import pickle
-        #    fd=open("saveme.pickle","wb")
-        #    pickle.dump([obs, sm, raHexen, decHexen, idHexen, tree, camera], fd)
-        #    fd.close()
-            raHexen, decHexen, idHexen, hexVals, rank = \
-                hexalate.cutAndHexalateOnRaDec ( obs, sm, raHexen, decHexen, idHexen, tree, camera, cutProbs=False)
-
-            # where rank is to be understood as the indicies of the
-            # ranked hexes in order; i.e., they have nothing to do with
-            # raHexen, decHexen, hexVals except as a sorting key
-            name = nameStem + "-hexVals.txt"
-            if os.path.exists(name): os.remove(name)
-            
-            f = open(name,'w')
-            for j in range(0,raHexen.size) :
-                f.write("{:.6f}, {:.5f}, {:s}, {:.4e}, {:d}, {:.4f}\n".format(
-                    raHexen[j],decHexen[j],idHexen[j],hexVals[j],rank[j],
-                    (np.asfarray(rank*0.)+(start_mjd+time))[j]))
-            f.close()
+            nameStem = os.path.join(data_dir, str(trigger_id) + "-{}".format(str(counter)))
+            hexalateProbs.append(hexalateProb)
+            hexalateStems.append(nameStem)
+            hexalateMjds.append(start_mjd+time)
+            hexalateSlots.append(counter)
+    slotMaps.setMade(args["slot_maps"], made_maps_list)
+
+    if len(hexalateProbs) > 0 :
+        # where rank is to be understood as the indicies of the
+        # ranked hexes in order; i.e., they have nothing to do with
+        # raHexen, decHexen, hexVals except as a sorting key
+        hexalateProbs = np.vstack(hexalateProbs)
+        print "\t hexalating {} slots".format(len(hexalateStems))
+        if multires :
+            hexMatrix, multiresReport = decam2hp.multiresHexPixelMatrix(
+                camera, nside, hexalateProbs, hexFile, footprint=footprint,
+                coarse_nside=gw_map_control.multires_nside,
+                fraction=gw_map_control.multires_fraction, rows=do_these,
+                validate=gw_map_control.multires_validate)
+        hexVals = hexalate.hexalateNight(hexalateProbs, raHexen, decHexen, idHexen, hexMatrix,
+            cutProbs=False, nameStems=hexalateStems, mjds=hexalateMjds)
+        # and kept as one (slots x hexes) store, for obsSlots.replan, with
+        # the sky at the hexes in each filter of the strategy, for visits
+        sky = mags.skyAtSlots(obs, conditions, hexalateSlots, raHexen, decHexen,
+            np.unique(gw_map_strategy.filter_list))
+        hexalate.writeHexValStore(data_dir, trigger_id, hexVals, do_these,
+            hexalateSlots, hexalateMjds, sky=sky)
     
-            #######################################################################################
-            ##### Brout: new, we have to run again where we dont double up on probability in the ##
-            ##### hexes, but this cannot be used for prioritization. ##############################
-            raHexencut, decHexencut, idHexencut, hexValscut, rankcut = \
-                hexalate.cutAndHexalateOnRaDec( obs, sm, raHexen, decHexen, idHexen, tree, camera, cutProbs=True)
-            name = nameStem + "-hexVals-cutOverlappingProb.txt"
-            if os.path.exists(name): os.remove(name)
-            f = open(name,'w')
-            for j in range(0,raHexencut.size) :
-                f.write("{:.6f}, {:.5f}, {:s}, {:.4e}, {:d}, {:.4f}\n".format(
-                    raHexencut[j],decHexencut[j],idHexencut[j],hexValscut[j],rankcut[j],
-                    (np.asfarray(rankcut*0.)+(start_mjd+time))[j]))
-            f.close()
+        #######################################################################################
+        ##### Brout: new, we have to run again where we dont double up on probability in the ##
+        ##### hexes, but this cannot be used for prioritization. ##############################
+        hexalate.hexalateNight(hexalateProbs, raHexen, decHexen, idHexen, hexMatrix,
+            cutProbs=True, nameStems=hexalateStems, mjds=hexalateMjds)
     return made_maps_list
 
+# one slot of probabilityMapSaver: make the maps at time and write them.
+#   returns whether the maps were made (the sun is down), and 
+#   the probability map to hexalate if performHexalatationCalculation
+def slotMapSaver (obs, counter, time, prob, performHexalatationCalculation, args) :
+    burst_mjd       = args["burst_mjd"]
+    start_mjd       = args["start_mjd"]
+    trigger_id      = args["trigger_id"]
+    trigger_type    = args["trigger_type"]
+    ligo            = args["ligo"]
+    distance        = args["distance"]
+    distance_sig    = args["distance_sig"]
+    filter          = args["filter"]
+    exposure        = args["exposure"]
+    kasen_fraction  = args["kasen_fraction"]
+    data_dir        = args["data_dir"]
+    simple_distance = args["simple_distance"]
+    simple_dist_err = args["simple_dist_err"]
+
+    daysSinceStart = time
+    #print "daysSinceStart:", daysSinceStart, time, start_mjd, burst_mjd
+    obs,sm, isDark = \
+        probabilityMaps( obs, burst_mjd, start_mjd, daysSinceStart, 
+        ligo, distance, distance_sig,
+        filter, exposure, trigger_type=trigger_type, 
+        kasen_fraction=kasen_fraction, data_dir = data_dir,
+        simple_distance=simple_distance, simple_dist_err=simple_dist_err,
+        conditions=args.get("conditions"), trigger_id=trigger_id)
+    if obs.sunBrightnessModel (obs.sunZD ): 
+        #print "\t\tThe sun is up. Continue", time, prob
+        #print ""
+        return False, None
+
+    # Legend:
+    # obs.ra, obs.dec, obs.map  = ligo map
+    # obs.hx, obs.hy   = mcbryde projection of houar angle, dec
+    # obs.maglim = limiting mag
+    # sm.prob = limiting mag convolve abmag convolve volume
+    # sm.probMap = total prob map
+    # hexRa,hexDec,hexVals
+    print "\t Writing maps of slot {} as {} for time {:.3f} and prob {:.2e}".format(
+        counter, args["slot_maps"], time, prob)
+
+    # the maps are written full sky; if obs is restricted to a working set,
+    # from the full sky night conditions, without a full sky observed
+    maps = obs.fullSkyMaps(args.get("conditions"))
+
+    # sm.probMap = sm.probMap*gal
+    try:
+        probMap = obs.fullSky(sm.probMap)
+    except:
+        # there is no prob map in the sm, so prob is zero everywhere
+        probMap = obs.fullSky(obs.map*0.0)
+    slotMaps.writeSlot(args["slot_maps"], counter, maps, probMap)
+
+    hexalateProb = None
+    if performHexalatationCalculation :
+        hexalateProb = obs.map*sm.probMap
+    return True, hexalateProb
+
+#
+# Slot results.
+#
+# manyDaysOfTotalProbability and then probabilityMapSaver work on the same
+# slots, so the source probability map of a slot is made once and kept here,
+# keyed by (trigger, slot mjd, filter, exposure, kasen fraction). The maps are
+# kept in memory or, if gw_map_control.slot_cache_spill, in .npy files in
+# datadir/slot-cache/ with only the file names in memory.
+#
+slotCache = dict()
+slotCacheState = dict(spill_dir=None, new=set())
+
+def slotCacheKey (trigger_id, mjd, filter, exposure, kasen_fraction) :
+    return (str(trigger_id), "{:.6f}".format(mjd), filter, exposure, kasen_fraction)
+
+def slotCacheSpill (gw_map_control) :
+    spill_dir = None
+    if gw_map_control.slot_cache_spill :
+        spill_dir = os.path.join(gw_map_control.datadir, "slot-cache")
+    slotCacheState["spill_dir"] = spill_dir
+
+def slotCacheGet (key) :
+    if key not in slotCache : return None
+    sunIsUp, apparent_mag, probMap = slotCache[key]
+    if isinstance(probMap, str) :
+        probMap = np.load(probMap)
+    return sunIsUp, apparent_mag, probMap
+
+def slotCachePut (key, sunIsUp, apparent_mag, probMap) :
+    spill_dir = slotCacheState["spill_dir"]
+    if spill_dir is not None :
+        try :
+            os.makedirs(spill_dir)
+        except OSError :
+            pass
+        file = os.path.join(spill_dir, "-".join([str(k) for k in key]) + ".npy")
+        # write then rename, so that a reader never sees a partial file
+        tmp_file = file + ".{}.tmp".format(os.getpid())
+        fd = open(tmp_file, "wb")
+        np.save(fd, probMap)
+        fd.close()
+        os.rename(tmp_file, file)
+        probMap = file
+    slotCache[key] = (sunIsUp, apparent_mag, probMap)
+    slotCacheState["new"].add(key)
+
+# the entries made since the last take, for a pool worker to hand back
+def slotCacheTake () :
+    entries = dict([(key, slotCache[key]) for key in slotCacheState["new"]])
+    slotCacheState["new"].clear()
+    return entries
+
+def slotCacheClear (trigger_id) :
+    import glob
+    for key in slotCache.keys() :
+        if key[0] == str(trigger_id) : del slotCache[key]
+    slotCacheState["new"].clear()
+    spill_dir = slotCacheState["spill_dir"]
+    if spill_dir is not None :
+        for file in glob.glob(os.path.join(spill_dir, str(trigger_id) + "-*.npy")) :
+            os.remove(file)
+
+#
+# Slots in parallel.
+#
+# The pool is forked after obs and the read only maps are put in poolState,
+# so the workers share them copy on write rather than having them pickled
+# to every worker. Each worker changes the time of its own copy of obs.
+# The answers come back in slot order, so that the files written are 
+# the same as those of the sequential loop. The slot cache entries the 
+# workers made come back with them.
+#
+poolState = dict()
+
+def runSlotPool (worker, slots, obs, args, n_workers) :
+    import multiprocessing
+    poolState["obs"] = obs
+    poolState["args"] = args
+    pool = multiprocessing.Pool(n_workers)
+    try :
+        answers = pool.map(worker, slots, chunksize=1)
+        for answer, entries in answers :
+            slotCache.update(entries)
+        answers = [answer for answer, entries in answers]
+    finally :
+        pool.close()
+        pool.join()
+        poolState.clear()
+    return answers
+
+def slotTotalProbabilityWorker (time_since_start) :
+    answer = slotTotalProbability(poolState["obs"], time_since_start, poolState["args"])
+    return answer, slotCacheTake()
+
+def slotMapSaverWorker (slot) :
+    counter, time, prob, performHexalatationCalculation = slot
+    answer = slotMapSaver(poolState["obs"], counter, time, prob,
+        performHexalatationCalculation, poolState["args"])
+    return answer, slotCacheTake()
+
+# leave obs as the sequential loop would have: at the last slot time
+def syncToSlot (obs, start_mjd, time, filter, exposure, conditions) :
+    islot = conditions.indexOfMjd(start_mjd+time)
+    if islot >= 0 :
+        obs.setConditions(conditions, islot)
+        return
+    obs.resetTime(start_mjd+time)
+    if not obs.sunBrightnessModel(obs.sunZD) :
+        obs.limitMag(filter, exposure=exposure)
+
 # pass apparent mag from yaml file to sourceProb
 
 
 # Get the saved maps for each day and hour.
+#   prob, sm.prob, is no longer saved and is None
 def readMaps (data_dir, simNumber, slot) :
-    name = os.path.join(data_dir, str(simNumber) + "-{}".format(str(slot)))
-
-    ra=hp.read_map(name+"-ra.hp");
-    dec=hp.read_map(name+"-dec.hp");
-    ha=hp.read_map(name+"-ha.hp");
-    map=hp.read_map(name+"-map.hp");
-    maglim=hp.read_map(name+"-maglim.hp");
-    prob=hp.read_map(name+"-prob.hp");
-    probMap=hp.read_map(name+"-probMap.hp");
-    hx=hp.read_map(name+"-hx.hp");
-    hy=hp.read_map(name+"-hy.hp");
-    x=hp.read_map(name+"-x.hp");
-    y=hp.read_map(name+"-y.hp");
+    maps = slotMaps.readSlot(data_dir, simNumber, slot)
+    ra, dec, map, maglim, probMap = \
+        maps["ra"], maps["dec"], maps["map"], maps["maglim"], maps["probMap"]
+    hx, hy, x, y = maps["hx"], maps["hy"], maps["x"], maps["y"]
+    prob = None
     return ra, dec, map, maglim, prob, probMap, x,y, hx,hy
-
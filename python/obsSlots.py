@@ -47,17 +47,30 @@ import warnings
 #
 # Ok, then, code:
 #
-def slotCalculations(mjd, exposure_lengths, tiling_list, overhead, hexesPerSlot = 6, camera="decam") :
+#   with slew (decam only) the overhead is that of the Blanco slew model of
+#   telescope (telescope.decamVisitsTime): each exposure is read out, and the
+#   move to the next hex is a slew to a neighbouring hex and a settle.
+#   The hexes of a slot are then put in the order that slews least
+#   (getHexObservations.writeObservingRecord), and the time that order saves
+#   gives the slot places for more hexes (getHexObservations.slewCapacity).
+#
+def slotCalculations(mjd, exposure_lengths, tiling_list, overhead, hexesPerSlot = 6, camera="decam",
+        slew=False) :
     from getHexObservations import hoursPerNight
-    slot_duration = slotDuration(exposure_lengths, tiling_list, overhead, hexesPerSlot) 
+    slot_duration = slotDuration(exposure_lengths, tiling_list, overhead, hexesPerSlot,
+        slew = slew and camera == "decam") 
     hoursAvailable = hoursPerNight(mjd, camera)
     answers = dict()
     answers["slotDuration"] = slot_duration
     answers["hoursPerNight"] = hoursAvailable
     return answers
 
-def slotDuration(exposure_lengths, tiling_list, overhead, hexesPerSlot = 6) :
+def slotDuration(exposure_lengths, tiling_list, overhead, hexesPerSlot = 6, slew=False) :
     tot_exptime = np.size(tiling_list)*(np.array(overhead)+np.array(exposure_lengths)).sum()
+    if slew :
+        import telescope
+        tot_exptime = telescope.decamVisitsTime(1, exposure_lengths, np.size(tiling_list),
+            telescope.blancoSlewTime(0., 0., 0., telescope.decamHexSpacing))
     slot_time = tot_exptime*hexesPerSlot
     slot_duration = slot_time/60. ;# in minutes
     return slot_duration
@@ -111,24 +124,26 @@ def findStartMap ( probs, times, n_slots ) :
 #
 #   if we do zzi at 2 mins/image then 4 min/hex + 2 min/hex2 = 6 mins
 #   call it 60 minute slots  and 10 hexes/slot
+#
+#   hexes are matched across slots by their integer index in the hexCatalog of camera
+#   scheduler is "greedy" (greedySchedule) or "optimal" (optimalSchedule, which
+#   also reports the greedy schedule's probability; slotDuration in minutes
+#   gives it per telescope-hour)
+#   capacity, if given, is a function of a schedule giving the places of
+#   each slot, {slot: n}, from the time the slot's hexes take (getHexObservations
+#   .slewCapacity); the hexes are scheduled again in those places until
+#   they settle, at most capacityPasses times. The places found from the 
+#   first schedule may be more or fewer than maxHexesPerSlot; after that
+#   they only go down, so that they settle with every slot's hexes in its time.
+capacityPasses = 10
+
 def observing(sim, nslots, data_dir, 
-        maxHexesPerSlot = 4, mapZero = 0, do_nslots = -1, start_slot=-1, verbose=0) :
+        maxHexesPerSlot = 4, mapZero = 0, do_nslots = -1, start_slot=-1, verbose=0,
+        camera="decam", scheduler="greedy", slotDuration=None, capacity=None) :
+    import hexCatalog
+    catalog = hexCatalog.getHexCatalog(camera)
     # prep the observing lists
     observingSlots = np.arange(0,nslots)
-    slotsObserving = dict()
-    slotsObserving["nslots"] = nslots
-    slotsObserving["mapZero"] = mapZero
-    slotsObserving["do_nslots"] = do_nslots
-    slotsObserving["start_slot"] = start_slot
-    for i in observingSlots :
-        slotsObserving[i] = 0
-        slotsObserving[i,"ra"]   = np.array([])
-        slotsObserving[i,"dec"]  = np.array([])
-        slotsObserving[i,"id"]  = np.array([])
-        slotsObserving[i,"prob"] = np.array([])
-        slotsObserving[i,"mjd"] = np.array([])
-        slotsObserving[i,"slotNum"] = np.array([]) ;#non-zero prob slots
-        slotsObserving[i,"islot"] = np.array([]) ;# range(0,nslots)
 
     # read in the hexelated probability data
     hexData = dict()
@@ -140,101 +155,482 @@ def observing(sim, nslots, data_dir,
         raHexen, decHexen, idHexen, hexVal, rank, mjd, slotNum = \
            loadHexalatedProbabilities( sim, map_i, data_dir)
         islot = i*np.ones(raHexen.size)
+        hexIndex = catalog.indexOfRaDec(raHexen, decHexen)
+        if np.any(hexIndex == -1) :
+            raise Exception("slot {} has hexes not in {}".format(map_i, catalog.hexFile))
         print "\t", map_i, "map size= {:10d};".format(raHexen.size), 
 
         impossible = 1e-5
         impossible = 1e-7
         impossible = 1e-8
         ix = np.nonzero(hexVal < impossible)
-        raHexen, decHexen, idHexen, hexVal, mjd, slotNum, islot  = \
+        raHexen, decHexen, idHexen, hexVal, mjd, slotNum, islot, hexIndex  = \
             np.delete(raHexen, ix), \
             np.delete(decHexen, ix), \
             np.delete(idHexen, ix), \
             np.delete(hexVal, ix), \
             np.delete(mjd, ix) , \
             np.delete(slotNum, ix), \
-            np.delete(islot, ix)
+            np.delete(islot, ix), \
+            np.delete(hexIndex, ix)
         print " n hexes w/ >{} probability=".format(str(impossible)),
         print "{:4d};".format(raHexen.size),
         print "  in slot,all_possible_hexes sum prob= {:7.4f} %".format( 100*hexVal.sum())
-        hexData[i] = raHexen, decHexen, idHexen, hexVal, mjd, slotNum, islot
+        hexData[i] = raHexen, decHexen, idHexen, hexVal, mjd, slotNum, islot, hexIndex
         #print i, np.sort(hexVal[0:10]), hexVal.sum(), 100.*hexVal.sum(),"%"
 
-    # start the search for all max probabilities
-    # we'll assume the list is less than 40,000 long, the n-sq-degrees/sky
-    for n in range(0,40000) :
-        # search for a single max probabilities
-        maxRa, maxDec, maxId, maxProb, maxMjd, maxSlotNum, maxIslot  = \
-            findMaxProbOfAllHexes(hexData, slotsObserving, observingSlots, n, verbose) 
-        maxData = maxRa,maxDec,maxId, maxProb,maxMjd,maxSlotNum, maxIslot
-
-        # we've found the maximum probability on the lists, 
-        # so add it to the obs lists # unless not possible. 
-        # If the latter, delete it from that slot
-        slot = maxIslot
-        # if slot is -1, then no max prob found
-        if slot > -1 :  
-            if slotsObserving[slot] < maxHexesPerSlot : 
-                # it is possible to make the observation, 
-                # put it onto the observing lists
-                slotsObserving = addObsToSlot (slotsObserving, maxData, slot)
-                if verbose >= 1: print n, "slot of max:",slot
+    places = maxHexesPerSlot
+    for npass in range(0, capacityPasses) :
+        slotsObserving = newSlotsObserving(nslots, mapZero, do_nslots, start_slot)
+        if scheduler == "greedy" :
+            # the greedy schedule, highest probability first
+            slotsObserving = greedySchedule(hexData, slotsObserving, places, verbose)
+        elif scheduler == "optimal" :
+            # the schedule of most summed probability, against the greedy one
+            greedy = greedySchedule(hexData, newSlotsObserving(nslots, mapZero, do_nslots, start_slot),
+                places, verbose)
+            slotsObserving = optimalSchedule(hexData, slotsObserving, places, verbose)
+            compareSchedules(greedy, slotsObserving, places, slotDuration)
+        else :
+            raise Exception("scheduler={} ! Can only be greedy or optimal".format(scheduler))
+        if capacity is None : break
+        new_places = capacity(slotsObserving)
+        if npass > 0 :
+            new_places = dict([(i, min(new_places[i], places[i])) for i in new_places.keys()])
+        if new_places == places : break
+        places = new_places
+        print "	 places of the slots from the time their hexes take:", \
+            [places[i] for i in sorted(places.keys())]
+    sumObs = 0
+    for i in hexData.keys() :
+        sumObs += slotsObserving[i]
+    print "\t======================================== "
+    print "\tnumber of hexes possible to observe = ", sumObs
+    print "\t======================================== "
+    return slotsObserving
+
+# the empty observing lists of nslots slots
+def newSlotsObserving (nslots, mapZero=0, do_nslots=-1, start_slot=-1) :
+    slotsObserving = dict()
+    slotsObserving["nslots"] = nslots
+    slotsObserving["mapZero"] = mapZero
+    slotsObserving["do_nslots"] = do_nslots
+    slotsObserving["start_slot"] = start_slot
+    for i in range(0,nslots) :
+        slotsObserving[i] = 0
+        slotsObserving[i,"ra"]   = np.array([])
+        slotsObserving[i,"dec"]  = np.array([])
+        slotsObserving[i,"id"]  = np.array([])
+        slotsObserving[i,"prob"] = np.array([])
+        slotsObserving[i,"mjd"] = np.array([])
+        slotsObserving[i,"slotNum"] = np.array([]) ;#non-zero prob slots
+        slotsObserving[i,"islot"] = np.array([]) ;# range(0,nslots)
+    return slotsObserving
+
+# the places of slot i: maxHexesPerSlot, or maxHexesPerSlot[i] if it is a dict
+def slotPlaces (maxHexesPerSlot, i) :
+    if isinstance(maxHexesPerSlot, dict) : return maxHexesPerSlot[i]
+    return maxHexesPerSlot
+
+#
+# Replan from now.
+#
+# To replan part way through the night, for weather lost or hexes done,
+# observing would read every -hexVals.txt file again, and make_hexes would need
+# start_slot and do_nslots. replan takes the night's (slots x hexes) values
+# from the hexVals store (hexalate.writeHexValStore), memory mapped and kept
+# in memory between calls, and schedules only what is left:
+#   observed, hex ids (or hexCatalog indices) already done, are taken out of every slot
+#   slots over by mjd are dropped; the slot under way keeps the places
+#       not yet gone by, slotDuration (minutes) being its length
+#   mapZero, nslots limit it to the slots make_hexes used, if given
+#   with units (visitUnits), the visits are scheduled (visitSchedule),
+#       and an observed hex has all of its visits done
+#   with mjd None, the whole night is planned
+# Returns slotsObserving, as observing does, for the slots left.
+#
+#   hoursObserving = obsSlots.replan(trigger_id, data_dir, ["24-31", "25-30"], mjd_now,
+#       maxHexesPerSlot, slotDuration)
+#
+def replan (sim, data_dir, observed, mjd, maxHexesPerSlot, slotDuration,
+        mapZero=0, nslots=-1, camera="decam", scheduler="greedy", verbose=0,
+        units=None, working_filter=None, min_revisit=0.) :
+    import hexCatalog
+    catalog = hexCatalog.getHexCatalog(camera)
+    store = nightHexVals(sim, data_dir, camera)
+    slotLength = slotDuration/(60.*24.)
+
+    done = np.zeros(catalog.size, dtype=bool)
+    observed = np.atleast_1d(observed)
+    if observed.size > 0 :
+        if observed.dtype.kind in "iu" :
+            done[observed] = True
+        else :
+            # the ids of a -hexVals.txt file have a leading space
+            done[catalog.indicesOfIds(np.char.strip(observed.astype(str)))] = True
+
+    if mjd is None : mjd = store["mjd"].min()
+    rows, = np.nonzero((store["mjd"] + slotLength > mjd) & (store["slot"] >= mapZero))
+    if nslots > -1 :
+        rows = rows[store["slot"][rows] < mapZero+nslots]
+    if rows.size == 0 :
+        return newSlotsObserving(0, mapZero)
+    first = store["slot"][rows].min()
+    slotsObserving = newSlotsObserving(store["slot"][rows].max()-first+1, first)
+
+    hexIndex = store["hexIndex"]
+    notDone = ~done[hexIndex]
+    hexData = dict()
+    gone = dict()
+    weights, capacity = dict(), dict()
+    for row in rows :
+        i = store["slot"][row] - first
+        hexVal = np.asarray(store["vals"][row])
+        ix, = np.nonzero((hexVal >= 1e-8) & notDone)
+        index = hexIndex[ix]
+        hexData[i] = catalog.ra[index], catalog.dec[index], catalog.id[index], hexVal[ix], \
+            np.zeros(ix.size) + store["mjd"][row], np.zeros(ix.size) + store["slot"][row], \
+            np.zeros(ix.size) + i, index
+        # the places of the slot under way that are gone by
+        fraction = (mjd - store["mjd"][row])/slotLength
+        gone[i] = int(np.floor(maxHexesPerSlot*np.clip(fraction, 0., 1.)))
+        slotsObserving[i] = gone[i]
+        if units is not None :
+            weights[i] = filterWeights(units, store, row, ix, working_filter)
+            capacity[i] = maxHexesPerSlot*units["cost"].sum()*(1.-np.clip(fraction, 0., 1.))
+            slotsObserving[i] = gone[i] = 0
+
+    if units is not None :
+        if scheduler != "greedy" :
+            raise Exception("scheduler={} ! Visits can only be greedy".format(scheduler))
+        slotsObserving = visitSchedule(hexData, weights, slotsObserving, units, capacity,
+            slotDuration, min_revisit, verbose)
+    elif scheduler == "greedy" :
+        slotsObserving = greedySchedule(hexData, slotsObserving, maxHexesPerSlot, verbose)
+    elif scheduler == "optimal" :
+        slotsObserving = optimalSchedule(hexData, slotsObserving, maxHexesPerSlot, verbose)
+    else :
+        raise Exception("scheduler={} ! Can only be greedy or optimal".format(scheduler))
+    for i in gone.keys() :
+        slotsObserving[i] -= gone[i]
+    if verbose >= 1 :
+        print "\t replan at mjd {:.4f}: {} slots left, {} hexes done".format(
+            mjd, len(hexData), done.sum())
+    return slotsObserving
+
+# the hexVals store of the night; made from the -hexVals.txt files,
+# if the maps were made by older code
+def nightHexVals (sim, data_dir, camera="decam") :
+    import hexalate
+    import hexCatalog
+    import glob
+    import re
+    store = hexalate.readHexValStore(data_dir, sim)
+    if store is not None : return store
+
+    files = glob.glob(os.path.join(data_dir, str(sim) + "-*-hexVals.txt"))
+    pattern = re.compile(re.escape(str(sim)) + r"-(\d+)-hexVals.txt$")
+    slots = sorted([int(pattern.search(f).group(1)) for f in files if pattern.search(f)])
+    if len(slots) == 0 :
+        raise Exception("no hexVals store or -hexVals.txt files for {} in {}".format(sim, data_dir))
+    catalog = hexCatalog.getHexCatalog(camera)
+    vals, mjds = [], []
+    for slot in slots :
+        raHexen, decHexen, idHexen, hexVal, rank, mjd, slotNum = \
+            loadHexalatedProbabilities(sim, slot, data_dir)
+        if len(vals) == 0 :
+            hexIndex = catalog.indexOfRaDec(raHexen, decHexen)
+            if np.any(hexIndex == -1) :
+                raise Exception("slot {} has hexes not in {}".format(slot, catalog.hexFile))
+        elif hexVal.size != hexIndex.size :
+            raise Exception("slot {} has other hexes than slot {}".format(slot, slots[0]))
+        vals.append(hexVal)
+        mjds.append(mjd[0])
+    hexalate.writeHexValStore(data_dir, sim, np.vstack(vals), hexIndex, slots, mjds)
+    return hexalate.readHexValStore(data_dir, sim)
+
+#
+# The greedy schedule, as greedyRescan (checkSchedules.py) makes it, without the rescans.
+#
+# greedyRescan finds the highest probability hex of all the slots, puts it
+# in its slot, deletes it from every slot, and does it again: each hex placed
+# costs a search of, and a delete from, every slot. Here the (hex, slot)
+# candidates of every slot are put once into the order greedyRescan takes
+# them: highest probability first, ties to the lower slot, then to the
+# earlier hex in the slot's hexVals file. The priorities never change,
+# so the priority queue is one lexsort. The candidates are taken in that
+# order, and one whose hex is already observed or whose slot is full is
+# dropped when it comes up (lazy invalidation) rather than deleted from
+# every slot when its hex is placed. That is O(N log N) in the N candidates.
+# maxHexesPerSlot may be per slot (slotPlaces), as may that of optimalSchedule.
+#
+#   hexData[i] = raHexen, decHexen, idHexen, hexVal, mjd, slotNum, islot, hexIndex
+#
+def greedySchedule (hexData, slotsObserving, maxHexesPerSlot, verbose=0) :
+    slots = sorted(hexData.keys())
+    if len(slots) == 0 : return slotsObserving
+    value    = np.concatenate([hexData[i][3] for i in slots])
+    slot     = np.concatenate([np.zeros(hexData[i][3].size, dtype=int)+i for i in slots])
+    position = np.concatenate([np.arange(hexData[i][3].size) for i in slots])
+    hexIndex = np.concatenate([hexData[i][7] for i in slots]).astype(int)
+    if value.size == 0 : return slotsObserving
+    order = np.lexsort((position, slot, -value))
+
+    observed = np.zeros(hexIndex.max()+1, dtype=bool)
+    nobs = dict([(i, slotsObserving[i]) for i in slots])
+    places = dict([(i, slotPlaces(maxHexesPerSlot, i)) for i in slots])
+    open_slots = len([i for i in slots if nobs[i] < places[i]])
+    for k in order :
+        if open_slots == 0 : break
+        i, j = slot[k], position[k]
+        if observed[hexIndex[k]] or nobs[i] >= places[i] : continue
+        observed[hexIndex[k]] = True
+        nobs[i] += 1
+        if nobs[i] >= places[i] : open_slots -= 1
+        hexRa, hexDec, hexId, hexVal, hexMjd, hexSlotNum, hexIslot, hexIndices = hexData[i]
+        maxData = hexRa[j], hexDec[j], hexId[j], hexVal[j], hexMjd[j], hexSlotNum[j], i
+        if verbose >= 1: print "slot of max:",i, hexVal[j]
+        slotsObserving = addObsToSlot (slotsObserving, maxData, i)
+    return slotsObserving
+
+#
+# The schedule of the most summed probability.
+#
+# The greedy schedule places the highest probability (hex, slot) first, which
+# can take a hex for one slot that another slot needed more. Placing hexes in
+# the maxHexesPerSlot places of each slot, each hex at most once, for the most
+# summed probability is a min cost flow: source -> hex (1) -> slot (1, the
+# probability) -> sink (the slot's places). It is solved by successive 
+# longest paths: each step adds one hex, along the path of greatest gain, 
+# a free hex into a slot, a hex of that slot moved on to another, ... ending 
+# in a slot with a free place, until no path gains. The hexes are nodes of
+# the path only through their slots, so the path is found by Bellman-Ford over
+# the slots (tens), with the gains of moving each slot's hexes to every other
+# slot, and of taking each free hex, as numpy arrays.
+# Only the best K candidates of a slot, K the number of places, can be
+# needed: a schedule using another has an unplaced one of the K to swap in.
+# So the hexes are the union of those.
+# The hexes of a slot are listed highest probability first, as by greedySchedule.
+#
+#   hexData[i] = raHexen, decHexen, idHexen, hexVal, mjd, slotNum, islot, hexIndex
+#
+def optimalSchedule (hexData, slotsObserving, maxHexesPerSlot, verbose=0) :
+    slots = [i for i in sorted(hexData.keys()) if hexData[i][3].size > 0]
+    places = np.array([max(int(slotPlaces(maxHexesPerSlot, i)) - slotsObserving[i], 0) for i in slots])
+    if places.sum() == 0 : return slotsObserving
+    nslots = len(slots)
+
+    # the best candidates of each slot, by value then position as greedySchedule
+    best = []
+    for i in slots :
+        hexVal = hexData[i][3]
+        best.append(np.lexsort((np.arange(hexVal.size), -hexVal))[:places.sum()])
+    hexes = np.unique(np.concatenate(
+        [hexData[i][7][best[k]] for k,i in enumerate(slots)]).astype(int))
+    # value of hex in slot, -inf if not a candidate
+    value = np.zeros((hexes.size, nslots)) - np.inf
+    position = np.zeros((hexes.size, nslots), dtype=int) - 1
+    for k,i in enumerate(slots) :
+        # in reverse, so a hex twice in a slot keeps its best
+        j = best[k][::-1]
+        rows = np.searchsorted(hexes, hexData[i][7][j].astype(int))
+        value[rows,k] = hexData[i][3][j]
+        position[rows,k] = j
+
+    where = np.zeros(hexes.size, dtype=int) - 1
+    used = np.zeros(nslots, dtype=int)
+    for n in range(0, places.sum()) :
+        # the gain of taking the best free hex into each slot
+        free, = np.nonzero(where == -1)
+        gain = np.zeros(nslots) - np.inf
+        enter = np.zeros(nslots, dtype=int) - 1
+        if free.size > 0 :
+            enter = free[np.argmax(value[free], axis=0)]
+            gain = value[enter, np.arange(nslots)]
+        # the gain of moving a hex of slot a on to slot b
+        move = np.zeros((nslots, nslots)) - np.inf
+        mover = np.zeros((nslots, nslots), dtype=int) - 1
+        for a in np.nonzero(used)[0] :
+            in_a, = np.nonzero(where == a)
+            change = value[in_a] - value[in_a, a][:,np.newaxis]
+            mover[a] = in_a[np.argmax(change, axis=0)]
+            move[a] = change.max(axis=0)
+        move[np.arange(nslots), np.arange(nslots)] = -np.inf
+        # longest paths from a free hex to each slot; there are no cycles of 
+        # gain, so ask for more than round off to make a step
+        came_from = np.zeros(nslots, dtype=int) - 1
+        for step in range(0, nslots) :
+            through = gain[:,np.newaxis] + move
+            a = np.argmax(through, axis=0)
+            better, = np.nonzero(through[a, np.arange(nslots)] > gain + 1e-15)
+            if better.size == 0 : break
+            gain[better] = through[a[better], better]
+            came_from[better] = a[better]
+        # the best path ends in a slot with a free place
+        gain[used >= places] = -np.inf
+        end = np.argmax(gain)
+        if not gain[end] > 0 : break
+        used[end] += 1
+        b = end
+        for step in range(0, nslots) :
+            if came_from[b] == -1 : break
+            a = came_from[b]
+            where[mover[a,b]] = b
+            b = a
+        where[enter[b]] = b
+
+    for k,i in enumerate(slots) :
+        placed = position[where == k, k]
+        hexRa, hexDec, hexId, hexVal, hexMjd, hexSlotNum, hexIslot, hexIndex = hexData[i]
+        for j in placed[np.lexsort((placed, -hexVal[placed]))] :
+            maxData = hexRa[j], hexDec[j], hexId[j], hexVal[j], hexMjd[j], hexSlotNum[j], i
+            if verbose >= 1: print "slot:",i, hexVal[j]
+            slotsObserving = addObsToSlot (slotsObserving, maxData, i)
+    return slotsObserving
+
+# print the summed probability of two schedules, and per telescope-hour
+# if the slotDuration (minutes) is known; a hex takes its slot's duration 
+# over the slot's places
+def compareSchedules (greedy, optimal, maxHexesPerSlot, slotDuration=None) :
+    print "\t scheduler     n hexes   sum prob",
+    if slotDuration is not None : print "   prob/telescope-hour",
+    print ""
+    sums = []
+    for name, schedule in [("greedy", greedy), ("optimal", optimal)] :
+        ra,dec,id,prob,mjd,slotNum,islot = slotsObservingToNpArrays(schedule)
+        sums.append(prob.sum())
+        print "\t {:10s}  {:8d}   {:7.4f} %".format(name, prob.size, 100*prob.sum()),
+        if slotDuration is not None and prob.size > 0 :
+            places = np.array([slotPlaces(maxHexesPerSlot, int(i)) for i in islot], dtype=float)
+            hours = (slotDuration/places).sum()/60.
+            print "   {:7.4f} %".format(100*prob.sum()/hours),
+        print ""
+    print "\t optimal - greedy = {:.4f} %".format(100*(sums[1]-sums[0]))
+
+#
+# Visits.
+#
+# A slot holds maxHexesPerSlot hexes, each observed with every exposure of the
+# strategy at every tiling. Here each (hex, tiling, filter) visit is
+# scheduled on its own: the units of the strategy are, for each tiling, the
+# exposures of each filter (visitUnits). A unit costs its exposures and their
+# overheads; a slot has the time of maxHexesPerSlot hexes of all the units.
+# The value of a unit in a slot is the hex's probability in the slot, shared
+# equally among the units, times the depth its filter keeps, relative to the
+# working filter, under the slot's sky at the hex (filterWeights): a filter 
+# the moon hurts more than the working filter goes to the darker slots.
+# Two tilings of a hex are to be min_revisit minutes apart: in different slots
+# by the slots' mjds; in one slot they are passes over the slot's hexes,
+# a slot length over the number of tilings apart for each pass between them.
+# The units are placed in one greedy pass, as greedySchedule does the hexes:
+# highest value first, ties to the lower slot, the earlier hex, the earlier
+# unit. With min_revisit 0 and one filter, this is the schedule of
+# greedySchedule with every unit of each hex in the hex's slot.
+#
+#   units = obsSlots.visitUnits(exposure_list, filter_list, tiling_list, overhead)
+#   hexData[i] = raHexen, decHexen, idHexen, hexVal, mjd, slotNum, islot, hexIndex
+#   weights[i] = (units x hexes of hexData[i]), capacity[i] = seconds left in slot i
+#
+def visitUnits (exposure_lengths, filter_list, tiling_list, overhead) :
+    exposure_lengths = np.atleast_1d(exposure_lengths)
+    filter_list = np.atleast_1d(filter_list)
+    # the filters in the order of the strategy
+    filters = [f for k,f in enumerate(filter_list) if f not in filter_list[:k]]
+    units = dict(tiling=[], filter=[], exposure=[], cost=[], tilingPass=[])
+    for k, tiling in enumerate(np.atleast_1d(tiling_list)) :
+        for filter in filters :
+            exposures = exposure_lengths[filter_list == filter]
+            units["tiling"].append(tiling)
+            units["filter"].append(filter)
+            units["exposure"].append(exposures)
+            units["cost"].append((np.array(overhead)+exposures).sum())
+            units["tilingPass"].append(k)
+    for key in ["tiling", "filter", "cost", "tilingPass"] :
+        units[key] = np.array(units[key])
+    return units
+
+# the (units x hexes) weights of the units at the hexes in the store's row:
+#   the depth lost in the unit's filter, less that lost in working_filter, as a
+#   flux fraction, at most one. One if the store has no sky for the filters.
+def filterWeights (units, store, row, columns, working_filter) :
+    weights = np.ones((units["filter"].size, np.size(columns)))
+    sky = store.get("sky", dict())
+    if working_filter not in sky : return weights
+    working = np.asarray(sky[working_filter][row])[columns]
+    for u, filter in enumerate(units["filter"]) :
+        if filter == working_filter or filter not in sky : continue
+        delta_mag = 0.5*(np.asarray(sky[filter][row])[columns] - working)
+        weights[u] = np.minimum(1.0, 10**(0.4*delta_mag))
+    return weights
+
+def visitSchedule (hexData, weights, slotsObserving, units, capacity, slotLength,
+        min_revisit=0., verbose=0) :
+    slots = sorted(hexData.keys())
+    nunits = units["cost"].size
+    if len(slots) == 0 : return slotsObserving
+    value    = np.concatenate([(hexData[i][3]*weights[i]/nunits).ravel() for i in slots])
+    if value.size == 0 : return slotsObserving
+    slot     = np.concatenate([np.zeros(weights[i].size, dtype=int)+i for i in slots])
+    unit     = np.concatenate([np.repeat(np.arange(nunits), hexData[i][3].size) for i in slots])
+    position = np.concatenate([np.tile(np.arange(hexData[i][3].size), nunits) for i in slots])
+    order = np.lexsort((unit, position, slot, -value))
+
+    cost = units["cost"]
+    tilingPass = units["tilingPass"]
+    # minutes between two passes of a slot
+    passTime = slotLength/float(np.unique(tilingPass).size)
+    slotMjd = dict([(i, hexData[i][4][0]) for i in slots if hexData[i][4].size > 0])
+    left = dict([(i, capacity[i]) for i in slots])
+    open_slots = len([i for i in slots if left[i] >= cost.min()])
+    placed = dict()
+    for k in order :
+        if open_slots == 0 : break
+        i, j, u = slot[k], position[k], unit[k]
+        if left[i] < cost[u] : continue
+        hexIndex = hexData[i][7][j]
+        visits = placed.get(hexIndex, [])
+        if u in [v for v,islot in visits] : continue
+        conflict = False
+        for v, islot in visits :
+            if tilingPass[v] == tilingPass[u] : continue
+            if islot == i : 
+                apart = abs(tilingPass[u] - tilingPass[v])*passTime
             else :
-                # but if this slot of observing is full, it is not possible 
-                # to make the observation,
-                # so move on AFTER deleting it from the list
-                hexData = deleteHexFromSlot (hexData, slot, maxProb) 
-        #if verbose >= 2: 
-        #   if n > 7: raise Exception("jack")
-    
-        # perform the necessary bookkeeping, 
-        # eliminating this hex from future observing
-        hexData = deleteHexFromAllSlots (
-            hexData, slotsObserving, observingSlots, maxRa, maxDec, verbose, n) 
-
-        # do some summary statistics
-        sumHexes = 0
-        sumObs = 0
-        for i in range(0,nslots) :
-# JTA 6
-            if start_slot > -1 and do_nslots > -1 :
-                if i+mapZero < start_slot or i+mapZero >= start_slot+do_nslots : continue
-            sumHexes += hexData[i][0].size
-            sumObs += slotsObserving[i]
+                apart = abs(slotMjd[i] - slotMjd[islot])*24.*60.
+            if apart < min_revisit : conflict = True
+        if conflict : continue
+        placed[hexIndex] = visits + [(u, i)]
+        was_open = left[i] >= cost.min()
+        left[i] -= cost[u]
+        if was_open and left[i] < cost.min() : open_slots -= 1
+        hexRa, hexDec, hexId, hexVal, hexMjd, hexSlotNum, hexIslot, hexIndices = hexData[i]
+        maxData = hexRa[j], hexDec[j], hexId[j], value[k], hexMjd[j], hexSlotNum[j], i
+        if verbose >= 1: print "slot:",i, value[k], units["tiling"][u], units["filter"][u]
+        slotsObserving = addVisitToSlot (slotsObserving, maxData, i, 
+            units["tiling"][u], units["filter"][u])
+    return slotsObserving
 
-        if verbose >= 2: 
-            print "sumHexes =", sumHexes, 
-            print "   slots left=", len(observingSlots),
-            print "   slots=",observingSlots,
-            print "   n_obs=",
-            for i in observingSlots:
-                print slotsObserving[i],
-            print "   sum prob= ",
-            for i in observingSlots:
-                print " {:8.6f}".format( slotsObserving[i,"prob"].sum()) ,
-            print ""
-
-        # eliminate full observing slots
-        observingSlots = eliminateFullObservingSlots(\
-            hexData, slotsObserving, observingSlots, maxHexesPerSlot, verbose) 
-
-        # check and see if we are done
-        # two conditions: observing is full, or candidates empty
-        if (len(observingSlots)==0) | (sumHexes == 0) :
-            print "\t======================================== "
-            if verbose >= 1: 
-                print "n slots =", len(observingSlots)," == 0?"
-                print "sumHexes = ", sumHexes, "==? 0"
-            print "\tnumber of hexes possible to observe = ", sumObs
-            print "\t======================================== "
-            return slotsObserving 
-
-        # otherwise, go back and do it again
-    
-    # we've done everything on the lists, we can observe it all,
-    # return this great success that will never be reached.
+# addObsToSlot, with the tiling and filter of the visit
+def addVisitToSlot (slotsObserving, maxData, slot, tiling, filter) :
+    slotsObserving = addObsToSlot (slotsObserving, maxData, slot)
+    slotsObserving[slot,"tiling"] = np.append(
+        slotsObserving.get((slot,"tiling"), np.array([], dtype=int)), tiling)
+    slotsObserving[slot,"filter"] = np.append(
+        slotsObserving.get((slot,"filter"), np.array([], dtype=str)), filter)
     return slotsObserving
-    
+
+# the tiling and filter of each entry of slotsObservingToNpArrays, 
+# None if slotsObserving is not of visits
+def visitsToNpArrays (slotsObserving) :
+    nslots = slotsObserving["nslots"]
+    if not np.any([(i,"tiling") in slotsObserving for i in range(0,nslots)]) :
+        return None, None
+    tiling, filter = np.array([], dtype=int), np.array([], dtype=str)
+    for i in range(0,nslots) :
+        tiling = np.append(tiling, slotsObserving.get((i,"tiling"), np.array([], dtype=int)))
+        filter = np.append(filter, slotsObserving.get((i,"filter"), np.array([], dtype=str)))
+    return tiling, filter
+
 #
 # examine the statistics of the observing lists
 #
@@ -291,6 +687,18 @@ def readObservingRecord(trigger_id, data_dir) :
             np.array([0,]),np.array([0,]),np.array([0,]),np.array([0,])
     return ra,dec,id,prob,mjd,slotNum,dist
 
+# the tiling and filter columns of the record, None, None if it is not of visits
+#  tiling,filter = obsSlots.readObservingVisits(trigger_id,data_dir)
+def readObservingVisits(trigger_id, data_dir) :
+    import os
+    name = os.path.join(data_dir, str(trigger_id) + "-ra-dec-id-prob-mjd-slot-dist.txt")
+    if not os.path.exists(name) : return None, None
+    fd = open(name,"r"); header = fd.readline(); fd.close()
+    if "tiling" not in header : return None, None
+    tiling = np.atleast_1d(np.genfromtxt(name,comments="#",usecols=(7),dtype=int))
+    filter = np.atleast_1d(np.genfromtxt(name,comments="#",usecols=(8),dtype="str"))
+    return tiling, filter
+
 def slotsObservingToNpArrays(slotsObserving) :
 
     do_nslots  = slotsObserving["do_nslots"]
@@ -342,6 +750,7 @@ def findMaxProbOfAllHexes(hexData, slotsObserving, observingSlots, n="", verbose
         hexVal    = data[3]
         hexMjd    = data[4]
         hexMyslot = data[5]
+        hexIndex  = data[7]
         if hexVal.size == 0: continue
         if verbose >= 2: 
             if i == 2: print n,"====",i, "hexSize =",hexRa.size
@@ -358,19 +767,20 @@ def findMaxProbOfAllHexes(hexData, slotsObserving, observingSlots, n="", verbose
             maxMjd    = hexMjd[ix]
             maxProb   = newProb
             maxSlot   = hexMyslot[ix]
+            maxIndex  = hexIndex[ix]
             islot = i
     #print "observingSlots", observingSlots
     if maxProb == -1 : 
-        maxRa, maxDec, maxId, maxVal, maxMjd, maxSlot, islot = \
-            -1,-1,-1,-1,-1,-1,-1
+        maxRa, maxDec, maxId, maxVal, maxMjd, maxSlot, islot, maxIndex = \
+            -1,-1,-1,-1,-1,-1,-1,-1
         #raise Exception("no max probability found")
     try :
         if len(maxRa) > 1 :
-            maxRa, maxDec, maxId, maxVal, maxMjd, maxSlot, islot = \
-            maxRa[0], maxDec[0], maxId[0], maxVal[0], maxMjd[0], maxSlot[0], islot
+            maxRa, maxDec, maxId, maxVal, maxMjd, maxSlot, islot, maxIndex = \
+            maxRa[0], maxDec[0], maxId[0], maxVal[0], maxMjd[0], maxSlot[0], islot, maxIndex[0]
     except :
         pass
-    return maxRa, maxDec, maxId, maxVal, maxMjd, maxSlot, islot
+    return maxRa, maxDec, maxId, maxVal, maxMjd, maxSlot, islot, maxIndex
 
 # we've found a hex,slot that can be observed so add it the the observing lists
 def addObsToSlot (slotsObserving, maxData, slot) :
@@ -393,7 +803,7 @@ def addObsToSlot (slotsObserving, maxData, slot) :
 # there can be no more observing in this slot, so this hex,slotj
 # is impossible, delete it from the list.
 def deleteHexFromSlot (hexData, slot, maxProb) :
-    hexRa, hexDec, hexId, hexVal, hexMjd, hexSlotNum, hexIslot = hexData[slot] 
+    hexRa, hexDec, hexId, hexVal, hexMjd, hexSlotNum, hexIslot, hexIndex = hexData[slot] 
     ix = np.nonzero(hexVal == maxProb) 
     hexRa  = np.delete(hexRa, ix)
     hexDec = np.delete(hexDec, ix)
@@ -402,11 +812,13 @@ def deleteHexFromSlot (hexData, slot, maxProb) :
     hexMjd = np.delete(hexMjd, ix)
     hexSlotNum = np.delete(hexSlotNum, ix)
     hexIslot   = np.delete(hexIslot, ix)
-    hexData[slot] = hexRa, hexDec, hexId, hexVal, hexMjd, hexSlotNum, hexIslot
+    hexIndex   = np.delete(hexIndex, ix)
+    hexData[slot] = hexRa, hexDec, hexId, hexVal, hexMjd, hexSlotNum, hexIslot, hexIndex
     return hexData
 # the hex,slot has made it onto an observing list, so remove the hex
 # from all hex lists ( rm hex,*)
-def deleteHexFromAllSlots (hexData, slotsObserving, observingSlots, maxRa, maxDec, verbose=0, n="") :
+#   the hex is known by its hexCatalog index, not by float ra,dec equality
+def deleteHexFromAllSlots (hexData, slotsObserving, observingSlots, maxIndex, verbose=0, n="") :
     warnings.filterwarnings("ignore")
     do_nslots  = slotsObserving["do_nslots"]
     start_slot = slotsObserving["start_slot"]
@@ -417,30 +829,9 @@ def deleteHexFromAllSlots (hexData, slotsObserving, observingSlots, maxRa, maxDe
 # JTA 4
         if start_slot > -1 and do_nslots > -1 :
             if i+mapZero < start_slot or i+mapZero >= start_slot+do_nslots : continue
-        data = hexData[i]
-        data = hexData[i]
-        hexRa  = data[0]
-        hexDec = data[1]
-        hexId  = data[2]
-        hexVal = data[3]
-        hexMjd = data[4]
-        hexSlotNum = data[5]
-        hexIslot   = data[6]
-        #print len(hexRa)
-        #print len(maxRa)
-        try:
-            ix = np.nonzero((hexRa == maxRa) & (hexDec == maxDec))
-        except:
-            print "len hexRA hexDec "+str(len(hexRa))+" "+str(len(hexDec))
-            print "len maxRA maxDec "+str(len(maxRa))+" "+str(len(maxDec))
-            maxRa = max(maxRa)
-            maxDec = max(maxDec)
-            ix = np.nonzero((hexRa == maxRa) & (hexDec == maxDec))
-            print i
-            print ix              
-#        print "ag compare i "+str(i)
-#        print ix
-        if verbose >=4 : print ix, hexRa, maxRa
+        hexRa, hexDec, hexId, hexVal, hexMjd, hexSlotNum, hexIslot, hexIndex = hexData[i]
+        ix = np.nonzero(hexIndex == maxIndex)
+        if verbose >=4 : print ix, hexIndex, maxIndex
         if verbose >=2 : 
             ixs = np.shape(ix)[1]
             print n,"bookkeeping",i,"  nHex=",hexRa.size, "   ix.size", ixs, 
@@ -451,7 +842,8 @@ def deleteHexFromAllSlots (hexData, slotsObserving, observingSlots, maxRa, maxDe
         hexMjd = np.delete(hexMjd, ix)
         hexSlotNum = np.delete(hexSlotNum, ix)
         hexIslot   = np.delete(hexIslot, ix)
-        hexData[i] = hexRa, hexDec, hexId, hexVal, hexMjd, hexSlotNum, hexIslot
+        hexIndex   = np.delete(hexIndex, ix)
+        hexData[i] = hexRa, hexDec, hexId, hexVal, hexMjd, hexSlotNum, hexIslot, hexIndex
 
         if verbose >= 2: 
             print "\t after delete nHex=",hexRa.size,
@@ -710,22 +710,22 @@ def confidenceLevels(map) :
 
 #   ra, dec, ligo, maglim, prob, ha, x,y, hx,hy = readMaps(
 def readMaps(mapDir, simNumber, slot) :
-    import healpy as hp
+    import slotMaps
     # get the maps for a reasonable slot
-    name = os.path.join(mapDir, str(simNumber) + "-"+str(slot))
-    raMap     =hp.read_map(name+"-ra.hp", verbose=False);
-    decMap    =hp.read_map(name+"-dec.hp", verbose=False);
-    haMap     =hp.read_map(name+"-ha.hp", verbose=False);
-    xMap      =hp.read_map(name+"-x.hp", verbose=False);
-    yMap      =hp.read_map(name+"-y.hp", verbose=False);
-    hxMap     =hp.read_map(name+"-hx.hp", verbose=False);
-    hyMap     =hp.read_map(name+"-hy.hp", verbose=False);
-    ligoMap   =hp.read_map(name+"-map.hp", verbose=False);
-    maglimMap =hp.read_map(name+"-maglim.hp", verbose=False);
-    probMap   =hp.read_map(name+"-probMap.hp", verbose=False);
-    haMap=haMap/(2*np.pi/360.)
-    raMap=raMap/(2*np.pi/360.)
-    decMap=decMap/(2*np.pi/360.)
+    maps = slotMaps.readSlot(mapDir, simNumber, slot)
+    raMap     = maps["ra"]
+    decMap    = maps["dec"]
+    haMap     = maps["ha"]
+    xMap      = maps["x"]
+    yMap      = maps["y"]
+    hxMap     = maps["hx"]
+    hyMap     = maps["hy"]
+    ligoMap   = maps["map"]
+    maglimMap = maps["maglim"]
+    probMap   = maps["probMap"]
+    haMap=haMap.astype(np.float64)/(2*np.pi/360.)
+    raMap=raMap.astype(np.float64)/(2*np.pi/360.)
+    decMap=decMap.astype(np.float64)/(2*np.pi/360.)
     return raMap, decMap, ligoMap, maglimMap, probMap, \
         haMap, xMap, yMap, hxMap, hyMap
 
@@ -30,23 +30,15 @@ def calc(trigger_id, ra_dec_file_dir, mjd, expTime, filter, best=False, camera="
     # will work every hour from sunset to sunrise
     mjd_list = np.arange( sunset, sunrise+1./24., 1./24.)
     
-    # calculate the limiting magnitudes
-    limit_mag = []
-    best_limit_mag = []
-    moon_sep = []
-    moon_phase = []
+    # calculate the limiting magnitudes, every hour at once
     obs = mags.observed(ra,dec,prob, sunset, doMaps=False, verbose=False)
-    for mjd in mjd_list :
-        obs.resetTime(mjd)
-        obs.limitMag(filter,exposure=expTime)
-        limit_mag.append(obs.maglim)
-        best_limit_mag.append(obs.maglim[best_ix])
-        moon_sep.append(obs.moonSep[0]*360./2/np.pi)
-        moon_phase.append(obs.moonPhase)
-    limit_mag = np.vstack(limit_mag)
+    conditions = mags.nightConditions(obs, mjd_list, filter, exposure=expTime)
+    limit_mag = conditions.maglim.copy()
+    best_limit_mag = conditions.maglim[:,best_ix]
     ix = limit_mag < 0; limit_mag[ix] = 0
-    moon_sep = np.array(moon_sep)
-    moon_phase = np.array(moon_phase)
+    moon_sep = conditions.moonSep[:,0]*360./2/np.pi
+    moon_phase = np.zeros(mjd_list.size) + obs.moonPhase
+    obs.setConditions(conditions, mjd_list.size-1)
     # moon phase: where 0 = full, 90 equals half, and  180 = new
     # convert to %full
     moon_phase = ((180.-moon_phase)/180.)*100.
@@ -91,7 +91,8 @@ def moon_brightness_model ( filter, extinction, phase, moon_sep, moon_zd, obj_zd
     obj_airmass = -2.5*np.log10( 1-10**(-0.4*extinction*obj_airmass))
 
     scattering = scattering_function(moon_sep)
-    if moon_zd > 93 : phase = 0.0 
+    # moon_zd is a scalar, or one per row for mags.nightConditions
+    phase = np.where(moon_zd > 93, 0.0, phase)
     lunar_mag = moon_mag(phase, filter)
     sky = scattering + lunar_mag + lunar_airmass + obj_airmass
     return sky
@@ -102,7 +103,11 @@ def scattering_airmass(zenith_distance) :
     sin_zd = np.sin( zenith_distance )
     airmass = 1/(np.sqrt( 1 - 0.96*sin_zd**2 ))
     # the function is symmetrical about zd=90, not what we want
-    if airmass.size > 1 :
+    if airmass.ndim == 2 :
+        # (slots x pixels) from mags.nightConditions, each slot as its own map
+        ix = zenith_distance > 90*rad_per_deg
+        airmass = np.where(ix, airmass.max(axis=1)[:,np.newaxis], airmass)
+    elif airmass.size > 1 :
         ix=np.nonzero(zenith_distance > 90*rad_per_deg)
         if ix[0].size > 0 :
             airmass[ix] = airmass.max()
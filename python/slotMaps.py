@@ -0,0 +1,120 @@
+import numpy as np
+import os
+import shutil
+
+license="""
+   Copyright (C) 2014 James Annis
+
+   This program is free software; you can redistribute it and/or modify it
+   under the terms of version 3 of the GNU General Public License as
+   published by the Free Software Foundation.
+
+   More to the points- this code is science code: buggy, barely working,
+   with little or no documentation. Science code in the the alpine fast
+   & light style.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program; if not, write to the Free Software
+   Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""
+
+#
+# The maps of every slot of a trigger, in one place.
+#
+# mapsAtTimeT.probabilityMapSaver once wrote eleven healpix fits files for
+# each dark slot, <trigger_id>-<slot>-ra.hp and so on, most of them the same
+# in every slot. Now data_dir/<trigger_id>-slotMaps/ holds .npy files:
+#   ra, dec, x, y, map                           the full sky, stored once
+#   ha, hx, hy, maglim, maglim-global, probMap   (slots x pixels)
+#   mjd                                          the mjd of each slot
+#   made                                         the slot's row is written (sun down)
+# all float32, as hp.write_map wrote them, and memory mapped on read.
+# The slot rows are written in place, so pool workers can each write their own.
+#
+#   store = slotMaps.createSlotMaps(data_dir, trigger_id, obs, mjds)
+#   slotMaps.writeSlot(store, slot, obs.fullSkyMaps(conditions), probMap)
+#   slotMaps.setMade(store, made_slots)
+#   maps = slotMaps.readSlot(data_dir, trigger_id, slot)   # maps["maglim"] etc
+#
+# readSlot falls back to the .hp files of a directory made by older code.
+#
+staticMaps = ["ra", "dec", "x", "y", "map"]
+slotMaps   = ["ha", "hx", "hy", "maglim", "maglim-global", "probMap"]
+
+def slotMapsDir (data_dir, trigger_id) :
+    return os.path.join(data_dir, str(trigger_id) + "-slotMaps")
+
+def slotMapsFile (store, name) :
+    return os.path.join(store, name + ".npy")
+
+# a new, empty store for the slots at mjds, with the full sky maps of obs
+def createSlotMaps (data_dir, trigger_id, obs, mjds, dtype=np.float32) :
+    from equalArea import mcbryde
+    store = slotMapsDir(data_dir, trigger_id)
+    if os.path.exists(store) : shutil.rmtree(store)
+    os.makedirs(store)
+
+    # the written maps are full sky, even if obs is restricted to a working set
+    if obs.pixels is None :
+        ra, dec, map = obs.ra, obs.dec, obs.map
+    else :
+        ra, dec, map = obs.fullRa*obs.degToRad, obs.fullDec*obs.degToRad, obs.fullMap
+    x,y = mcbryde.mcbryde(ra/obs.degToRad, dec/obs.degToRad, alpha=obs.mcbryde_alpha)
+    for name, values in zip(staticMaps, [ra, dec, x, y, map]) :
+        np.save(slotMapsFile(store, name), np.asarray(values).astype(dtype))
+
+    shape = (len(mjds), ra.size)
+    for name in slotMaps :
+        np.lib.format.open_memmap(slotMapsFile(store, name), mode="w+",
+            dtype=dtype, shape=shape).flush()
+    np.save(slotMapsFile(store, "mjd"), np.asarray(mjds, dtype=np.float64))
+    np.save(slotMapsFile(store, "made"), np.zeros(len(mjds), dtype=bool))
+    return store
+
+# write the row of slot from the full sky maps (mags.observed.fullSkyMaps)
+# and probability map
+def writeSlot (store, slot, maps, probMap) :
+    values = dict(maps)
+    values["probMap"] = probMap
+    for name in slotMaps :
+        column = np.load(slotMapsFile(store, name), mmap_mode="r+")
+        column[slot] = values[name]
+        column.flush()
+        del column
+
+# mark the slots whose rows were written
+def setMade (store, slots) :
+    made = np.load(slotMapsFile(store, "made"))
+    made[np.asarray(slots, dtype=int)] = True
+    np.save(slotMapsFile(store, "made"), made)
+
+# the slots of the store whose rows were written
+def madeSlots (data_dir, trigger_id) :
+    file = slotMapsFile(slotMapsDir(data_dir, trigger_id), "made")
+    if not os.path.exists(file) : return np.zeros(0, dtype=int)
+    return np.nonzero(np.load(file))[0]
+
+# the maps of a slot, by name; memory mapped rows of the store,
+# or the <trigger_id>-<slot>-<name>.hp files if the store does not have the slot
+def readSlot (data_dir, trigger_id, slot) :
+    store = slotMapsDir(data_dir, trigger_id)
+    if slot in madeSlots(data_dir, trigger_id) :
+        maps = dict()
+        for name in staticMaps :
+            maps[name] = np.load(slotMapsFile(store, name), mmap_mode="r")
+        for name in slotMaps :
+            maps[name] = np.load(slotMapsFile(store, name), mmap_mode="r")[slot]
+        return maps
+
+    import healpy as hp
+    name = os.path.join(data_dir, str(trigger_id) + "-"+str(slot))
+    maps = dict()
+    for map_name in staticMaps + slotMaps :
+        maps[map_name] = hp.read_map(name+"-"+map_name+".hp", verbose=False)
+    return maps
+
@@ -172,3 +172,113 @@ def tree (ha, dec) :
     tree = cKDTree(coords)
     return tree
 
+
+#
+# A Blanco slew model.
+#
+# The Blanco is on an equatorial mount: the HA and Dec axes slew at once,
+# each speeding up to its top rate and slowing down again, and the slew is
+# done when the slower axis is; then the telescope settles. Between two
+# exposures DECam reads out, then the telescope slews if the next exposure
+# is elsewhere. The rates are a model, not a measurement, set so that the
+# move to a neighbouring hex costs the 30 seconds of the flat overhead
+# of gw_map_configure.strategy.
+#
+blancoSlewRate  = 0.75   ;# deg/s, top rate of each axis
+blancoSlewAccel = 0.25   ;# deg/s^2
+blancoSettle    = 4.     ;# s
+decamReadout    = 20.    ;# s
+decamHexSpacing = 2.2    ;# deg, between neighbouring hexes of a tiling
+
+# seconds for one axis to move d degrees
+def axisSlewTime (d, rate=blancoSlewRate, accel=blancoSlewAccel) :
+    d = np.abs(d)
+    # the degrees covered speeding up to the top rate and slowing down
+    ramp = rate*rate/accel
+    return np.where(d < ramp, 2*np.sqrt(d/accel), d/rate + rate/accel)
+
+# seconds to slew and settle from (ha1,dec1) to (ha2,dec2), in degrees
+def blancoSlewTime (ha1, dec1, ha2, dec2) :
+    time = np.maximum(axisSlewTime(ha2-ha1), axisSlewTime(dec2-dec1))
+    return np.where(time > 0, time + blancoSettle, 0.)
+
+# seconds between an exposure and the next, at a hex distance degrees away
+def blancoOverhead (distance=decamHexSpacing) :
+    return decamReadout + blancoSlewTime(0., 0., 0., distance)
+
+# seconds to observe n hexes, each with the exposures of exposure_list, in
+# ntilings passes of slews seconds of slewing each: every exposure is read
+# out, then the telescope slews on. obsSlots.slotDuration (a neighbour's slew
+# per hex) and the slew ordered slots of getHexObservations both use it.
+def decamVisitsTime (n, exposure_list, ntilings=1, slews=0.) :
+    visit = np.sum(exposure_list) + np.size(exposure_list)*decamReadout
+    return ntilings*(n*visit + slews)
+
+# the hour angle, degrees, of ra at mjd at the camera's site
+def hourAngle (ra, mjd, camera="decam") :
+    from pyslalib import slalib
+    import mags
+    lat, lon, height = mags.observatorySite(camera)
+    lon = lon*2*np.pi/360.
+    lst = (slalib.sla_gmst(mjd) + slalib.sla_eqeqx(mjd) + lon)*360./2/np.pi
+    ha = (lst - np.asarray(ra)) % 360.
+    return np.where(ha > 180., ha - 360., ha)
+
+#
+# The order of the hexes at ha,dec (degrees) that slews least, as an open
+# path from start (an ha,dec), or from whichever hex is best if start is
+# None: nearest neighbour, then 2-opt (reverse a stretch of the path while
+# that shortens it). A slot holds a handful of hexes, so this is quick.
+#
+def slewTour (ha, dec, start=None) :
+    ha, dec = np.asarray(ha, dtype=float), np.asarray(dec, dtype=float)
+    n = ha.size
+    if n <= 1 : return np.arange(n)
+    cost = blancoSlewTime(ha[:,np.newaxis], dec[:,np.newaxis], ha[np.newaxis,:], dec[np.newaxis,:])
+    if start is None :
+        first = np.zeros(n)
+        starts = range(0,n)
+    else :
+        first = blancoSlewTime(start[0], start[1], ha, dec)
+        starts = [np.argmin(first)]
+
+    best = None
+    for s in starts :
+        order = [s]
+        left = np.ones(n, dtype=bool)
+        left[s] = False
+        for i in range(1,n) :
+            candidates, = np.nonzero(left)
+            next = candidates[np.argmin(cost[order[-1], candidates])]
+            order.append(next)
+            left[next] = False
+        order = np.array(order)
+        if best is None or tourSlewTime(order, cost, first) < tourSlewTime(best, cost, first) :
+            best = order
+    order = best
+
+    improved = True
+    while improved :
+        improved = False
+        for i in range(0,n-1) :
+            for j in range(i+1,n) :
+                if i == 0 : before, before_new = first[order[i]], first[order[j]]
+                else : before, before_new = cost[order[i-1],order[i]], cost[order[i-1],order[j]]
+                if j == n-1 : after, after_new = 0., 0.
+                else : after, after_new = cost[order[j],order[j+1]], cost[order[i],order[j+1]]
+                if before_new + after_new < before + after - 1e-9 :
+                    order[i:j+1] = order[i:j+1][::-1]
+                    improved = True
+    return order
+
+# seconds of slewing along order, given the hex to hex cost and the first slew
+def tourSlewTime (order, cost, first) :
+    return first[order[0]] + cost[order[:-1], order[1:]].sum()
+
+# seconds of slewing to visit ha,dec (degrees) in turn, from start if given
+def pathSlewTime (ha, dec, start=None) :
+    ha, dec = np.asarray(ha, dtype=float), np.asarray(dec, dtype=float)
+    time = blancoSlewTime(ha[:-1], dec[:-1], ha[1:], dec[1:]).sum()
+    if start is not None and ha.size > 0 :
+        time += blancoSlewTime(start[0], start[1], ha[0], dec[0])
+    return float(time)
@@ -262,6 +262,19 @@ class event:
         gw_map_control  = gw_map_configure.control( resolution, outputDir, debug, 
                                                     allSky=allSky, snarf_mi_maps=snarf_mi_maps, mi_map_dir = mi_map_dir,
                                                     gif_resolution = gif_resolution)
+        gw_map_control.footprint = config.get("footprint", "flat")
+        gw_map_control.credible_level = config.get("credible_level", 1.0)
+        gw_map_control.n_workers = config.get("n_workers", 1)
+        gw_map_control.slot_cache_spill = config.get("slot_cache_spill", False)
+        gw_map_control.conditions_cache = config.get("conditions_cache", False)
+        gw_map_control.scheduler = config.get("scheduler", "greedy")
+        gw_map_control.slew_order = config.get("slew_order", False)
+        gw_map_control.visits = config.get("visits", False)
+        gw_map_control.min_revisit = config.get("min_revisit", 0.)
+        gw_map_control.multires = config.get("multires", False)
+        gw_map_control.multires_nside = config.get("multires_nside", 32)
+        gw_map_control.multires_fraction = config.get("multires_fraction", 1e-4)
+        gw_map_control.multires_validate = config.get("multires_validate", False)
         gw_map_trigger  = gw_map_configure.trigger( skymap, trigger_id, trigger_type, 
                                                     resolution, days_since_burst=days_since_burst)
         ##ag test jul 30
@@ -274,6 +287,21 @@ class event:
         
         if not os.path.exists(outputDir): os.makedirs(outputDir)
         
+        if config.get("campaign", False) :
+            # plan the night of every epoch of the trigger type, each in outputDir/epoch<k>/
+            if trigger_type == "hasrem" : epoch_type = "NS"
+            else : epoch_type = "BH"
+            epochs = []
+            for i in range(1, config["nepochs_"+epoch_type]+1) :
+                key = "epoch{}_{}".format(i, epoch_type)
+                if key in config : epochs.append(config[key])
+            nights = getHexObservations.make_campaign(
+                gw_map_trigger, gw_map_strategy, gw_map_control, epochs)
+            if do_make_jsons :
+                for night_trigger, night_control, night_results in nights :
+                    getHexObservations.make_jsons( night_trigger, gw_map_strategy, night_control, night_results)
+            do_make_maps, do_make_hexes, do_make_jsons, do_make_gifs = False, False, False, False
+
         if do_make_maps :
             # make the computationally expensive maps of everything
             getHexObservations.make_maps( 